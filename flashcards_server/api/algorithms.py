@@ -1,7 +1,6 @@
 from typing import List
 
 from fastapi import APIRouter, Depends
-from flashcards_core.schedulers import get_available_schedulers
 from flashcards_server.schemas import UserRead
 from flashcards_server.users import current_active_user
 
@@ -20,4 +19,8 @@ def get_algorithms(
     limit: int = 100, 
     current_user: UserRead = Depends(current_active_user)
 ):
+    # Imported here: the schedulers pull in their numeric libraries, which
+    # would slow down the startup of every worker
+    from flashcards_core.schedulers import get_available_schedulers
+
     return get_available_schedulers()
@@ -0,0 +1,251 @@
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.dependencies.utils import request_body_to_args, request_params_to_args
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from fastapi.routing import APIRoute, serialize_response
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+from starlette.datastructures import QueryParams
+from starlette.routing import Match
+
+from flashcards_server.constants import BATCH_MAX_OPERATIONS
+from flashcards_server.database import (
+    BatchSession,
+    get_async_session,
+    session_maker_like,
+)
+from flashcards_server.users import current_active_user
+from flashcards_server.schemas import UserRead
+
+
+class BatchOperation(BaseModel):
+    #: Name of the operation, to reference its result in later operations
+    id: Optional[str]
+    method: str
+    path: str
+    query: Optional[Dict[str, Any]]
+    body: Optional[Any]
+
+
+class BatchResult(BaseModel):
+    id: Optional[str]
+    status: int
+    body: Any
+
+
+#: A reference to the result of an earlier operation, like ``$question.id``
+_REFERENCE = re.compile(r"\$(\w+)((?:\.\w+)+)")
+
+#: The dependencies batched routes can have: the batch provides both
+_BATCH_DEPENDENCIES = {current_active_user, get_async_session}
+
+
+router = APIRouter(
+    prefix="/batch",
+    tags=["batch"],
+    responses={404: {"description": "Not found"}},
+)
+
+
+def _resolve(match: re.Match, results: Dict[str, Any]) -> Any:
+    """
+    The value a reference points to, in the results of the earlier operations.
+    """
+    name, fields = match.group(1), match.group(2).split(".")[1:]
+    if name not in results:
+        raise ValueError(f"'{match.group(0)}' refers to no earlier operation")
+    value = results[name]
+    for field in fields:
+        try:
+            value = value[int(field)] if isinstance(value, list) else value[field]
+        except (IndexError, KeyError, TypeError, ValueError):
+            raise ValueError(f"'{match.group(0)}' is not in the result of '{name}'")
+    return value
+
+
+def _substitute(value: Any, results: Dict[str, Any]) -> Any:
+    """
+    Replaces the references in this value, recursively. A string that is only
+    a reference is replaced by the value itself, which may not be a string.
+    """
+    if isinstance(value, dict):
+        return {key: _substitute(item, results) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_substitute(item, results) for item in value]
+    if isinstance(value, str):
+        match = _REFERENCE.fullmatch(value)
+        if match:
+            return _resolve(match, results)
+        return _REFERENCE.sub(lambda match: str(_resolve(match, results)), value)
+    return value
+
+
+def _batchable(route: APIRoute) -> bool:
+    """
+    Whether the batch can call this route: it must need nothing else than
+    the user and the session, besides its parameters.
+    """
+    dependant = route.dependant
+    return not dependant.background_tasks_param_name and all(
+        dependency.call in _BATCH_DEPENDENCIES for dependency in dependant.dependencies
+    )
+
+
+def _operation_request(operation: BatchOperation) -> Request:
+    """
+    The request the route of an operation sees: it has no headers, so
+    operations don't take the Idempotency-Key or If-None-Match of the batch.
+    """
+    return Request(
+        {
+            "type": "http",
+            "method": operation.method.upper(),
+            "path": operation.path,
+            "root_path": "",
+            "headers": [],
+            "query_string": str(QueryParams(operation.query or {})).encode(),
+        }
+    )
+
+
+def _find_route(
+    request: Request, method: str, path: str
+) -> Tuple[APIRoute, Dict[str, Any]]:
+    """
+    The route of the app that serves this operation, and its path parameters.
+    """
+    scope = {"type": "http", "method": method.upper(), "path": path, "root_path": ""}
+    for route in request.app.routes:
+        if not isinstance(route, APIRoute):
+            continue
+        match, child_scope = route.matches(scope)
+        if match == Match.FULL:
+            if not _batchable(route):
+                raise HTTPException(
+                    status_code=400, detail=f"{method.upper()} {path} can't be batched"
+                )
+            return route, child_scope["path_params"]
+    raise HTTPException(status_code=404, detail=f"No route for {method.upper()} {path}")
+
+
+async def _run_operation(
+    route: APIRoute,
+    path_params: Dict[str, Any],
+    operation: BatchOperation,
+    user: UserRead,
+    session: BatchSession,
+) -> Tuple[int, Any]:
+    """
+    Validates the parameters of the operation like FastAPI does, and calls
+    the endpoint of its route.
+
+    :returns: the status code and the serialized response.
+    """
+    dependant = route.dependant
+    path_values, errors = request_params_to_args(dependant.path_params, path_params)
+    query_values, query_errors = request_params_to_args(
+        dependant.query_params, QueryParams(operation.query or {})
+    )
+    errors += query_errors
+    body_values = {}
+    if dependant.body_params:
+        body_values, body_errors = await request_body_to_args(
+            dependant.body_params, operation.body
+        )
+        errors += body_errors
+    if errors:
+        raise HTTPException(
+            status_code=422,
+            detail=jsonable_encoder(RequestValidationError(errors).errors()),
+        )
+
+    kwargs = {**path_values, **query_values, **body_values}
+    if dependant.request_param_name:
+        kwargs[dependant.request_param_name] = _operation_request(operation)
+    if dependant.response_param_name:
+        # Its headers, like the ETag, are dropped: the batch has one response
+        kwargs[dependant.response_param_name] = Response()
+    for dependency in dependant.dependencies:
+        if dependency.call is current_active_user:
+            kwargs[dependency.name] = user
+        else:
+            kwargs[dependency.name] = session
+
+    content = await route.endpoint(**kwargs)
+    if isinstance(content, Response):
+        return content.status_code, None
+    body = await serialize_response(
+        field=route.response_field, response_content=content
+    )
+    return route.status_code or 200, jsonable_encoder(body)
+
+
+@router.post("", response_model=List[BatchResult])
+async def batch(
+    operations: List[BatchOperation],
+    request: Request,
+    current_user: UserRead = Depends(current_active_user),
+    session: Session = Depends(get_async_session),
+):
+    """
+    Runs a list of operations in order, in one transaction: either all of
+    them are saved, or none is.
+
+    Each operation is a call to a route of the API, like ``{"method": "post",
+    "path": "/facts/", "body": {...}}``. Operations with an ``id`` can be
+    referenced by the later ones, in their path, query or body: for example,
+    ``"$question.id"`` is the ID in the result of the operation ``question``.
+
+    If an operation fails, the batch fails with its status code, and the
+    detail gives the index of the operation and its error.
+
+    :param operations: the operations to run.
+    :returns: The status code and the result of each operation.
+    """
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"A batch can have up to {BATCH_MAX_OPERATIONS} operations",
+        )
+    results: Dict[str, Any] = {}
+    responses = []
+    # Authenticating may have taken a connection: give it back first, as in
+    # SQLite WAL mode the batch needs the only writer connection
+    await session.close()
+    async with session_maker_like(session, class_=BatchSession)() as batch_session:
+        for index, operation in enumerate(operations):
+            try:
+                try:
+                    path = _substitute(operation.path, results)
+                    operation = operation.copy(
+                        update={
+                            "path": path,
+                            "query": _substitute(operation.query, results),
+                            "body": _substitute(operation.body, results),
+                        }
+                    )
+                except ValueError as exc:
+                    raise HTTPException(status_code=400, detail=str(exc))
+                route, path_params = _find_route(request, operation.method, path)
+                status, body = await _run_operation(
+                    route, path_params, operation, current_user, batch_session
+                )
+                if batch_session.rolled_back:
+                    raise HTTPException(
+                        status_code=409,
+                        detail="The operation rolled back the transaction",
+                    )
+            except HTTPException as exc:
+                await batch_session.rollback()
+                raise HTTPException(
+                    status_code=exc.status_code,
+                    detail={"operation": index, "detail": exc.detail},
+                )
+            if operation.id is not None:
+                results[operation.id] = body
+            responses.append(BatchResult(id=operation.id, status=status, body=body))
+        await batch_session.commit_batch()
+    return responses
@@ -2,21 +2,27 @@ from typing import Any, List, Optional
 
 from uuid import UUID
 from datetime import datetime
-from fastapi import Depends, HTTPException
+from fastapi import Depends, HTTPException, Query, Request, Response
 from sqlalchemy import select
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
 from pydantic import BaseModel
 
+from flashcards_server.archive import with_archived_reviews
+from flashcards_server.constants import MAX_PAGE_SIZE
 from flashcards_server.database import (
     get_async_session,
+    load_related,
     Card as CardModel,
     Tag as TagModel,
-    Fact as FactModel,
+    Review as ReviewModel,
 )
+from flashcards_server.idempotency import run_idempotently
 from flashcards_server.api.decks import router, valid_deck
-from flashcards_server.api.facts import FactRead
+from flashcards_server.api.facts import FACT_LOAD_OPTIONS, FactRead, fact_loader
 from flashcards_server.api.tags import TagRead, TagCreate
+from flashcards_server.loaders import loader
 from flashcards_server.users import current_active_user
+from flashcards_server.versions import etag, get_version, is_not_modified
 from flashcards_server.schemas import UserRead
 
 
@@ -85,6 +91,20 @@ class Review(BaseModel):
         orm_mode = True
 
 
+def _with_facts(relationship) -> list:
+    return [selectinload(relationship).options(*FACT_LOAD_OPTIONS)]
+
+
+#: Loads what CardRead shows of a card, in a constant number of queries
+CARD_LOAD_OPTIONS = [
+    *_with_facts(CardModel.question),
+    *_with_facts(CardModel.answer),
+    *_with_facts(CardModel.question_context_facts),
+    *_with_facts(CardModel.answer_context_facts),
+    selectinload(CardModel.tags),
+]
+
+
 async def valid_card(
     session: Session, user: UserRead, deck_id: UUID, card_id: UUID
 ) -> CardModel:
@@ -96,8 +116,8 @@ async def valid_card(
     :returns: the card, if all check passes.
     :raises HTTPException if any check fails
     """
-    valid_deck(session=session, user=user, deck_id=deck_id)
-    card = await CardModel.get_one_async(session=session, object_id=card_id)
+    await valid_deck(session=session, user=user, deck_id=deck_id)
+    card = await session.get(CardModel, card_id)
     if card is None or card.deck_id != deck_id:
         raise HTTPException(
             status_code=404, detail=f"Card with ID '{card_id}' not found"
@@ -108,32 +128,40 @@ async def valid_card(
 @router.get("/{deck_id}/cards", response_model=List[CardRead])
 async def get_cards(
     deck_id: UUID,
-    offset: int = 0,
-    limit: int = 100,
+    request: Request,
+    response: Response,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=0, le=MAX_PAGE_SIZE),
     current_user: UserRead = Depends(current_active_user),
     session: Session = Depends(get_async_session),
 ):
     """
     Get all the cards for a deck (paginated, if needed).
 
+    Supports conditional requests: send back the ETag in If-None-Match to
+    get a 304 if no card changed.
+
     :param deck_id: the id of the deck this card belongs to
     :param offset: for pagination, index at which to start returning cards.
     :param limit: for pagination, maximum number of cards to return.
     :returns: List of cards.
     """
-    valid_deck(session=session, user=current_user, deck_id=deck_id)
+    version = await get_version(session=session, entity="cards", entity_id=deck_id)
+    response.headers["ETag"] = etag("cards", deck_id, version)
+    if is_not_modified(request, response.headers["ETag"]):
+        # The ownership check is cached: no need to load the deck
+        if await current_user.owns_deck(session=session, deck_id=deck_id):
+            return Response(status_code=304, headers={"ETag": response.headers["ETag"]})
+    await valid_deck(session=session, user=current_user, deck_id=deck_id)
     stmt = (
         select(CardModel)
         .where(CardModel.deck_id == deck_id)
+        .options(*CARD_LOAD_OPTIONS)
         .offset(offset)
         .limit(limit)
     )
-    results = await session.scalars(stmt)
-    db_cards = results.all()
-    cards = []
-    for card in db_cards:
-        card.related = await card.related_cards_async(session)
-        cards.append(card)
+    cards = (await session.scalars(stmt)).all()
+    await load_related(session=session, objects=cards, options=CARD_LOAD_OPTIONS)
     return cards
 
 
@@ -162,51 +190,68 @@ async def get_card(
 async def create_card(
     deck_id: UUID,
     card: CardCreate,
+    request: Request,
     current_user: UserRead = Depends(current_active_user),
     session: Session = Depends(get_async_session),
 ):
     """
     Creates a new card with the given data.
 
+    Send a unique Idempotency-Key header to retry safely: the card is
+    created once, and the retries get the same card.
+
     :param deck_id: the id of the deck this card will belong to
     :param card: the details of the new card.
     :returns: The new card
     """
-    valid_deck(session=session, user=current_user, deck_id=deck_id)
-
-    card_data = card.dict()
-    card_data["deck_id"] = deck_id
-    tags = card_data.pop("tags", [])
-    question_context = card_data.pop("question_context_facts", [])
-    answer_context = card_data.pop("answer_context_facts", [])
-    new_card = await CardModel.create_async(session=session, **card_data)
-
-    if tags:
-        for tag in tags:
-            tag_object = await TagModel.get_by_name_async(session=session, name=tag["name"])
-            if not tag_object:
-                tag_object = await TagModel.create_async(session=session, name=tag["name"])
-            new_card.assign_tag(session=session, tag_id=tag_object.id)
 
-    if question_context:
-        for fact in question_context:
-            fact_object = await FactModel.get_one_async(session=session, object_id=fact)
-            if not fact_object:
-                raise HTTPException(
-                    status_code=404, detail=f"Fact with ID '{fact}' not found"
-                )
-            new_card.assign_question_context(session=session, fact_id=fact)
+    async def create(session: Session):
+        await valid_deck(session=session, user=current_user, deck_id=deck_id)
 
-    if answer_context:
-        for fact in answer_context:
-            fact_object = await FactModel.get_one_async(session=session, object_id=fact)
+        card_data = card.dict()
+        card_data["deck_id"] = deck_id
+        tags = card_data.pop("tags", None) or []
+        question_context = card_data.pop("question_context_facts", None) or []
+        answer_context = card_data.pop("answer_context_facts", None) or []
+
+        # All the context facts in one query, checked before creating anything
+        context_facts = question_context + answer_context
+        fact_objects = await fact_loader(session).load_many(context_facts)
+        for fact, fact_object in zip(context_facts, fact_objects):
             if not fact_object:
                 raise HTTPException(
                     status_code=404, detail=f"Fact with ID '{fact}' not found"
                 )
-            new_card.assign_answer_context(session=session, fact_id=fact)
+        new_card = await CardModel.create_async(session=session, **card_data)
+
+        names = list(dict.fromkeys(tag["name"] for tag in tags))
+        tag_objects = await loader(session, TagModel, TagModel.name).load_many(names)
+        for name, tag_object in zip(names, tag_objects):
+            if not tag_object:
+                tag_object = await TagModel.create_async(session=session, name=name)
+            await session.run_sync(new_card.assign_tag, tag_id=tag_object.id)
 
-    return new_card
+        for fact in question_context:
+            await session.run_sync(new_card.assign_question_context, fact_id=fact)
+        for fact in answer_context:
+            await session.run_sync(new_card.assign_answer_context, fact_id=fact)
+
+        # The assignments don't update the relationships loaded on creation
+        stmt = (
+            select(CardModel)
+            .where(CardModel.id == new_card.id)
+            .options(*CARD_LOAD_OPTIONS)
+            .execution_options(populate_existing=True)
+        )
+        return (await session.scalars(stmt)).one()
+
+    return await run_idempotently(
+        request=request,
+        session=session,
+        user_id=current_user.id,
+        run=create,
+        schema=CardRead,
+    )
 
 
 @router.patch("/{deck_id}/cards/{card_id}", response_model=CardRead)
@@ -225,7 +270,9 @@ async def edit_card(
     :param new_card_data: the new details of the card. Can be partial.
     :returns: The modified card
     """
-    original_data = valid_card(session=session, deck_id=deck_id, card_id=card_id)
+    original_data = await valid_card(
+        session=session, user=current_user, deck_id=deck_id, card_id=card_id
+    )
 
     update_data = new_card_data.dict(exclude_unset=True)
     new_model = CardCreate(**vars(original_data)).copy(update=update_data)
@@ -244,16 +291,16 @@ async def get_reviews(
     session: Session = Depends(get_async_session),
 ):
     """
-    Get all the reviews done on this card.
+    Get all the reviews done on this card, archived ones included.
 
     :param deck_id: the id of the deck this card belongs to
     :param card_id: the id of the card to get the reviews of
-    :returns: The reviews of the card.
+    :returns: The reviews of the card, oldest first.
     """
-    card = await valid_card(
-        session=session, user=current_user, deck_id=deck_id, card_id=card_id
-    )
-    return card.reviews
+    await valid_card(session=session, user=current_user, deck_id=deck_id, card_id=card_id)
+    select_reviews = select(ReviewModel).where(ReviewModel.card_id == card_id)
+    reviews = (await session.scalars(select_reviews)).all()
+    return await with_archived_reviews(session=session, card_id=card_id, reviews=reviews)
 
 
 @router.put("/{deck_id}/cards/{card_id}/tags/{tag_name}", response_model=CardRead)
@@ -275,7 +322,7 @@ async def assign_tag_to_card(
     card = await valid_card(
         session=session, user=current_user, deck_id=deck_id, card_id=card_id
     )
-    tag = await TagModel.get_by_name_async(session=session, name=tag["name"])
+    tag = await loader(session, TagModel, TagModel.name).load(tag_name)
     if not tag:
         tag = await TagModel.create_async(session=session, name=tag_name)
     card.assign_tag(session=session, tag_id=tag.id)
@@ -300,7 +347,7 @@ async def remove_tag_from_card(
     card = await valid_card(
         session=session, user=current_user, deck_id=deck_id, card_id=card_id
     )
-    tag = await TagModel.get_by_name_async(session=session, name=tag["name"])
+    tag = await loader(session, TagModel, TagModel.name).load(tag_name)
     if not tag:
         raise HTTPException(status_code=404, detail=f"Tag '{tag_name}' doesn't exist.")
     card.remove_tag(session=session, tag_id=tag.id)
@@ -327,7 +374,7 @@ async def assign_question_context_to_card(
     card = await valid_card(
         session=session, user=current_user, deck_id=deck_id, card_id=card_id
     )
-    fact = await FactModel.get_one_async(session=session, object_id=fact_id)
+    fact = await fact_loader(session).load(fact_id)
     if not fact:
         raise HTTPException(
             status_code=404, detail=f"Fact with ID '{fact_id}' doesn't exist."
@@ -356,7 +403,7 @@ async def remove_question_context_from_card(
     card = await valid_card(
         session=session, user=current_user, deck_id=deck_id, card_id=card_id
     )
-    fact = await FactModel.get_one_async(session=session, object_id=fact_id)
+    fact = await fact_loader(session).load(fact_id)
     if not fact:
         raise HTTPException(
             status_code=404, detail=f"Fact with ID '{fact_id}' doesn't exist."
@@ -383,7 +430,7 @@ async def assign_answer_context_to_card(
     card = await valid_card(
         session=session, user=current_user, deck_id=deck_id, card_id=card_id
     )
-    fact = await FactModel.get_one_async(session=session, object_id=fact_id)
+    fact = await fact_loader(session).load(fact_id)
     if not fact:
         raise HTTPException(
             status_code=404, detail=f"Fact with ID '{fact_id}' doesn't exist."
@@ -412,7 +459,7 @@ async def remove_answer_context_from_card(
     card = await valid_card(
         session=session, user=current_user, deck_id=deck_id, card_id=card_id
     )
-    fact = await FactModel.get_one_async(session=session, object_id=fact_id)
+    fact = await fact_loader(session).load(fact_id)
     if not fact:
         raise HTTPException(
             status_code=404, detail=f"Fact with ID '{fact_id}' doesn't exist."
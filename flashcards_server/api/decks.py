@@ -1,16 +1,27 @@
-from typing import List, Optional
+import asyncio
+import json
+from typing import AsyncGenerator, List, Optional
 
 from uuid import UUID
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 
+from flashcards_server.card_states import load_card_states
+from flashcards_server.constants import EVENTS_KEEPALIVE_SECONDS, MAX_PAGE_SIZE
 from flashcards_server.database import (
     get_async_session,
+    get_live_deck,
+    purge_deck,
+    session_maker_like,
     Deck as DeckModel,
     Tag as TagModel
 )
+from flashcards_server.events import RESYNC, Subscriber, event_hubs, replay_events
 from flashcards_server.users import current_active_user
+from flashcards_server.versions import etag, get_version, is_not_modified
 from flashcards_server.schemas import UserRead
 from flashcards_server.api.tags import TagRead, TagCreate
 
@@ -51,12 +62,19 @@ async def valid_deck(
     """
     Check that the deck actually exists and belongs to the current user.
 
+    Ownership checks are cached (see ``User.owns_deck``) and the deck is
+    remembered by the session (see ``get_live_deck``), so calling this several
+    times during the same request costs at most one query. Decks marked as
+    deleted are never returned.
+
     :param deck_id: the ID of the deck to test.
     :returns: the deck object, if all checks passes.
     :raises: HTTPException is any check fails.
     """
-    deck = DeckModel.get_one(session=session, object_id=deck_id)
-    if not deck or not user.owns_deck(session=session, deck_id=deck_id):
+    deck = None
+    if await user.owns_deck(session=session, deck_id=deck_id):
+        deck = await get_live_deck(session=session, deck_id=deck_id)
+    if not deck:
         raise HTTPException(
             status_code=404, detail=f"Deck with ID '{deck_id}' not found"
         )
@@ -73,10 +91,30 @@ router = APIRouter(
 
 @router.get("", response_model=List[DeckRead])
 async def get_my_decks(
+    request: Request,
+    response: Response,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=0, le=MAX_PAGE_SIZE),
     current_user: UserRead = Depends(current_active_user),
     session: Session = Depends(get_async_session),
 ):
-    return await current_user.get_decks(session=session)
+    """
+    Get all the decks of the current user (paginated, if needed).
+
+    Supports conditional requests: send back the ETag in If-None-Match to
+    get a 304 if nothing changed.
+
+    :param offset: for pagination, index at which to start returning decks.
+    :param limit: for pagination, maximum number of decks to return.
+    :returns: List of decks, with their tags.
+    """
+    version = await get_version(session=session, entity="decks", entity_id=current_user.id)
+    response.headers["ETag"] = etag("decks", current_user.id, version)
+    if is_not_modified(request, response.headers["ETag"]):
+        return Response(status_code=304, headers={"ETag": response.headers["ETag"]})
+    decks = await current_user.get_decks(session=session, offset=offset, limit=limit)
+    await load_card_states(session=session, decks=decks)
+    return decks
 
 
 @router.get("/{deck_id}", response_model=DeckRead)
@@ -91,7 +129,104 @@ async def get_deck(
     :param deck_id: the id of the deck to get
     :returns: The details of the deck. Cards list not included, use ``/deck/<uuid>/cards``
     """
-    return await valid_deck(session=session, user=current_user, deck_id=deck_id)
+    deck = await valid_deck(session=session, user=current_user, deck_id=deck_id)
+    await load_card_states(session=session, decks=[deck])
+    return deck
+
+
+@router.get("/{deck_id}/events")
+async def get_deck_events(
+    deck_id: UUID,
+    request: Request,
+    current_user: UserRead = Depends(current_active_user),
+    session: Session = Depends(get_async_session),
+):
+    """
+    Stream the changes to the deck, its cards, their facts and tags, and the
+    reviews, as server-sent events, instead of polling for them.
+
+    Each change is a ``change`` event, with ``{"entity": "card", "id": ...,
+    "op": "create"}`` as data: fetch the object to get its new state. The
+    stream ends after the deck is deleted.
+
+    A ``resync`` event means some changes were missed, for example because
+    the client didn't keep up: fetch the deck and its cards again. Clients
+    reconnecting with a Last-Event-ID header get the changes they missed
+    meanwhile, or a ``resync`` event.
+
+    :param deck_id: the id of the deck to follow
+    :returns: The stream of events, as text/event-stream.
+    """
+    await valid_deck(session=session, user=current_user, deck_id=deck_id)
+    if len(event_hubs) >= event_hubs.max_streams:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many event streams, please retry later.",
+            headers={"Retry-After": "5"},
+        )
+    subscriber = await event_hubs.subscribe(
+        session=session, deck_id=deck_id, user_id=current_user.id
+    )
+    try:
+        replayed = []
+        last_event_id = request.headers.get("Last-Event-ID")
+        if last_event_id is not None and last_event_id.isdigit():
+            replayed = await replay_events(
+                session=session,
+                deck_id=deck_id,
+                user_id=current_user.id,
+                since=int(last_event_id),
+            )
+            if replayed is None:
+                replayed = [{"seq": int(last_event_id), "event": RESYNC}]
+        # Don't keep a connection for the lifetime of the stream
+        await session.close()
+    except BaseException:
+        event_hubs.unsubscribe(session=session, subscriber=subscriber)
+        raise
+    return StreamingResponse(
+        _stream_events(session=session, subscriber=subscriber, replayed=replayed),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _format_event(deck_event: dict) -> str:
+    if deck_event.get("event") == RESYNC:
+        return f"id: {deck_event['seq']}\nevent: {RESYNC}\ndata: {{}}\n\n"
+    data = json.dumps(jsonable_encoder({key: deck_event[key] for key in ("entity", "id", "op")}))
+    return f"id: {deck_event['seq']}\nevent: change\ndata: {data}\n\n"
+
+
+async def _stream_events(
+    session: Session, subscriber: Subscriber, replayed: List[dict]
+) -> AsyncGenerator[str, None]:
+    """
+    Yields the replayed events, then the new ones as they come, until the
+    deck is deleted or the client disconnects.
+    """
+    last_seq = 0
+    try:
+        yield ": connected\n\n"
+        for deck_event in replayed:
+            last_seq = deck_event["seq"]
+            yield _format_event(deck_event)
+        while True:
+            try:
+                deck_event = await asyncio.wait_for(
+                    subscriber.queue.get(), EVENTS_KEEPALIVE_SECONDS
+                )
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if deck_event["seq"] <= last_seq:
+                continue  # Already replayed
+            last_seq = deck_event["seq"]
+            yield _format_event(deck_event)
+            if deck_event.get("entity") == "deck" and deck_event.get("op") == "delete":
+                return
+    finally:
+        event_hubs.unsubscribe(session=session, subscriber=subscriber)
 
 
 @router.post("/", response_model=DeckRead)
@@ -120,6 +255,63 @@ async def create_deck(
     return new_deck
 
 
+@router.post("/{deck_id}/clone", response_model=DeckRead)
+async def clone_deck(
+    deck_id: UUID,
+    current_user: UserRead = Depends(current_active_user),
+    session: Session = Depends(get_async_session),
+):
+    """
+    Creates a copy of the given deck for the current user. The deck must be
+    one of theirs, or one shared by its owner (see ``share_deck``).
+
+    The cards of the copy share their facts with the original deck until they
+    are edited. The copy starts with a fresh scheduler state and no reviews.
+
+    :param deck_id: the id of the deck to clone
+    :returns: The new deck
+    """
+    if not await current_user.can_clone_deck(session=session, deck_id=deck_id):
+        raise HTTPException(
+            status_code=404, detail=f"Deck with ID '{deck_id}' not found"
+        )
+    return await current_user.clone_deck(session=session, deck_id=deck_id)
+
+
+@router.put("/{deck_id}/shared", response_model=DeckRead)
+async def share_deck(
+    deck_id: UUID,
+    current_user: UserRead = Depends(current_active_user),
+    session: Session = Depends(get_async_session),
+):
+    """
+    Shares the given deck: every user can clone it, like a starter deck.
+
+    :param deck_id: the id of the deck to share
+    :returns: The deck
+    """
+    deck = await valid_deck(session=session, user=current_user, deck_id=deck_id)
+    await current_user.share_deck(session=session, deck_id=deck_id)
+    return deck
+
+
+@router.delete("/{deck_id}/shared", response_model=DeckRead)
+async def unshare_deck(
+    deck_id: UUID,
+    current_user: UserRead = Depends(current_active_user),
+    session: Session = Depends(get_async_session),
+):
+    """
+    Stops sharing the given deck. Its existing clones are left as they are.
+
+    :param deck_id: the id of the deck to stop sharing
+    :returns: The deck
+    """
+    deck = await valid_deck(session=session, user=current_user, deck_id=deck_id)
+    await current_user.share_deck(session=session, deck_id=deck_id, shared=False)
+    return deck
+
+
 @router.patch("/{deck_id}", response_model=DeckRead)
 async def edit_deck(
     deck_id: UUID,
@@ -135,6 +327,7 @@ async def edit_deck(
     :returns: The modified deck. Cards list not included, use ``/deck/<uuid>/cards``
     """
     deck_to_edit = await valid_deck(session=session, user=current_user, deck_id=deck_id)
+    await load_card_states(session=session, decks=[deck_to_edit])
 
     update_data = new_deck_data.dict(exclude_unset=True)
     tags = update_data.pop("tags", [])
@@ -157,14 +350,19 @@ async def edit_deck(
 @router.delete("/{deck_id}")
 async def delete_deck(
     deck_id: UUID,
+    background_tasks: BackgroundTasks,
     current_user: UserRead = Depends(current_active_user),
     session: Session = Depends(get_async_session),
 ):
     """
     Removes the given deck
 
+    The deck disappears immediately, while its cards, reviews and other
+    related data are deleted in the background.
+
     :param deck_id: the id of the deck to remove
     :returns: None
     """
-    valid_deck(session=session, user=current_user, deck_id=deck_id)
+    await valid_deck(session=session, user=current_user, deck_id=deck_id)
     await current_user.delete_deck(session=session, deck_id=deck_id)
+    background_tasks.add_task(purge_deck, deck_id, session_maker=session_maker_like(session))
@@ -1,18 +1,24 @@
 from typing import List, Optional
 
 from uuid import UUID
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy import select
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
 from pydantic import BaseModel
 
+from flashcards_server.constants import MAX_PAGE_SIZE
 from flashcards_server.database import (
+    SharedFactError,
     get_async_session,
+    load_related,
     Fact as FactModel,
     Tag as TagModel,
 )
+from flashcards_server.loaders import Loader, loader
 from flashcards_server.users import current_active_user
+from flashcards_server.versions import etag, get_version, is_not_modified
 from flashcards_server.schemas import UserRead
+from flashcards_server.api.decks import valid_deck
 from flashcards_server.api.tags import TagRead, TagCreate
 
 
@@ -49,6 +55,52 @@ class FactRead(FactBase):
         orm_mode = True
 
 
+#: Loads what FactRead shows of a fact, in a constant number of queries
+FACT_LOAD_OPTIONS = [selectinload(FactModel.tags)]
+
+
+def fact_loader(session: Session) -> Loader:
+    """
+    Loads facts by ID with what FactRead shows, batching the lookups.
+    """
+    return loader(session, FactModel, options=FACT_LOAD_OPTIONS)
+
+
+async def _fact_for_edit(
+    session: Session, user: UserRead, fact_id: UUID, deck_id: Optional[UUID]
+) -> FactModel:
+    """
+    The fact to change for this user, which may be a copy of the given one
+    (see ``User.fact_for_edit``).
+
+    :raises HTTPException: if the deck or the fact doesn't exist, or if the
+        fact is shared with other decks and can't be changed for this one.
+    """
+    if deck_id is not None:
+        await valid_deck(session=session, user=user, deck_id=deck_id)
+    try:
+        fact = await user.fact_for_edit(session=session, fact_id=fact_id, deck_id=deck_id)
+    except SharedFactError as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    if fact is None:
+        raise HTTPException(status_code=404, detail=f"Fact with ID '{fact_id}' not found")
+    return fact
+
+
+async def _related_fact(session: Session, related_fact_id: str) -> FactModel:
+    """
+    Loads the fact to relate to another one.
+
+    :raises HTTPException: if it doesn't exist.
+    """
+    fact = await fact_loader(session).load(related_fact_id)
+    if fact is None:
+        raise HTTPException(
+            status_code=404, detail=f"Fact with ID '{related_fact_id}' not found"
+        )
+    return fact
+
+
 router = APIRouter(
     prefix="/facts",
     tags=["facts"],
@@ -59,50 +111,73 @@ router = APIRouter(
 
 @router.get("/", response_model=List[FactRead])
 async def get_facts(
-    offset: int = 0,
-    limit: int = 100,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=0, le=MAX_PAGE_SIZE),
     current_user: UserRead = Depends(current_active_user),  # to protect endpoint
     session: Session = Depends(get_async_session),
 ):
     """
     Get all facts.
 
+    :param offset: for pagination, index at which to start returning values.
+    :param limit: for pagination, maximum number of elements to return.
     :returns: All the facts, paginated.
     """
-    results: List[FactModel] = await FactModel.get_all_async(session=session, offset=offset, limit=limit)
-    db_facts = []
-    for db_fact in results:
-        db_fact.related = await db_fact.related_facts_async(session)
-        db_facts.append(db_fact)
+    stmt = select(FactModel).options(*FACT_LOAD_OPTIONS).offset(offset).limit(limit)
+    db_facts = (await session.scalars(stmt)).all()
+    await load_related(session=session, objects=db_facts, options=FACT_LOAD_OPTIONS)
     return db_facts
 
 
+async def read_fact(session: Session, fact_id: UUID) -> FactModel:
+    """
+    Loads all the details of one fact, as the routes return it.
+
+    :param fact_id: the id of the fact to get
+    :returns: The fact, with its related facts.
+    :raises HTTPException: if the fact doesn't exist.
+    """
+    db_fact: FactModel = await fact_loader(session).load(fact_id)
+    if db_fact is None:
+        raise HTTPException(
+            status_code=404, detail=f"Fact with ID '{fact_id}' not found"
+        )
+    db_fact.related = await db_fact.related_facts_async(session)
+    return db_fact
+
+
 @router.get("/{fact_id}", response_model=FactRead)
 async def get_fact(
     fact_id: UUID,
+    request: Request,
+    response: Response,
     current_user: UserRead = Depends(current_active_user),  # to protect endpoint
     session: Session = Depends(get_async_session),
 ):
     """
     Get all the details of one fact.
 
+    Supports conditional requests: send back the ETag in If-None-Match to
+    get a 304 if the fact didn't change.
+
     :param fact_id: the id of the fact to get
     :returns: The details of the fact.
     """
-    db_fact: FactModel = await FactModel.get_one_async(session=session, object_id=fact_id)
-    db_fact.related = await db_fact.related_facts_async(session)
-    if db_fact is None:
-        raise HTTPException(
-            status_code=404, detail=f"Fact with ID '{fact_id}' not found"
-        )
-    return db_fact
+    version = await get_version(session=session, entity="fact", entity_id=fact_id)
+    response.headers["ETag"] = etag("fact", fact_id, version)
+    # Facts that don't exist have version 0 too
+    if is_not_modified(request, response.headers["ETag"]) and await session.scalar(
+        select(FactModel.id).where(FactModel.id == fact_id)
+    ):
+        return Response(status_code=304, headers={"ETag": response.headers["ETag"]})
+    return await read_fact(session=session, fact_id=fact_id)
 
 
 @router.get("/tag/{tag_name}", response_model=List[FactRead])
 async def get_facts_by_tag(
     tag_name: str,
-    offset: int = 0,
-    limit: int = 100,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=0, le=MAX_PAGE_SIZE),
     current_user: UserRead = Depends(current_active_user),  # to protect endpoint
     session: Session = Depends(get_async_session),
 ):
@@ -117,15 +192,13 @@ async def get_facts_by_tag(
     stmt = (
         select(FactModel)
         .where(FactModel.tags.any(TagModel.name == tag_name))
+        .options(*FACT_LOAD_OPTIONS)
         .offset(offset)
         .limit(limit)
     )
-    results = await session.scalars(stmt)
-    db_facts = []
-    for db_fact in results:
-        db_fact.related = await db_fact.related_facts_async(session)
-        db_facts.append(db_fact)
-    return results.all()
+    db_facts = (await session.scalars(stmt)).all()
+    await load_related(session=session, objects=db_facts, options=FACT_LOAD_OPTIONS)
+    return db_facts
 
 
 @router.post("/", response_model=FactRead)
@@ -141,13 +214,14 @@ async def create_fact(
     :returns: The new fact
     """
     fact_data = fact.dict()
-    tags = fact_data.pop("tags", [])
+    tags = fact_data.pop("tags", None) or []
     new_fact = await FactModel.create_async(session=session, **fact_data)
 
-    for tag in tags:
-        tag_object = await TagModel.get_by_name_async(session=session, name=tag["name"])
+    names = list(dict.fromkeys(tag["name"] for tag in tags))
+    tag_objects = await loader(session, TagModel, TagModel.name).load_many(names)
+    for name, tag_object in zip(names, tag_objects):
         if not tag_object:
-            tag_object = await TagModel.create_async(session=session, name=tag["name"])
+            tag_object = await TagModel.create_async(session=session, name=name)
         await new_fact.assign_tag_async(session=session, tag_id=tag_object.id)
     return new_fact
 
@@ -156,27 +230,37 @@ async def create_fact(
 async def edit_fact(
     fact_id: UUID,
     new_fact_data: FactPatch,
+    deck_id: Optional[UUID] = Query(None),
     current_user: UserRead = Depends(current_active_user),  # to protect endpoint
     session: Session = Depends(get_async_session),
 ):
     """
     Edits the details of the given fact
 
+    Facts can be shared by the cards of cloned decks. If this fact is used by
+    cards outside the edited deck, the cards of the deck are moved to an
+    edited copy of the fact, which is returned instead, and the original is
+    left as-is.
+
     :param fact_id: the id of the fact to edit
     :param new_fact_data: the new details of the fact. Can be partial.
+    :param deck_id: the deck to edit the fact in. Required if the fact is
+        used by the decks of other users.
     :returns: The modified fact
     """
+    fact = await _fact_for_edit(
+        session=session, user=current_user, fact_id=fact_id, deck_id=deck_id
+    )
     update_data = new_fact_data.dict(exclude_unset=True)
-    original_data = await get_fact(fact_id=fact_id, current_user=current_active_user, session=session)
-    new_model = FactBase(**original_data).copy(update=update_data)
-    new_fact = await FactModel.update(session=session, object_id=fact_id, **new_model.dict())
-    return new_fact
+    await FactModel.update_async(session=session, object_id=fact.id, **update_data)
+    return await read_fact(session=session, fact_id=fact.id)
 
 
 @router.put("/{fact_id}/tags/{tag_name}", response_model=FactRead)
 async def assign_tag_to_fact(
     fact_id: UUID,
     tag_name: str,
+    deck_id: Optional[UUID] = Query(None),
     current_user: UserRead = Depends(current_active_user),  # to protect endpoint
     session: Session = Depends(get_async_session),
 ):
@@ -185,15 +269,18 @@ async def assign_tag_to_fact(
 
     :param fact_id: the id of the fact to edit
     :param tag_name: the tag to assign to this fact
+    :param deck_id: the deck to edit the fact in (see ``edit_fact``).
     :returns: The modified fact
     """
-    fact = await FactModel.get_one_async(session=session, object_id=fact_id)
-    tag = await TagModel.get_by_name_async(session=session, name=tag_name)
+    fact = await _fact_for_edit(
+        session=session, user=current_user, fact_id=fact_id, deck_id=deck_id
+    )
+    tag = await loader(session, TagModel, TagModel.name).load(tag_name)
     if not tag:
         tag = await TagModel.create_async(session=session, name=tag_name)
     await fact.assign_tag_async(session=session, tag_id=tag.id)
 
-    fact = await get_fact(fact_id=fact_id, current_user=current_active_user, session=session)
+    fact = await read_fact(session=session, fact_id=fact.id)
     return fact
 
 
@@ -201,6 +288,7 @@ async def assign_tag_to_fact(
 async def remove_tag_from_fact(
     fact_id: UUID,
     tag_name: str,
+    deck_id: Optional[UUID] = Query(None),
     current_user: UserRead = Depends(current_active_user),  # to protect endpoint
     session: Session = Depends(get_async_session),
 ):
@@ -209,15 +297,18 @@ async def remove_tag_from_fact(
 
     :param fact_id: the id of the fact to edit
     :param tag_name: the tag to remove from this fact
+    :param deck_id: the deck to edit the fact in (see ``edit_fact``).
     :returns: The modified fact
     """
-    fact = await FactModel.get_one_async(session=session, object_id=fact_id)
-    tag = await TagModel.get_by_name_async(session=session, name=tag_name)
+    tag = await loader(session, TagModel, TagModel.name).load(tag_name)
     if not tag:
         raise HTTPException(status_code=404, detail=f"Tag '{tag_name}' doesn't exist.")
+    fact = await _fact_for_edit(
+        session=session, user=current_user, fact_id=fact_id, deck_id=deck_id
+    )
     await fact.remove_tag_async(session=session, tag_id=tag.id)
 
-    fact = await get_fact(fact_id=fact_id, current_user=current_active_user, session=session)
+    fact = await read_fact(session=session, fact_id=fact.id)
     return fact
 
 @router.put("/{fact_id}/related/", response_model=FactRead)
@@ -225,6 +316,7 @@ async def assign_related_fact(
     fact_id: UUID,
     related_fact_id: str,
     relationship: str,
+    deck_id: Optional[UUID] = Query(None),
     current_user: UserRead = Depends(current_active_user),  # to protect endpoint
     session: Session = Depends(get_async_session),
 ):
@@ -234,11 +326,15 @@ async def assign_related_fact(
     :param fact_id: the id of the fact to edit
     :param related_fact_id: the related fact to assign to this fact
     :param relationship: the type of relationship between these cards
+    :param deck_id: the deck to edit the fact in (see ``edit_fact``).
     :returns: The modified fact
     """
-    fact: FactModel = await FactModel.get_one_async(session=session, object_id=fact_id)
+    await _related_fact(session=session, related_fact_id=related_fact_id)
+    fact = await _fact_for_edit(
+        session=session, user=current_user, fact_id=fact_id, deck_id=deck_id
+    )
     await fact.assign_related_fact_async(session=session, fact_id=related_fact_id, relationship=relationship)
-    fact = await get_fact(fact_id=fact_id, current_user=current_active_user, session=session)
+    fact = await read_fact(session=session, fact_id=fact.id)
     return fact
 
 
@@ -247,6 +343,7 @@ async def remove_related_fact(
     fact_id: UUID,
     related_fact_id: str,
     relationship: str,
+    deck_id: Optional[UUID] = Query(None),
     current_user: UserRead = Depends(current_active_user),  # to protect endpoint
     session: Session = Depends(get_async_session),
 ):
@@ -255,21 +352,42 @@ async def remove_related_fact(
 
     :param fact_id: the id of the fact to edit
     :param related_fact_id: the related fact to assign to this fact
+    :param deck_id: the deck to edit the fact in (see ``edit_fact``).
     :returns: The modified fact
     """
-    fact: FactModel = await FactModel.get_one_async(session=session, object_id=fact_id)
+    await _related_fact(session=session, related_fact_id=related_fact_id)
+    fact = await _fact_for_edit(
+        session=session, user=current_user, fact_id=fact_id, deck_id=deck_id
+    )
     await fact.remove_related_fact_async(session=session, fact_id=related_fact_id, relationship=relationship)
-    fact = await get_fact(fact_id=fact_id, current_user=current_active_user, session=session)
+    fact = await read_fact(session=session, fact_id=fact.id)
     return fact
 
 
 @router.delete("/{fact_id}")
 async def delete_fact(
-    fact_id: str,
+    fact_id: UUID,
+    deck_id: Optional[UUID] = Query(None),
     current_user: UserRead = Depends(current_active_user),  # to protect endpoint
     session: Session = Depends(get_async_session),
 ):
+    """
+    Deletes the given fact.
+
+    While the decks of other users still use it, it's only removed from the
+    context of the cards of the current user instead.
+
+    :param fact_id: the id of the fact to delete
+    :param deck_id: the deck to remove the fact from. All the decks of the
+        current user by default.
+    """
+    if deck_id is not None:
+        await valid_deck(session=session, user=current_user, deck_id=deck_id)
     try:
-        await FactModel.delete_async(session=session, object_id=fact_id)
-    except ValueError:
+        deleted = await current_user.delete_fact(
+            session=session, fact_id=fact_id, deck_id=deck_id
+        )
+    except SharedFactError as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    if not deleted:
         raise HTTPException(status_code=404, detail=f"Fact '{fact_id}' not found")
\ No newline at end of file
@@ -1,12 +1,13 @@
 from typing import Any
 
 from uuid import UUID
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from flashcards_core.schedulers import get_scheduler_for_deck
 
+from flashcards_server.card_states import load_card_states
 from flashcards_server.database import get_async_session
+from flashcards_server.idempotency import run_idempotently
 
 # from flashcards_server.auth import oauth2_scheme
 from flashcards_server.api.decks import valid_deck
@@ -29,7 +30,7 @@ router = APIRouter(
 
 
 @router.get("/{deck_id}/start", response_model=CardRead)
-def first_card(
+async def first_card(
     deck_id: UUID,
     current_user: UserRead = Depends(current_active_user),
     session: Session = Depends(get_async_session),
@@ -40,15 +41,25 @@ def first_card(
     :param deck_id: the deck being studied
     :returns: the next card to study
     """
-    deck = valid_deck(session=session, user=current_user, deck_id=deck_id)
-    scheduler = get_scheduler_for_deck(session=session, deck=deck)
-    return scheduler.next_card()
+    deck = await valid_deck(session=session, user=current_user, deck_id=deck_id)
+    # The scheduler sees the whole state, and only its changes are written
+    await load_card_states(session=session, decks=[deck])
+
+    def _next_card(sync_session):
+        # Slow to import, see algorithms.py
+        from flashcards_core.schedulers import get_scheduler_for_deck
+
+        scheduler = get_scheduler_for_deck(session=sync_session, deck=deck)
+        return scheduler.next_card()
+
+    return await session.run_sync(_next_card)
 
 
 @router.post("/{deck_id}/next", response_model=CardRead)
-def next_card(
+async def next_card(
     deck_id: UUID,
     test_data: TestData,
+    request: Request,
     current_user: UserRead = Depends(current_active_user),
     session: Session = Depends(get_async_session),
 ):
@@ -56,20 +67,43 @@ def next_card(
     Processes the result of the previous test and returns the
     next card to study.
 
+    Send a unique Idempotency-Key header to retry safely: the result is
+    processed once, and the retries get the same card.
+
     :param deck_id: the deck being studied
     :param result: the result of the test (algorithm dependent)
     :returns: the next card to study
     """
-    deck = valid_deck(session=session, user=current_user, deck_id=deck_id)
-    scheduler = get_scheduler_for_deck(session=session, deck=deck)
-
-    if test_data:
-        card = valid_card(
-            session=session,
-            user=current_user,
-            deck_id=deck_id,
-            card_id=test_data.card_id,
-        )
-        scheduler.process_test_result(card=card, result=test_data.result)
-
-    return scheduler.next_card()
+
+    async def process_result(session: Session):
+        deck = await valid_deck(session=session, user=current_user, deck_id=deck_id)
+        # The scheduler sees the whole state, and only its changes are written
+        await load_card_states(session=session, decks=[deck])
+
+        card = None
+        if test_data:
+            card = await valid_card(
+                session=session,
+                user=current_user,
+                deck_id=deck_id,
+                card_id=test_data.card_id,
+            )
+
+        def _process_and_next_card(sync_session):
+            # Slow to import, see algorithms.py
+            from flashcards_core.schedulers import get_scheduler_for_deck
+
+            scheduler = get_scheduler_for_deck(session=sync_session, deck=deck)
+            if card:
+                scheduler.process_test_result(card=card, result=test_data.result)
+            return scheduler.next_card()
+
+        return await session.run_sync(_process_and_next_card)
+
+    return await run_idempotently(
+        request=request,
+        session=session,
+        user_id=current_user.id,
+        run=process_result,
+        schema=CardRead,
+    )
@@ -0,0 +1,149 @@
+import json
+from typing import AsyncGenerator, Dict, List
+
+from uuid import UUID
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.orm import Session, selectinload, sessionmaker
+
+from flashcards_server.card_states import load_card_states
+from flashcards_server.changelog import get_changes, is_cursor_expired, latest_seq
+from flashcards_server.constants import SYNC_BATCH_SIZE
+from flashcards_server.database import (
+    get_async_session,
+    session_maker_like,
+    Card as CardModel,
+    Deck as DeckModel,
+    Fact as FactModel,
+    Review as ReviewModel,
+    Tag as TagModel,
+)
+from flashcards_server.api.cards import CARD_LOAD_OPTIONS, CardRead, Review
+from flashcards_server.api.decks import DeckRead
+from flashcards_server.api.facts import FACT_LOAD_OPTIONS, FactRead
+from flashcards_server.api.tags import TagRead
+from flashcards_server.users import current_active_user
+from flashcards_server.schemas import UserRead
+
+
+#: How to load and serialize each entity of the change log
+SYNCED_ENTITIES = {
+    "deck": (DeckModel, DeckRead, [selectinload(DeckModel.tags)]),
+    "card": (CardModel, CardRead, CARD_LOAD_OPTIONS),
+    "fact": (FactModel, FactRead, FACT_LOAD_OPTIONS),
+    "tag": (TagModel, TagRead, []),
+    "review": (ReviewModel, Review, []),
+}
+
+
+router = APIRouter(
+    prefix="/sync",
+    tags=["sync"],
+    responses={410: {"description": "Cursor too old, download everything again"}},
+)
+
+
+@router.get("")
+async def sync(
+    since: int = Query(0, ge=0),
+    current_user: UserRead = Depends(current_active_user),
+    session: Session = Depends(get_async_session),
+):
+    """
+    Stream what changed since the given cursor, as newline-delimited JSON.
+
+    Each object appears at most once, with its latest state:
+    ``{"entity": "card", "id": ..., "op": "upsert", "data": {...}}`` or
+    ``{"entity": "card", "id": ..., "op": "delete"}``. Cards of a deleted deck
+    are not listed: deleting the deck deletes them. The last line is
+    ``{"cursor": ...}``, to send as ``since`` next time.
+
+    If the changes after ``since`` are no longer kept, answers 410 with the
+    current cursor: download everything again, then sync from that cursor.
+
+    :param since: the cursor returned by the last sync, 0 the first time.
+    :returns: the changes, then the new cursor.
+    """
+    until = await latest_seq(session=session)
+    if await is_cursor_expired(session=session, since=since):
+        raise HTTPException(
+            status_code=410,
+            detail={
+                "message": "Cursor too old, download everything again",
+                "cursor": until,
+            },
+        )
+    return StreamingResponse(
+        _stream_changes(
+            session_maker=session_maker_like(session),
+            owner_id=current_user.id,
+            since=since,
+            until=until,
+        ),
+        media_type="application/x-ndjson",
+    )
+
+
+async def _stream_changes(
+    session_maker: sessionmaker, owner_id: UUID, since: int, until: int
+) -> AsyncGenerator[str, None]:
+    """
+    Yields the changes in batches. Uses its own session, because the
+    request's one may be closed before the response is streamed.
+    """
+    after = since
+    async with session_maker() as session:
+        while True:
+            changes = await get_changes(
+                session=session,
+                owner_id=owner_id,
+                since=since,
+                until=until,
+                after=after,
+                limit=SYNC_BATCH_SIZE,
+            )
+            if not changes:
+                break
+            upserted = [
+                (entity, entity_id)
+                for entity, entity_id, _, op, _ in changes
+                if op != "delete"
+            ]
+            objects = await _load_objects(session=session, keys=upserted)
+
+            lines = []
+            for entity, entity_id, _, op, created in changes:
+                obj = objects.get((entity, entity_id))
+                if op == "delete" or obj is None:
+                    if not created:  # Otherwise the client never saw it
+                        lines.append(
+                            {"entity": entity, "id": entity_id, "op": "delete"}
+                        )
+                else:
+                    lines.append(
+                        {"entity": entity, "id": entity_id, "op": "upsert", "data": obj}
+                    )
+            yield "".join(json.dumps(jsonable_encoder(line)) + "\n" for line in lines)
+            after = changes[-1][2]
+    yield json.dumps({"cursor": until}) + "\n"
+
+
+async def _load_objects(session: Session, keys: List[tuple]) -> Dict[tuple, object]:
+    """
+    Loads and serializes the current state of these objects, one query per
+    kind of object (plus one per relationship).
+    """
+    objects = {}
+    for entity, (model, schema, options) in SYNCED_ENTITIES.items():
+        ids = [entity_id for kind, entity_id in keys if kind == entity]
+        if not ids:
+            continue
+        select_objects = select(model).where(model.id.in_(ids)).options(*options)
+        loaded = (await session.scalars(select_objects)).all()
+        if model is DeckModel:
+            await load_card_states(session=session, decks=loaded)
+        for obj in loaded:
+            objects[(entity, obj.id)] = schema.from_orm(obj)
+    return objects
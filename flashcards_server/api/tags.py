@@ -1,10 +1,11 @@
 from typing import List
 
 from uuid import UUID
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 
+from flashcards_server.constants import MAX_PAGE_SIZE
 from flashcards_server.database import (
     get_async_session,
     Tag as TagModel,
@@ -38,8 +39,8 @@ router = APIRouter(
 
 @router.get("/", response_model=List[TagRead])
 async def get_tags(
-    offset: int = 0,
-    limit: int = 100,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=0, le=MAX_PAGE_SIZE),
     current_user: UserRead = Depends(current_active_user),  # to protect endpoint
     session: Session = Depends(get_async_session),
 ):
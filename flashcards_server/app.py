@@ -1,11 +1,31 @@
+import asyncio
 import importlib.metadata
 
 from fastapi import FastAPI
 from fastapi.routing import APIRoute
 
-from flashcards_server.database import create_db_and_tables
+from flashcards_server.constants import (
+    JOBS_ENABLED,
+    METRICS_ENABLED,
+    RATE_LIMITING_ENABLED,
+    SCHEMA_MODE,
+    SHARDING_ENABLED,
+)
+from flashcards_server.database import create_db_and_tables, engine, read_engine
+from flashcards_server.events import event_hubs
+from flashcards_server.jobs import JobScheduler, default_jobs
+from flashcards_server.metrics import MetricsMiddleware, instrument_engine, metrics_response
+from flashcards_server.passwords import password_helper
+from flashcards_server.ratelimit import (
+    AdmissionControlMiddleware,
+    admission_metrics,
+    concurrency_limiter,
+    rate_limiter,
+)
 from flashcards_server.users import auth_backend, fastapi_users
 from flashcards_server.schemas import UserRead, UserCreate, UserUpdate
+from flashcards_server.shards import enable_sharding, shard_engines
+from flashcards_server.utils.openapi import load_openapi
 
 
 __version__ = importlib.metadata.version('flashcards_server')
@@ -18,6 +38,19 @@ app = FastAPI(
     version=__version__,
 )
 
+if RATE_LIMITING_ENABLED:
+    app.add_middleware(
+        AdmissionControlMiddleware,
+        rate_limiter=rate_limiter,
+        concurrency_limiter=concurrency_limiter,
+    )
+
+if METRICS_ENABLED:
+    # Added last to see the requests rejected by admission control too
+    app.add_middleware(MetricsMiddleware)
+    for instrumented_engine in {engine, read_engine}:
+        instrument_engine(instrumented_engine)
+
 
 # Import and include all routers
 from flashcards_server.api.algorithms import (  # noqa: F401, E402
@@ -28,6 +61,8 @@ from flashcards_server.api.decks import router as decks_router  # noqa: F401, E4
 from flashcards_server.api.facts import router as facts_router  # noqa: F401, E402
 from flashcards_server.api.tags import router as tags_router  # noqa: F401, E402
 from flashcards_server.api.study import router as study_router  # noqa: F401, E402
+from flashcards_server.api.sync import router as sync_router  # noqa: F401, E402
+from flashcards_server.api.batch import router as batch_router  # noqa: F401, E402
 
 app.include_router(algorithms_router)
 app.include_router(cards_router)
@@ -35,17 +70,53 @@ app.include_router(decks_router)
 app.include_router(facts_router)
 app.include_router(tags_router)
 app.include_router(study_router)
+app.include_router(sync_router)
+app.include_router(batch_router)
 app.include_router(fastapi_users.get_auth_router(auth_backend), prefix="/auth/jwt", tags=["auth"])  # Prefix needed for OpenAPI
 app.include_router(fastapi_users.get_register_router(UserRead, UserCreate), tags=["auth"])
 app.include_router(fastapi_users.get_reset_password_router(), tags=["auth"])
 app.include_router(fastapi_users.get_verify_router(UserRead), tags=["auth"])
 app.include_router(fastapi_users.get_users_router(UserRead, UserUpdate), prefix="/users", tags=["users"])
 
+if SHARDING_ENABLED:
+    # Each user's data in their own SQLite file, the users in the main database
+    enable_sharding(app)
+
 
 @app.on_event("startup")
 async def on_startup():
-    # Not needed if you setup a migration system like Alembic
-    await create_db_and_tables()
+    if SCHEMA_MODE == "create":
+        await create_db_and_tables()
+    elif SCHEMA_MODE == "upgrade":
+        from flashcards_server.utils.migrate import upgrade_schema
+
+        # Alembic runs its own event loop
+        await asyncio.to_thread(upgrade_schema)
+    else:
+        # Migrations run before startup (flashcards-migrate): only check they did.
+        # Imported here, Alembic is slow to import and only needed at startup
+        from flashcards_server.utils.migrate import current_revision, head_revision
+
+        current, head = await current_revision(engine), head_revision()
+        if current != head:
+            raise RuntimeError(
+                f"The database schema is at revision {current}, expected {head}: "
+                "run `flashcards-migrate` before starting the server."
+            )
+    # Maintenance jobs: purging deleted decks, pruning the change log, ...
+    app.state.scheduler = JobScheduler()
+    if JOBS_ENABLED:
+        for job in default_jobs():
+            app.state.scheduler.add(job)
+    app.state.scheduler.start()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await app.state.scheduler.stop()
+    await event_hubs.close_all()
+    await shard_engines.close_all()
+    password_helper.shutdown()
 
 
 # Default endpoint
@@ -54,6 +125,16 @@ async def root():
     return {"message": "Hello!"}
 
 
+@app.get("/ratelimit/metrics", include_in_schema=False)
+async def ratelimit_metrics():
+    return admission_metrics()
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return metrics_response()
+
+
 
 def use_route_names_as_operation_ids(app: FastAPI) -> None:
     """
@@ -67,4 +148,7 @@ def use_route_names_as_operation_ids(app: FastAPI) -> None:
             route.operation_id = route.name
 
 
-use_route_names_as_operation_ids(app)
\ No newline at end of file
+use_route_names_as_operation_ids(app)
+
+# Serve the schema generated at build time, if any: see flashcards-openapi
+app.openapi = lambda: load_openapi(app)
@@ -0,0 +1,212 @@
+import json
+import struct
+import sys
+import zlib
+from array import array
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List
+
+from uuid import UUID
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    ForeignKey,
+    Integer,
+    LargeBinary,
+    Table,
+    delete,
+    insert,
+    select,
+)
+from sqlalchemy.orm import Session
+
+from flashcards_core.guid import GUID
+from flashcards_core.database import Base, Card, Review
+
+from flashcards_server.constants import REVIEW_ARCHIVE_BATCH_SIZE
+
+#: Old reviews, packed into one row per card by ``archive_reviews``
+ReviewArchive = Table(
+    "review_archives",
+    Base.metadata,
+    Column("card_id", GUID(), ForeignKey(Card.id), primary_key=True),
+    Column("reviews_count", Integer(), nullable=False),
+    Column("newest", DateTime(), nullable=False),
+    Column("data", LargeBinary(), nullable=False),
+)
+
+#: Format of ReviewArchive.data: this header, then a zlib compressed body
+#: holding the metadata length (uint32) and JSON, the review IDs (16 bytes
+#: each), the timestamps (int64 microseconds, each one a delta from the
+#: previous one), and the indexes of the algorithm and result of each review
+#: in the metadata (uint16 each). All little endian.
+_MAGIC = b"RVA1"
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+@dataclass
+class ArchivedReview:
+    """
+    A review read back from the archive, with the same fields as the Review model.
+    """
+
+    id: UUID
+    card_id: UUID
+    result: Any
+    algorithm: str
+    datetime: datetime
+
+
+def pack_reviews(reviews: Iterable) -> bytes:
+    """
+    Packs reviews into the binary format of ReviewArchive.data.
+
+    :param reviews: Review models or ArchivedReviews, in chronological order.
+    """
+    algorithms: Dict[str, int] = {}
+    results: Dict[str, int] = {}
+    ids = bytearray()
+    timestamps = array("q")
+    algorithm_indexes = array("H")
+    result_indexes = array("H")
+    previous = 0
+    for review in reviews:
+        ids += review.id.bytes
+        timestamp = (review.datetime - _EPOCH) // timedelta(microseconds=1)
+        timestamps.append(timestamp - previous)
+        previous = timestamp
+        algorithm_indexes.append(
+            algorithms.setdefault(review.algorithm, len(algorithms))
+        )
+        result = json.dumps(review.result, default=str)
+        result_indexes.append(results.setdefault(result, len(results)))
+
+    metadata = json.dumps(
+        {"algorithms": list(algorithms), "results": list(results)}
+    ).encode()
+    arrays = [timestamps, algorithm_indexes, result_indexes]
+    if sys.byteorder == "big":
+        for values in arrays:
+            values.byteswap()
+    body = b"".join(
+        [struct.pack("<I", len(metadata)), metadata, bytes(ids)]
+        + [values.tobytes() for values in arrays]
+    )
+    return _MAGIC + zlib.compress(body, 9)
+
+
+def unpack_reviews(card_id: UUID, data: bytes) -> List[ArchivedReview]:
+    """
+    Reads back the reviews packed by ``pack_reviews``.
+
+    :param card_id: the card they were done on.
+    :param data: the packed reviews.
+    """
+    if not data.startswith(_MAGIC):
+        raise ValueError("Not a review archive")
+    header_length = len(_MAGIC)
+    body = zlib.decompress(data[header_length:])
+    (metadata_length,) = struct.unpack_from("<I", body)
+    offset = 4 + metadata_length
+    metadata = json.loads(body[4:offset])
+    count = (len(body) - offset) // (16 + 8 + 2 + 2)
+
+    ids_end = offset + 16 * count
+    ids = [
+        UUID(bytes=raw) for (raw,) in struct.iter_unpack("16s", body[offset:ids_end])
+    ]
+    offset = ids_end
+    arrays = []
+    for typecode, size in (("q", 8), ("H", 2), ("H", 2)):
+        end = offset + size * count
+        values = array(typecode, body[offset:end])
+        if sys.byteorder == "big":
+            values.byteswap()
+        arrays.append(values)
+        offset += size * count
+    deltas, algorithm_indexes, result_indexes = arrays
+
+    reviews = []
+    timestamp = 0
+    results = [json.loads(result) for result in metadata["results"]]
+    for index in range(count):
+        timestamp += deltas[index]
+        reviews.append(
+            ArchivedReview(
+                id=ids[index],
+                card_id=card_id,
+                result=results[result_indexes[index]],
+                algorithm=metadata["algorithms"][algorithm_indexes[index]],
+                datetime=_EPOCH + timedelta(microseconds=timestamp),
+            )
+        )
+    return reviews
+
+
+async def archive_reviews(
+    session: Session, older_than: datetime, batch_size: int = REVIEW_ARCHIVE_BATCH_SIZE
+) -> int:
+    """
+    Moves the reviews older than the given date of a batch of cards into
+    their archive, in the session's transaction, and commits.
+
+    :param session: the session (see flashcards_core.database:init_db()).
+    :param older_than: the reviews done before this are archived.
+    :param batch_size: how many cards to archive the reviews of.
+    :returns: how many cards had reviews archived: 0 once there's nothing left.
+    """
+    reviews = Review.__table__
+    is_old = reviews.c.datetime < older_than
+    select_cards = select(reviews.c.card_id).where(is_old).distinct().limit(batch_size)
+    card_ids = (await session.scalars(select_cards)).all()
+    if not card_ids:
+        return 0
+
+    in_batch = reviews.c.card_id.in_(card_ids)
+    by_card = {card_id: [] for card_id in card_ids}
+    select_archives = select(ReviewArchive.c.card_id, ReviewArchive.c.data).where(
+        ReviewArchive.c.card_id.in_(card_ids)
+    )
+    for card_id, data in await session.execute(select_archives):
+        by_card[card_id] += unpack_reviews(card_id, data)
+    for review in await session.execute(select(reviews).where(in_batch, is_old)):
+        by_card[review.card_id].append(review)
+
+    rows = []
+    for card_id, card_reviews in by_card.items():
+        card_reviews.sort(key=lambda review: review.datetime)
+        rows.append(
+            {
+                "card_id": card_id,
+                "reviews_count": len(card_reviews),
+                "newest": card_reviews[-1].datetime,
+                "data": pack_reviews(card_reviews),
+            }
+        )
+    await session.execute(
+        delete(ReviewArchive).where(ReviewArchive.c.card_id.in_(card_ids))
+    )
+    await session.execute(insert(ReviewArchive), rows)
+    await session.execute(delete(reviews).where(in_batch, is_old))
+    await session.commit()
+    return len(card_ids)
+
+
+async def with_archived_reviews(session: Session, card_id: UUID, reviews: List) -> List:
+    """
+    Adds the archived reviews of a card to its recent ones.
+
+    :param session: the session (see flashcards_core.database:init_db()).
+    :param card_id: the card the reviews were done on.
+    :param reviews: its recent reviews, from the Review table.
+    :returns: all the reviews of the card, oldest first.
+    """
+    select_archive = select(ReviewArchive.c.data).where(
+        ReviewArchive.c.card_id == card_id
+    )
+    data = await session.scalar(select_archive)
+    archived = unpack_reviews(card_id, data) if data is not None else []
+    return archived + sorted(reviews, key=lambda review: review.datetime)
@@ -0,0 +1,78 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class TTLCache:
+    """
+    In-process cache shared across requests: a bounded LRU mapping whose
+    entries expire after ``ttl`` seconds.
+
+    Not thread safe: it's meant to be used from the event loop only.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        """
+        :param maxsize: how many entries to keep at most. The least recently
+            used ones are dropped first.
+        :param ttl: how many seconds an entry stays valid.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Optional[Any]:
+        """
+        Returns the value cached for this key.
+
+        :param key: the key to look for.
+        :param default: what to return if the key is missing or expired.
+        :returns: the cached value, or the default.
+        """
+        try:
+            expires_at, value = self._entries[key]
+        except KeyError:
+            return default
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """
+        Caches a value, evicting the least recently used entries if needed.
+
+        :param key: the key to store the value under.
+        :param value: the value to cache.
+        """
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        """
+        Removes this key from the cache, if present.
+
+        :param key: the key to remove.
+        """
+        self._entries.pop(key, None)
+
+    def pop_where(self, predicate: Callable[[Hashable], bool]) -> None:
+        """
+        Removes all the keys matching the predicate. Scans the whole cache.
+
+        :param predicate: returns True for the keys to remove.
+        """
+        for key in [key for key in self._entries if predicate(key)]:
+            del self._entries[key]
+
+    def clear(self) -> None:
+        """
+        Empties the cache.
+        """
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
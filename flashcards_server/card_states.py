@@ -0,0 +1,208 @@
+import copy
+from typing import Dict, Iterable, Tuple
+from uuid import UUID
+
+from sqlalchemy import (
+    JSON,
+    Column,
+    ForeignKey,
+    String,
+    Table,
+    delete,
+    event,
+    inspect,
+    select,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, object_session
+from sqlalchemy.orm.attributes import flag_modified, set_committed_value
+
+from flashcards_core.guid import GUID
+from flashcards_core.database import Base, Deck
+
+from flashcards_server.changelog import defer_changes
+from flashcards_server.versions import write_versions
+
+#: The entries of Deck.state keyed by a card ID, where schedulers keep their
+#: per-card state. Storing them apart, one row each, makes a review write
+#: one small row instead of the whole state of the deck. The decks table
+#: keeps the rest of the state.
+CardState = Table(
+    "card_states",
+    Base.metadata,
+    Column("deck_id", GUID(), ForeignKey(Deck.id), primary_key=True),
+    Column("key", String(36), primary_key=True),
+    Column("state", JSON(), nullable=True),
+)
+
+_UPSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def split_state(state: dict) -> Tuple[dict, dict]:
+    """
+    Splits a deck state into its own entries and the per-card ones.
+
+    :returns: (the deck entries, the card entries), both by key.
+    """
+    deck_entries, card_entries = {}, {}
+    for key, value in (state or {}).items():
+        try:
+            UUID(key)
+            card_entries[key] = value
+        except (TypeError, ValueError):
+            deck_entries[key] = value
+    return deck_entries, card_entries
+
+
+async def load_card_states(session: Session, decks: Iterable[Deck]) -> None:
+    """
+    Puts the card entries back into the state of these decks, so that they
+    show their whole state. Changes to the state of these decks are then
+    written entry by entry at the next flush.
+
+    :param session: the session (see flashcards_core.database:init_db()).
+    :param decks: the decks to load the state of. Loaded decks are skipped.
+    """
+    snapshots = session.info.setdefault("card_state_snapshots", {})
+    decks = {deck.id: deck for deck in decks if deck.id not in snapshots}
+    if not decks:
+        return
+    card_entries: Dict[UUID, dict] = {deck_id: {} for deck_id in decks}
+    select_states = select(CardState).where(CardState.c.deck_id.in_(decks))
+    for deck_id, key, state in await session.execute(select_states):
+        card_entries[deck_id][key] = state
+    for deck_id, deck in decks.items():
+        state = {**(deck.state or {}), **card_entries[deck_id]}
+        set_committed_value(deck, "state", state)
+        snapshots[deck_id] = (deck, copy.deepcopy(state))
+
+
+@event.listens_for(Deck, "expire")
+@event.listens_for(Deck, "refresh")
+def _forget_card_states(deck, *args):
+    """
+    A reloaded deck has only its deck entries again: it must be loaded with
+    ``load_card_states`` again before its card entries can be diffed.
+    """
+    session = object_session(deck)
+    # Not deck.id: expired by a rollback, the deck can't be loaded again
+    identity = inspect(deck).identity
+    if session is not None and identity is not None:
+        session.info.get("card_state_snapshots", {}).pop(identity[0], None)
+
+
+def flag_changed_states(session: Session) -> None:
+    """
+    A state changed in place leaves the session clean, which skips the flush:
+    mark these decks as changed so that their entries are written.
+
+    Listens to ``before_commit`` before ``changelog.write_changes``, which
+    flushes: see database.py.
+    """
+    for deck, snapshot in session.info.get("card_state_snapshots", {}).values():
+        if deck.state != snapshot:
+            flag_modified(deck, "state")
+
+
+@event.listens_for(Session, "before_flush")
+def _split_card_states(session, flush_context, instances):
+    """
+    Keeps the card entries of the changed deck states out of the decks
+    table: only the entries that changed are written, after the flush.
+    """
+    snapshots = session.info.get("card_state_snapshots", {})
+    decks = {obj.id: obj for obj in session.dirty if isinstance(obj, Deck)}
+    # Also the loaded decks whose state was changed in place
+    decks.update((deck_id, deck) for deck_id, (deck, _) in snapshots.items())
+    for deck in decks.values():
+        snapshot = snapshots[deck.id][1] if deck.id in snapshots else None
+        if snapshot is None and not session.is_modified(deck):
+            continue
+        state = deck.state or {}
+        deck_entries, card_entries = split_state(state)
+        if snapshot is None:
+            # Not loaded with load_card_states: only add or replace entries
+            old_deck_entries, old_card_entries = None, {}
+        else:
+            old_deck_entries, old_card_entries = split_state(snapshot)
+        changed = {
+            key: value
+            for key, value in card_entries.items()
+            if key not in old_card_entries or old_card_entries[key] != value
+        }
+        removed = [key for key in old_card_entries if key not in card_entries]
+        if (
+            not changed
+            and not removed
+            and old_deck_entries is None
+            and not card_entries
+        ):
+            continue  # A deck state without card entries: nothing to split
+
+        if deck_entries == old_deck_entries:
+            set_committed_value(deck, "state", state)  # No need to update the deck row
+        else:
+            deck.state = deck_entries
+        pending = session.info.setdefault("pending_card_states", {})
+        pending[deck.id] = (deck, state, changed, removed)
+        if snapshot is not None:
+            snapshots[deck.id] = (deck, copy.deepcopy(state))
+
+
+@event.listens_for(Session, "after_flush")
+def _write_card_states(session, flush_context):
+    """
+    Writes the changed card entries, and logs and versions their decks like
+    any other change to their state.
+    """
+    pending = session.info.get("pending_card_states")
+    if not pending:
+        return
+    connection = session.connection()
+    insert_state = _UPSERTS[connection.dialect.name]
+    changed_decks = set()
+    for deck_id, (_, _, changed, removed) in pending.items():
+        if removed:
+            connection.execute(
+                delete(CardState).where(
+                    CardState.c.deck_id == deck_id, CardState.c.key.in_(removed)
+                )
+            )
+        if changed:
+            upsert = insert_state(CardState).values(
+                [
+                    {"deck_id": deck_id, "key": key, "state": value}
+                    for key, value in changed.items()
+                ]
+            )
+            upsert = upsert.on_conflict_do_update(
+                index_elements=[CardState.c.deck_id, CardState.c.key],
+                set_={"state": upsert.excluded.state},
+            )
+            connection.execute(upsert)
+        if changed or removed:
+            changed_decks.add(deck_id)
+    if changed_decks:
+        defer_changes(
+            session,
+            [
+                {
+                    "entity": "deck",
+                    "entity_id": deck_id,
+                    "op": "update",
+                    "deck_id": deck_id,
+                }
+                for deck_id in changed_decks
+            ],
+        )
+        write_versions(connection, decks=changed_decks)
+
+
+@event.listens_for(Session, "after_flush_postexec")
+def _restore_whole_states(session, flush_context):
+    """
+    The flush wrote only the deck entries to the decks table: give the
+    decks their whole state back.
+    """
+    for deck, state, _, _ in session.info.pop("pending_card_states", {}).values():
+        set_committed_value(deck, "state", state)
@@ -0,0 +1,348 @@
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from uuid import UUID
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Integer,
+    String,
+    Table,
+    and_,
+    delete,
+    event,
+    func,
+    inspect,
+    insert,
+    or_,
+    select,
+)
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from flashcards_core.guid import GUID
+from flashcards_core.database import Base, Deck, Card, Tag, Fact, Review
+
+from flashcards_server.constants import CHANGE_LOG_RETENTION_DAYS
+
+#: Append-only log of the changes to decks, cards, facts, tags and reviews,
+#: written in the same transaction as the changes. ``deck_id`` scopes the
+#: change to the owners of that deck, ``owner_id`` to a single user, and
+#: changes with neither (facts and tags) are visible to everybody.
+ChangeLog = Table(
+    "change_log",
+    Base.metadata,
+    Column("seq", Integer(), primary_key=True, autoincrement=True),
+    Column("entity", String(16), nullable=False),
+    Column("entity_id", GUID(), nullable=False),
+    Column("op", String(8), nullable=False),
+    Column("deck_id", GUID(), nullable=True),
+    Column("owner_id", GUID(), nullable=True),
+    Column("changed_at", DateTime(), nullable=False, default=datetime.utcnow),
+)
+
+#: Held by the transaction writing to the change log, on PostgreSQL, so that
+#: sequence numbers are taken in the order of the commits (see write_changes)
+_CHANGE_LOG_LOCK = 7_350_917_363
+
+#: Entities tracked by the change log, by table
+ENTITIES = {
+    Deck.__table__: "deck",
+    Card.__table__: "card",
+    Fact.__table__: "fact",
+    Tag.__table__: "tag",
+    Review.__table__: "review",
+}
+
+
+async def log_changes(
+    session: Session,
+    entity: str,
+    entity_ids: Iterable[UUID],
+    op: str,
+    deck_id: Optional[UUID] = None,
+    owner_id: Optional[UUID] = None,
+) -> None:
+    """
+    Appends changes to the log, in the session's transaction: they are
+    written when it commits.
+
+    Changes flushed by the ORM are logged automatically: call this only
+    after changing rows with Core statements.
+
+    :param session: the session (see flashcards_core.database:init_db()).
+    :param entity: "deck", "card", "fact", "tag" or "review".
+    :param entity_ids: the IDs of the changed objects.
+    :param op: "create", "update" or "delete".
+    :param deck_id: the deck the objects belong to, if any.
+    :param owner_id: the only user who should see the change, if any.
+    """
+    rows = [
+        {
+            "entity": entity,
+            "entity_id": entity_id,
+            "op": op,
+            "deck_id": deck_id,
+            "owner_id": owner_id,
+        }
+        for entity_id in entity_ids
+    ]
+    defer_changes(session, rows)
+
+
+def defer_changes(session: Session, rows: List[dict]) -> None:
+    """
+    Keeps rows of the change log, to be written when the session commits.
+    """
+    session.info.setdefault("pending_changes", []).extend(
+        {"deck_id": None, "owner_id": None, **row} for row in rows
+    )
+
+
+async def latest_seq(session: Session) -> int:
+    """
+    Returns the cursor of the latest change. All the changes up to it are
+    committed: see ``write_changes``.
+    """
+    return (await session.scalar(select(func.max(ChangeLog.c.seq)))) or 0
+
+
+async def is_cursor_expired(session: Session, since: int) -> bool:
+    """
+    Whether some of the changes after this cursor were pruned from the log.
+    """
+    oldest = await session.scalar(select(func.min(ChangeLog.c.seq)))
+    return oldest is not None and since < oldest - 1
+
+
+async def get_changes(
+    session: Session,
+    owner_id: UUID,
+    since: int,
+    until: int,
+    after: int = 0,
+    limit: int = 500,
+) -> List[Tuple[str, UUID, int, str, bool]]:
+    """
+    Returns the changes visible to this user in the range (since, until],
+    compacted to one per object: its latest change, in order.
+
+    :param session: the session (see flashcards_core.database:init_db()).
+    :param owner_id: the user syncing.
+    :param since: the cursor the client synced to last time.
+    :param until: the cursor the client is syncing to.
+    :param after: for pagination, the ``seq`` of the last change returned.
+    :param limit: for pagination, maximum number of changes to return.
+    :returns: (entity, entity_id, seq, op, created) tuples, where ``created``
+        tells whether the object was created after ``since``.
+    """
+    deck_owners = Base.metadata.tables["deck_owners"]
+    my_decks = select(deck_owners.c.deck_id).where(deck_owners.c.owner_id == owner_id)
+    visible = or_(
+        ChangeLog.c.deck_id.in_(my_decks),
+        ChangeLog.c.owner_id == owner_id,
+        and_(ChangeLog.c.deck_id.is_(None), ChangeLog.c.owner_id.is_(None)),
+    )
+    last_seq = func.max(ChangeLog.c.seq)
+    compacted = (
+        select(
+            ChangeLog.c.entity,
+            ChangeLog.c.entity_id,
+            last_seq.label("seq"),
+        )
+        .where(ChangeLog.c.seq > since, ChangeLog.c.seq <= until, visible)
+        .group_by(ChangeLog.c.entity, ChangeLog.c.entity_id)
+        .having(last_seq > after)
+        .order_by(last_seq)
+        .limit(limit)
+        .subquery()
+    )
+    # Even when it's no longer visible: once a deck is purged, its creation
+    # is hidden and only its deletion is left
+    creations = ChangeLog.alias("creations")
+    created = (
+        select(creations.c.seq)
+        .where(
+            creations.c.entity == compacted.c.entity,
+            creations.c.entity_id == compacted.c.entity_id,
+            creations.c.op == "create",
+            creations.c.seq > since,
+            creations.c.seq <= until,
+        )
+        .exists()
+    )
+    select_changes = (
+        select(
+            compacted.c.entity,
+            compacted.c.entity_id,
+            compacted.c.seq,
+            ChangeLog.c.op,
+            created,
+        )
+        .join(ChangeLog, ChangeLog.c.seq == compacted.c.seq)
+        .order_by(compacted.c.seq)
+    )
+    return [
+        (entity, entity_id, seq, op, bool(created))
+        for entity, entity_id, seq, op, created in await session.execute(select_changes)
+    ]
+
+
+async def prune_change_log(
+    session: Session, retention_days: float = CHANGE_LOG_RETENTION_DAYS
+) -> None:
+    """
+    Deletes the changes older than the retention period, always keeping the
+    latest one. Clients with an older cursor get a 410 and must resync.
+
+    :param session: the session (see flashcards_core.database:init_db()).
+    :param retention_days: how many days changes are kept for.
+    """
+    oldest_kept = datetime.utcnow() - timedelta(days=retention_days)
+    await session.execute(
+        delete(ChangeLog).where(
+            ChangeLog.c.changed_at < oldest_kept,
+            ChangeLog.c.seq < select(func.max(ChangeLog.c.seq)).scalar_subquery(),
+        )
+    )
+    await session.commit()
+
+
+def _entity_change(state, op: str) -> dict:
+    mapper = state.mapper
+    table = mapper.local_table
+    change = {
+        "entity": ENTITIES[table],
+        "op": op,
+        "entity_id": mapper.primary_key_from_instance(state.obj())[0],
+    }
+    if table is Deck.__table__:
+        change["deck_id"] = change["entity_id"]
+    elif table is Card.__table__:
+        change["deck_id"] = state.dict.get("deck_id")
+    elif table is Review.__table__:
+        change["card_id"] = state.dict.get("card_id")
+    return change
+
+
+def _linked_entities(state) -> Iterable[Tuple[str, UUID]]:
+    """
+    The (entity, entity_id) linked by an association object.
+    """
+    mapper = state.mapper
+    for column in mapper.local_table.columns:
+        for foreign_key in column.foreign_keys:
+            target = foreign_key.column.table
+            if target in ENTITIES:
+                entity_id = state.dict.get(mapper.get_property_by_column(column).key)
+                if entity_id is not None:
+                    yield ENTITIES[target], entity_id
+
+
+def _flushed_changes(session: Session) -> Dict[Tuple[str, UUID], dict]:
+    """
+    Returns the changes in this flush, by (entity, entity_id). Association
+    objects count as updates to the objects they link.
+    """
+    changes = {}
+    modified = [obj for obj in session.dirty if session.is_modified(obj)]
+    for op, objects in (
+        ("create", session.new),
+        ("update", modified),
+        ("delete", session.deleted),
+    ):
+        for obj in objects:
+            state = inspect(obj)
+            if state.mapper.local_table in ENTITIES:
+                change = _entity_change(state, op)
+                key = (change["entity"], change["entity_id"])
+                # Creations and deletions win over updates in the same flush
+                if op != "update" or key not in changes:
+                    changes[key] = change
+                continue
+            for key in _linked_entities(state):
+                if key not in changes:
+                    changes[key] = {
+                        "entity": key[0],
+                        "entity_id": key[1],
+                        "op": "update",
+                    }
+    return changes
+
+
+def _resolve_decks(connection: Connection, changes: Iterable[dict]) -> None:
+    """
+    Finds the deck of the changed cards and reviews whose deck isn't known yet.
+    """
+    card_table = Card.__table__
+    missing = [
+        c for c in changes if c["entity"] in ("card", "review") and not c.get("deck_id")
+    ]
+    card_ids = {c.get("card_id") or c["entity_id"] for c in missing}
+    card_ids.discard(None)
+    if not card_ids:
+        return
+    select_decks = select(card_table.c.id, card_table.c.deck_id).where(
+        card_table.c.id.in_(card_ids)
+    )
+    decks = dict(connection.execute(select_decks).all())
+    for change in missing:
+        change["deck_id"] = decks.get(change.get("card_id") or change["entity_id"])
+
+
+@event.listens_for(Session, "after_flush")
+def _log_flushed_changes(session, flush_context):
+    """
+    Logs the objects of this flush, in the same transaction.
+    """
+    changes = list(_flushed_changes(session).values())
+    if not changes:
+        return
+    connection = session.connection()
+    _resolve_decks(connection, changes)
+    # Cards and reviews are only visible to the owners of their deck
+    changes = [
+        c for c in changes if c["entity"] not in ("card", "review") or c["deck_id"]
+    ]
+    defer_changes(
+        session,
+        [
+            {
+                "entity": c["entity"],
+                "entity_id": c["entity_id"],
+                "op": c["op"],
+                "deck_id": c.get("deck_id"),
+                "owner_id": None,
+            }
+            for c in changes
+        ],
+    )
+
+
+def write_changes(session: Session) -> None:
+    """
+    Writes the changes of the transaction to the log, right before it
+    commits. Listens to ``before_commit`` after the other listeners, which
+    may add changes to the flush: see database.py.
+
+    Clients sync up to the latest ``seq`` they see, so a transaction must
+    not commit a lower ``seq`` than one already committed. SQLite runs one
+    writer at a time. On PostgreSQL, a lock is held from the time the
+    sequence numbers are taken until the commit: this only serializes the
+    end of the transactions, and they hold no other lock the others wait for.
+    """
+    session.flush()  # For the changes of this flush to be logged too
+    rows = session.info.pop("pending_changes", None)
+    if not rows:
+        return
+    connection = session.connection()
+    if connection.dialect.name == "postgresql":
+        connection.execute(select(func.pg_advisory_xact_lock(_CHANGE_LOG_LOCK)))
+    connection.execute(insert(ChangeLog), rows)
+    session.info["logged_changes"] = True  # See events.py
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_changes(session, previous_transaction):
+    session.info.pop("pending_changes", None)
@@ -1,19 +1,77 @@
-from typing import AsyncGenerator, List
+import asyncio
+import sys
+from datetime import datetime
+from typing import AsyncGenerator, Iterable, List, Optional, Tuple
 
-from uuid import UUID
+from uuid import UUID, uuid4
 
-from fastapi import Depends
+from fastapi import Depends, Request
 from fastapi_users.db import SQLAlchemyBaseUserTableUUID, SQLAlchemyUserDatabase
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.ext.declarative import DeclarativeMeta, declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import Column, ForeignKey, Table, and_
-from sqlalchemy.orm import Session
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Table,
+    UniqueConstraint,
+    and_,
+    delete,
+    event,
+    insert,
+    false,
+    literal,
+    or_,
+    select,
+    update,
+)
+from sqlalchemy.orm import Session, joinedload, selectinload
 
 
 from flashcards_core.guid import GUID
 from flashcards_core.database import Base, Deck, Card, Tag, Fact, Review
 
+from flashcards_server.cache import TTLCache
+from flashcards_server.constants import (
+    DATABASE_ECHO,
+    DATABASE_MAX_OVERFLOW,
+    DATABASE_POOL_PRE_PING,
+    DATABASE_POOL_SIZE,
+    DATABASE_STATEMENT_CACHE_SIZE,
+    DECK_PURGE_BATCH_SIZE,
+    OWNERSHIP_CACHE_SIZE,
+    OWNERSHIP_CACHE_TTL_SECONDS,
+    SQLALCHEMY_DATABASE_URL,
+    SQLITE_PRAGMAS,
+    SQLITE_READERS,
+    SQLITE_WAL_MODE,
+    SQLITE_WRITE_TIMEOUT,
+)
+from flashcards_server.archive import ReviewArchive  # noqa: F401, adds its table to Base.metadata
+from flashcards_server.card_states import CardState  # noqa: F401, adds its table to Base.metadata
+from flashcards_server.card_states import flag_changed_states
+from flashcards_server.changelog import log_changes, write_changes
+from flashcards_server.idempotency import (  # noqa: F401, adds its table to Base.metadata
+    IdempotencyKey,
+)
+from flashcards_server.leases import JobLease  # noqa: F401, adds its table to Base.metadata
+from flashcards_server.versions import EntityVersion, bump_versions
+
+
+# The listeners whose order matters, in that order: the flush writing the
+# change log must include the deck states changed in place
+event.listen(Session, "before_commit", flag_changed_states)
+event.listen(Session, "before_commit", write_changes)
+
+
+#: Results of User.owns_deck, shared across requests and keyed by (user_id, deck_id)
+ownership_cache = TTLCache(maxsize=OWNERSHIP_CACHE_SIZE, ttl=OWNERSHIP_CACHE_TTL_SECONDS)
+
 
 class User(SQLAlchemyBaseUserTableUUID, Base):
     __tablename__ = "users"
@@ -36,36 +94,72 @@ class User(SQLAlchemyBaseUserTableUUID, Base):
         self, session: Session, offset: int = 0, limit: int = 100
     ) -> List[Deck]:
         """
-        Returns all the decks owned by this user.
+        Returns all the decks owned by this user, with their tags.
+
+        Decks and tags are loaded with a single joined query, so the cost
+        doesn't grow with the number of decks.
+
         :param session: the session (see flashcards_core.database:init_session()).
         :param offset: for pagination, index at which to start returning values.
         :param limit: for pagination, maximum number of elements to return.
         :returns: List of Decks.
         """
-        select = (
-            DeckOwner.select()
-            .where(DeckOwner.c.owner_id == self.id)
+        select_decks = (
+            select(Deck)
+            .join(DeckOwner, DeckOwner.c.deck_id == Deck.id)
+            .where(DeckOwner.c.owner_id == self.id, DeckOwner.c.deleted_at.is_(None))
+            .options(joinedload(Deck.tags))
+            .order_by(Deck.name, Deck.id)
             .offset(offset)
             .limit(limit)
         )
-        deck_owner_pairs = await session.execute(select)
-        return list([
-            await Deck.get_one_async(session=session, object_id=pair.deck_id)
-            for pair in deck_owner_pairs
-        ])
+        decks = await session.scalars(select_decks)
+        return list(decks.unique())
 
     async def owns_deck(self, session: Session, deck_id: UUID) -> bool:
         """
         Verify that the given deck is owned by this user.
+
+        The answer is remembered for the rest of the session, and for a few
+        seconds across requests (see ``ownership_cache``), so repeated checks
+        on the same deck don't hit the database.
+
         :param session: the session (see flashcards_core.database:init_session()).
         :param deck_id: the deck to check the ownership of.
         :returns: True if the user is the owner of this deck, False otherwise
         """
-        select = DeckOwner.select().where(
-            and_(DeckOwner.c.owner_id == self.id, DeckOwner.c.deck_id == deck_id)
-        )
-        deck_owner = await session.execute(select)
-        return len(list(deck_owner)) > 0
+        key = (self.id, deck_id)
+        session_memo = session.info.setdefault("owned_decks", {})
+        if key in session_memo:
+            return session_memo[key]
+
+        owned = ownership_cache.get(key)
+        if owned is None:
+            select_owner = select(DeckOwner.c.deck_id).where(
+                and_(
+                    DeckOwner.c.owner_id == self.id,
+                    DeckOwner.c.deck_id == deck_id,
+                    DeckOwner.c.deleted_at.is_(None),
+                )
+            )
+            owned = (await session.execute(select_owner)).first() is not None
+            ownership_cache.set(key, owned)
+
+        session_memo[key] = owned
+        return owned
+
+    def forget_deck_ownership(self, session: Session, deck_id: UUID) -> None:
+        """
+        Drop any remembered ownership check for this deck. To be called every
+        time the deck changes owner.
+
+        :param session: the session (see flashcards_core.database:init_session()).
+        :param deck_id: the deck whose ownership changed.
+        """
+        key = (self.id, deck_id)
+        session.info.get("owned_decks", {}).pop(key, None)
+        session.info.get("live_decks", {}).pop(deck_id, None)
+        ownership_cache.pop(key)
 
     async def create_deck(self, session: Session, deck_data: dict) -> Deck:
         """
@@ -76,23 +170,273 @@ class User(SQLAlchemyBaseUserTableUUID, Base):
         new_deck = await Deck.create_async(session=session, **deck_data)
         insert = DeckOwner.insert().values(owner_id=self.id, deck_id=new_deck.id)
         await session.execute(insert)
+        await bump_versions(session=session, keys=[("decks", self.id)])
         await session.commit()
+        self.forget_deck_ownership(session=session, deck_id=new_deck.id)
         await session.refresh(new_deck)
         return new_deck
 
+    async def share_deck(self, session: Session, deck_id: UUID, shared: bool = True) -> None:
+        """
+        Lets every user clone this deck of this user, or stops sharing it.
+
+        :param session: the session (see flashcards_core.database:init_db()).
+        :param deck_id: the ID of the deck to share.
+        :param shared: False to stop sharing the deck.
+        """
+        share = (
+            update(DeckOwner)
+            .where(DeckOwner.c.deck_id == deck_id, DeckOwner.c.owner_id == self.id)
+            .values(shared=shared)
+        )
+        await session.execute(share)
+        await session.commit()
+
+    async def can_clone_deck(self, session: Session, deck_id: UUID) -> bool:
+        """
+        Whether this user can clone the given deck: they own it, or its owner
+        shares it (see ``share_deck``).
+
+        :param session: the session (see flashcards_core.database:init_db()).
+        :param deck_id: the deck to clone.
+        """
+        if await self.owns_deck(session=session, deck_id=deck_id):
+            return True
+        select_shared = select(DeckOwner.c.deck_id).where(
+            DeckOwner.c.deck_id == deck_id,
+            DeckOwner.c.shared.is_(True),
+            DeckOwner.c.deleted_at.is_(None),
+        )
+        return (await session.execute(select_shared)).first() is not None
+
+    async def clone_deck(self, session: Session, deck_id: UUID) -> Deck:
+        """
+        Create a copy of the given deck and assign it to this user. Check
+        that the user can clone it first (see ``can_clone_deck``).
+
+        The cloned cards share the facts of the original ones: only the deck,
+        the cards and their tag and context associations are copied, with set
+        based inserts. Facts are copied later, the first time they're edited
+        (see ``fact_for_edit``). The clone starts with a fresh scheduler state
+        and no reviews.
+
+        :param deck_id: the ID of the deck to clone.
+        :param session: the session (see flashcards_core.database:init_db()).
+        :returns: the new deck.
+        """
+        deck_table = Deck.__table__
+        card_table = Card.__table__
+
+        select_deck = select(deck_table).where(deck_table.c.id == deck_id)
+        original_deck = (await session.execute(select_deck)).mappings().one()
+        new_deck = _copy_row(deck_table, original_deck, state={})
+        await session.execute(insert(deck_table), [new_deck])
+        await session.execute(
+            insert(DeckOwner), [{"owner_id": self.id, "deck_id": new_deck["id"]}]
+        )
+        await _copy_associations(
+            session=session,
+            table=Deck.tags.property.secondary,
+            source=deck_table,
+            select_sources=select(deck_table.c.id).where(deck_table.c.id == deck_id),
+            new_ids={deck_id: new_deck["id"]},
+        )
+
+        select_cards = select(card_table).where(card_table.c.deck_id == deck_id)
+        new_card_ids = {}
+        new_cards = []
+        for card in (await session.execute(select_cards)).mappings():
+            new_card = _copy_row(card_table, card, deck_id=new_deck["id"])
+            new_card_ids[card["id"]] = new_card["id"]
+            new_cards.append(new_card)
+        if new_cards:
+            await session.execute(insert(card_table), new_cards)
+            for association in _card_associations():
+                await _copy_associations(
+                    session=session,
+                    table=association,
+                    source=card_table,
+                    select_sources=select_cards.with_only_columns(card_table.c.id),
+                    new_ids=new_card_ids,
+                )
+
+        await bump_versions(
+            session=session, keys=[("decks", self.id), ("cards", new_deck["id"])]
+        )
+        await log_changes(session, "deck", [new_deck["id"]], "create", deck_id=new_deck["id"])
+        await log_changes(
+            session, "card", new_card_ids.values(), "create", deck_id=new_deck["id"]
+        )
+        await session.commit()
+        self.forget_deck_ownership(session=session, deck_id=new_deck["id"])
+        select_clone = (
+            select(Deck)
+            .where(Deck.id == new_deck["id"])
+            .options(selectinload(Deck.tags))
+        )
+        return (await session.scalars(select_clone)).one()
+
+    def _edited_decks(self, deck_id: Optional[UUID]):
+        """
+        A query of the decks a change is made for: this deck, or all the
+        decks of this user.
+        """
+        if deck_id is not None:
+            return select(literal(deck_id, GUID()))
+        return select(DeckOwner.c.deck_id).where(DeckOwner.c.owner_id == self.id)
+
+    async def fact_for_edit(
+        self, session: Session, fact_id: UUID, deck_id: Optional[UUID] = None
+    ) -> Optional[Fact]:
+        """
+        Returns the fact this user should change in place of the given one.
+
+        Cloned decks share their facts with the original deck (see
+        ``clone_deck``). If the fact is used by cards outside the edited
+        deck, it is copied with its tags and related facts, the cards of the
+        deck are pointed to the copy, and the copy is returned. Otherwise the
+        fact itself is returned.
+
+        :param fact_id: the ID of the fact to edit.
+        :param session: the session (see flashcards_core.database:init_db()).
+        :param deck_id: the deck the fact is edited for. Without it, only
+            facts used by no other user's decks can be edited.
+        :returns: the fact to edit, or None if it doesn't exist.
+        :raises SharedFactError: if the fact is used outside the edited
+            decks, and no deck was given or the deck doesn't use it: a copy
+            would be used by no card.
+        """
+        fact = await session.get(Fact, fact_id)
+        if not fact:
+            return None
+
+        fact_table = Fact.__table__
+        card_table = Card.__table__
+        my_decks = self._edited_decks(deck_id)
+        fact_contexts = _fact_contexts()
+        shows_fact = _shows_fact(fact_id, fact_contexts)
+        if not await _any_card(session, shows_fact, card_table.c.deck_id.not_in(my_decks)):
+            return fact
+        if deck_id is None or not await _any_card(
+            session, shows_fact, card_table.c.deck_id.in_(my_decks)
+        ):
+            raise SharedFactError(f"Fact '{fact_id}' is used by other decks")
+
+        select_my_cards = select(card_table.c.id, card_table.c.deck_id).where(
+            shows_fact, card_table.c.deck_id.in_(my_decks)
+        )
+        moved_cards = (await session.execute(select_my_cards)).all()
+
+        select_fact = select(fact_table).where(fact_table.c.id == fact_id)
+        new_fact = _copy_row(fact_table, (await session.execute(select_fact)).mappings().one())
+        await session.execute(insert(fact_table), [new_fact])
+        related_facts = _self_association(fact_table)
+        for association in [Fact.tags.property.secondary] + (
+            [related_facts[0]] if related_facts else []
+        ):
+            await _copy_associations(
+                session=session,
+                table=association,
+                source=fact_table,
+                select_sources=select(fact_table.c.id).where(fact_table.c.id == fact_id),
+                new_ids={fact_id: new_fact["id"]},
+            )
+        for column in (card_table.c.question_id, card_table.c.answer_id):
+            await session.execute(
+                update(card_table)
+                .where(column == fact_id, card_table.c.deck_id.in_(my_decks))
+                .values({column.name: new_fact["id"]})
+            )
+        for association, card_column, fact_column in fact_contexts:
+            my_cards = select(card_table.c.id).where(card_table.c.deck_id.in_(my_decks))
+            await session.execute(
+                update(association)
+                .where(fact_column == fact_id, card_column.in_(my_cards))
+                .values({fact_column.name: new_fact["id"]})
+            )
+        await bump_versions(session=session, facts=[new_fact["id"]])
+        await log_changes(session, "fact", [new_fact["id"]], "create")
+        for card_id, card_deck_id in moved_cards:
+            await log_changes(session, "card", [card_id], "update", deck_id=card_deck_id)
+        await session.commit()
+        return await session.get(Fact, new_fact["id"])
+
+    async def delete_fact(
+        self, session: Session, fact_id: UUID, deck_id: Optional[UUID] = None
+    ) -> bool:
+        """
+        Deletes the fact. While decks of other users still use it, it's only
+        removed from the context of the cards of the edited decks instead.
+
+        :param fact_id: the ID of the fact to delete.
+        :param session: the session (see flashcards_core.database:init_db()).
+        :param deck_id: the deck the fact is deleted from. All the decks of
+            this user by default.
+        :returns: False if the fact doesn't exist.
+        :raises SharedFactError: if the fact is used outside the edited decks,
+            and the cards of these decks don't use it, or show it as their
+            question or answer.
+        """
+        fact = await session.get(Fact, fact_id)
+        if not fact:
+            return False
+
+        card_table = Card.__table__
+        my_decks = self._edited_decks(deck_id)
+        fact_contexts = _fact_contexts()
+        shows_fact = _shows_fact(fact_id, fact_contexts)
+        if not await _any_card(session, shows_fact, card_table.c.deck_id.not_in(my_decks)):
+            await Fact.delete_async(session=session, object_id=fact_id)
+            return True
+
+        in_my_decks = card_table.c.deck_id.in_(my_decks)
+        is_question_or_answer = or_(
+            card_table.c.question_id == fact_id, card_table.c.answer_id == fact_id
+        )
+        if not await _any_card(session, shows_fact, in_my_decks) or await _any_card(
+            session, is_question_or_answer, in_my_decks
+        ):
+            raise SharedFactError(f"Fact '{fact_id}' is used by other decks")
+
+        select_my_cards = select(card_table.c.id, card_table.c.deck_id).where(
+            shows_fact, in_my_decks
+        )
+        detached_cards = (await session.execute(select_my_cards)).all()
+        for association, card_column, fact_column in fact_contexts:
+            my_cards = select(card_table.c.id).where(in_my_decks)
+            await session.execute(
+                delete(association).where(fact_column == fact_id, card_column.in_(my_cards))
+            )
+        await bump_versions(session=session, cards=[card_id for card_id, _ in detached_cards])
+        for card_id, card_deck_id in detached_cards:
+            await log_changes(session, "card", [card_id], "update", deck_id=card_deck_id)
+        await session.commit()
+        return True
+
     async def delete_deck(self, session: Session, deck_id: UUID) -> None:
         """
-        Remove the given deck from this user and delete it.
+        Remove the given deck from this user and mark it as deleted.
+
+        The deck disappears from every endpoint right away, but its rows are
+        removed later by ``purge_deck``, which should run as a background task.
+
         :param deck_id: the ID of the deck to remove.
         :param session: the session (see flashcards_core.database:init_db()).
         :returns: None.
         """
-        Deck.delete_async(session=session, object_id=deck_id)
-        delete = DeckOwner.delete().where(DeckOwner.c.deck_id == deck_id)
-        session.execute(delete)
-        session.commit()
-        session.refresh(self)
-
+        mark_deleted = (
+            update(DeckOwner)
+            .where(DeckOwner.c.deck_id == deck_id, DeckOwner.c.owner_id == self.id)
+            .values(deleted_at=datetime.utcnow())
+        )
+        await session.execute(mark_deleted)
+        await bump_versions(session=session, decks=[deck_id])
+        # Logged for the owner too: the deck's ownership goes away when it's purged
+        await log_changes(
+            session, "deck", [deck_id], "delete", deck_id=deck_id, owner_id=self.id
+        )
+        await session.commit()
+        self.forget_deck_ownership(session=session, deck_id=deck_id)
 
 
 #: Associative table for Decks and Users
@@ -101,24 +445,515 @@ DeckOwner = Table(
     Base.metadata,
     Column("deck_id", GUID(), ForeignKey(Deck.id), primary_key=True),
     Column("owner_id", GUID(), ForeignKey(User.id), nullable=False),
+    # Set when the deck is deleted: the deck is hidden until purge_deck removes it
+    Column("deleted_at", DateTime(), nullable=True),
+    # Whether every user can clone the deck, like a starter deck
+    Column("shared", Boolean(), nullable=False, default=False, server_default=false()),
 )
 
 
+def baseline_tables() -> List[Table]:
+    """
+    Returns the tables of flashcards-core (those of its models, mapped or
+    not, and their associative tables), and the users and deck owners
+    tables, in dependency order.
+    """
+    tables = {User.__table__, DeckOwner}
+    for mapper in Base.registry.mappers:
+        if mapper.class_.__module__.split(".")[0] == "flashcards_core":
+            tables.update(mapper.tables)
+            tables.update(
+                relationship.secondary
+                for relationship in mapper.relationships
+                if relationship.secondary is not None
+            )
+    for name, module in list(sys.modules.items()):
+        if name.split(".")[0] == "flashcards_core":
+            tables.update(value for value in vars(module).values() if isinstance(value, Table))
+    return [table for table in Base.metadata.sorted_tables if table in tables]
+
+
+def _is_indexed(column: Column) -> bool:
+    """
+    Whether lookups on this column can already use an index.
+    """
+    table = column.table
+    constraints = list(table.indexes) + [
+        constraint
+        for constraint in table.constraints
+        if isinstance(constraint, UniqueConstraint)
+    ]
+    leading_columns = [next(iter(constraint.columns), None) for constraint in constraints]
+    leading_columns.append(next(iter(table.primary_key.columns), None))
+    return bool(column.index or column.unique) or any(
+        leading_column is column for leading_column in leading_columns
+    )
+
+
+def _hot_path_columns() -> List[Column]:
+    columns = [
+        DeckOwner.c.owner_id,
+        Card.__table__.c.deck_id,
+        Review.__table__.c.card_id,
+        Tag.__table__.c.name,
+    ]
+    entity_tables = {model.__table__ for model in (User, Deck, Card, Fact, Tag, Review)}
+    for table in baseline_tables():
+        if table in entity_tables or table is DeckOwner:
+            continue
+        # Associative tables: the foreign keys are looked up from both sides
+        columns += [column for column in table.columns if column.foreign_keys]
+    return columns
+
+
+#: Indexes on the columns used by the most frequent lookups, where
+#: flashcards-core doesn't declare one. Created by the migrations.
+HOT_PATH_INDEXES = [
+    Index(f"ix_{column.table.name}_{column.name}", column)
+    for column in _hot_path_columns()
+    if not _is_indexed(column)
+]
+
+
+
+async def get_live_deck(session: Session, deck_id: UUID) -> Optional[Deck]:
+    """
+    Returns the deck with this ID, unless it doesn't exist or is being deleted.
+
+    The result is remembered for the rest of the session.
+
+    :param session: the session (see flashcards_core.database:init_db()).
+    :param deck_id: the ID of the deck to load.
+    :returns: the deck, or None.
+    """
+    session_memo = session.info.setdefault("live_decks", {})
+    if deck_id not in session_memo:
+        select_deck = (
+            select(Deck)
+            .join(DeckOwner, DeckOwner.c.deck_id == Deck.id)
+            .where(Deck.id == deck_id, DeckOwner.c.deleted_at.is_(None))
+        )
+        session_memo[deck_id] = (await session.scalars(select_deck)).first()
+    return session_memo[deck_id]
+
+
+class RelatedObject:
+    """
+    A card or fact seen as related to another one, through ``relationship``.
+    """
+
+    def __init__(self, obj, relationship: str):
+        self._obj = obj
+        self.relationship = relationship
+
+    def __getattr__(self, name):
+        return getattr(self._obj, name)
+
+
+async def load_related(session: Session, objects: List, options: Iterable = ()) -> None:
+    """
+    Sets ``related`` on each of these cards (or facts) to the list of cards
+    (or facts) related to it, with a single query for all of them, instead
+    of calling ``related_cards_async`` (or ``related_facts_async``) on each.
+
+    :param session: the session (see flashcards_core.database:init_db()).
+    :param objects: cards, or facts, all of the same kind.
+    :param options: loader options for the related objects.
+    """
+    if not objects:
+        return
+    model = type(objects[0])
+    for obj in objects:
+        obj.related = []
+    association = _self_association(model.__table__)
+    if association is None:
+        return
+    table, source_column, related_column = association
+    relationship_column = table.c.get("relationship", literal(""))
+    select_related = (
+        select(model, source_column, relationship_column)
+        .join(table, related_column == model.id)
+        .where(source_column.in_([obj.id for obj in objects]))
+        .options(*options)
+    )
+    by_id = {obj.id: obj for obj in objects}
+    for related, source_id, relationship in await session.execute(select_related):
+        by_id[source_id].related.append(RelatedObject(related, relationship))
+
+
+async def purge_deck(
+    deck_id: UUID,
+    batch_size: int = DECK_PURGE_BATCH_SIZE,
+    session_maker: Optional[sessionmaker] = None,
+) -> None:
+    """
+    Delete a deck marked as deleted, along with all the rows depending on it.
+
+    Cards are removed in batches together with their reviews, tags, contexts
+    and relationships, each batch in its own short transaction, so that other
+    writers never wait long for the database.
+
+    :param deck_id: the ID of the deck to purge.
+    :param batch_size: how many cards to delete in each transaction.
+    :param session_maker: sessions on the database of the deck (see
+        ``session_maker_like``). The main database by default.
+    """
+    session_maker = session_maker or async_session_maker
+    card_table = Card.__table__
+    deck_table = Deck.__table__
+
+    while True:
+        async with session_maker() as session:
+            select_batch = (
+                select(card_table.c.id).where(card_table.c.deck_id == deck_id).limit(batch_size)
+            )
+            card_ids = (await session.scalars(select_batch)).all()
+            if not card_ids:
+                break
+            for column in _dependent_columns(card_table):
+                await session.execute(delete(column.table).where(column.in_(card_ids)))
+            await session.execute(delete(card_table).where(card_table.c.id.in_(card_ids)))
+            await session.commit()
+        await asyncio.sleep(0)  # Let other requests go through between batches
+
+    async with session_maker() as session:
+        for column in _dependent_columns(deck_table):
+            if column.table is not DeckOwner:
+                await session.execute(delete(column.table).where(column == deck_id))
+        await session.execute(delete(DeckOwner).where(DeckOwner.c.deck_id == deck_id))
+        await session.execute(delete(deck_table).where(deck_table.c.id == deck_id))
+        await session.execute(
+            delete(EntityVersion).where(
+                EntityVersion.c.entity == "cards", EntityVersion.c.entity_id == deck_id
+            )
+        )
+        await session.commit()
+
+
+async def purge_deleted_decks(session_maker: Optional[sessionmaker] = None) -> None:
+    """
+    Purge all the decks marked as deleted, for example the ones left behind
+    by a restart before their background purge could complete.
+
+    :param session_maker: sessions on the database to purge, like a shard.
+        The main database by default.
+    """
+    session_maker = session_maker or async_session_maker
+    async with session_maker() as session:
+        select_deleted = select(DeckOwner.c.deck_id).where(DeckOwner.c.deleted_at.is_not(None))
+        deck_ids = (await session.scalars(select_deleted)).all()
+    for deck_id in deck_ids:
+        await purge_deck(deck_id, session_maker=session_maker)
+
+
+def _dependent_columns(target: Table) -> List[Column]:
+    """
+    Returns all the columns of the other tables holding a foreign key to ``target``.
+    """
+    return [
+        column
+        for table in Base.metadata.sorted_tables
+        if table is not target
+        for column in table.columns
+        if any(foreign_key.column.table is target for foreign_key in column.foreign_keys)
+    ]
+
+
+def _self_association(target: Table) -> Optional[Tuple[Table, Column, Column]]:
+    """
+    Returns the associative table relating rows of ``target`` to each other,
+    with the column of the source row and the column of the related one.
+    """
+    entity_tables = {model.__table__ for model in (User, Deck, Card, Fact, Tag, Review)}
+    for table in Base.metadata.sorted_tables:
+        if table is target or table in entity_tables:
+            continue
+        columns = [
+            column
+            for column in table.columns
+            if any(foreign_key.column.table is target for foreign_key in column.foreign_keys)
+        ]
+        if len(columns) == 2:
+            return table, columns[0], columns[1]
+    return None
+
+
+def _referencing_column(table: Table, target: Table) -> Column:
+    """
+    Returns the column of ``table`` holding a foreign key to ``target``, if any.
+    """
+    for column in table.columns:
+        if any(foreign_key.column.table is target for foreign_key in column.foreign_keys):
+            return column
+    return None
+
+
+class SharedFactError(Exception):
+    """
+    The fact is used by other decks, and can't be changed or deleted for the
+    edited decks alone (see ``User.fact_for_edit``).
+    """
+
+
+def _fact_contexts() -> List[Tuple[Table, Column, Column]]:
+    """
+    Returns the associative tables linking cards to their context facts, with
+    their card and fact columns.
+    """
+    fact_table, card_table = Fact.__table__, Card.__table__
+    return [
+        (
+            association,
+            _referencing_column(association, card_table),
+            _referencing_column(association, fact_table),
+        )
+        for association in _card_associations()
+        if _referencing_column(association, fact_table) is not None
+    ]
+
+
+def _shows_fact(fact_id: UUID, fact_contexts: List[Tuple[Table, Column, Column]]):
+    """
+    Filters the cards showing this fact, as their question, answer or context.
+    """
+    card_table = Card.__table__
+    return or_(
+        card_table.c.question_id == fact_id,
+        card_table.c.answer_id == fact_id,
+        *[
+            card_table.c.id.in_(select(card_column).where(fact_column == fact_id))
+            for _, card_column, fact_column in fact_contexts
+        ],
+    )
+
+
+async def _any_card(session: Session, *conditions) -> bool:
+    """
+    Whether some card matches these conditions.
+    """
+    select_card = select(Card.__table__.c.id).where(*conditions).limit(1)
+    return (await session.execute(select_card)).first() is not None
+
+
+def _card_associations() -> List[Table]:
+    """
+    Returns the associative tables linking cards to their tags and context facts.
+    """
+    return [
+        relationship.secondary
+        for relationship in Card.__mapper__.relationships
+        if relationship.secondary is not None and relationship.mapper.class_ in (Fact, Tag)
+    ]
+
+
+def _copy_row(table: Table, row: dict, **values) -> dict:
+    """
+    Returns a copy of this row, with new values for the surrogate primary keys.
+
+    :param table: the table the row belongs to.
+    :param row: the row to copy.
+    :param values: values to override in the copy.
+    """
+    new_row = dict(row, **values)
+    for column in table.primary_key.columns:
+        if column.foreign_keys or column.name in values:
+            continue
+        if isinstance(column.type, GUID):
+            new_row[column.name] = uuid4()
+        else:
+            del new_row[column.name]  # Let the database assign it
+    return new_row
+
+
+async def _copy_associations(
+    session: Session,
+    table: Table,
+    source: Table,
+    select_sources,
+    new_ids: dict,
+) -> None:
+    """
+    Copies the rows of an associative table, pointing them to new objects.
+
+    :param table: the associative table.
+    :param source: the table of the objects being copied.
+    :param select_sources: a query returning the IDs of the objects being copied.
+    :param new_ids: maps the ID of every object being copied to the ID of its copy.
+    """
+    source_column = _referencing_column(table, source)
+    select_rows = select(table).where(source_column.in_(select_sources.scalar_subquery()))
+    rows = [
+        _copy_row(table, row, **{source_column.name: new_ids[row[source_column.name]]})
+        for row in (await session.execute(select_rows)).mappings()
+    ]
+    if rows:
+        await session.execute(insert(table), rows)
+
+
+def create_database_engine(
+    url: str = SQLALCHEMY_DATABASE_URL,
+    pool_size: int = DATABASE_POOL_SIZE,
+    max_overflow: int = DATABASE_MAX_OVERFLOW,
+    pool_pre_ping: bool = DATABASE_POOL_PRE_PING,
+    statement_cache_size: int = DATABASE_STATEMENT_CACHE_SIZE,
+    echo: bool = DATABASE_ECHO,
+) -> AsyncEngine:
+    """
+    Creates an async engine for this database. Defaults come from constants.py.
+
+    :param url: the database URL, with an async driver (aiosqlite or asyncpg).
+    :param pool_size: how many connections to keep open. Not used with SQLite.
+    :param max_overflow: how many more connections to open under load. Not
+        used with SQLite.
+    :param pool_pre_ping: whether to check connections before using them.
+    :param statement_cache_size: how many compiled statements to cache. With
+        asyncpg, also how many prepared statements to cache on each connection.
+    :param echo: whether to log every statement.
+    :returns: the engine.
+    """
+    url = make_url(url)
+    options = {
+        "echo": echo,
+        "pool_pre_ping": pool_pre_ping,
+        "query_cache_size": statement_cache_size,
+    }
+    if url.get_backend_name() != "sqlite":
+        options.update(pool_size=pool_size, max_overflow=max_overflow)
+    if url.get_driver_name() == "asyncpg":
+        options["connect_args"] = {"prepared_statement_cache_size": statement_cache_size}
+    return create_async_engine(url, **options)
+
+
+def create_sqlite_engines(
+    url: str = SQLALCHEMY_DATABASE_URL,
+    readers: int = SQLITE_READERS,
+    write_timeout: float = SQLITE_WRITE_TIMEOUT,
+    pragmas: dict = SQLITE_PRAGMAS,
+    statement_cache_size: int = DATABASE_STATEMENT_CACHE_SIZE,
+    echo: bool = DATABASE_ECHO,
+) -> Tuple[AsyncEngine, AsyncEngine]:
+    """
+    Creates the engines for a SQLite database in WAL mode: a writer engine
+    with a single connection, and a reader engine with a pool of read-only
+    connections. Defaults come from constants.py.
+
+    In WAL mode readers don't block the writer and the writer doesn't block
+    readers, but SQLite still allows one writer at a time. Funneling every
+    write through a single connection makes writes wait in line in the pool
+    queue, rather than fail with "database is locked".
+
+    :param url: the database URL (sqlite+aiosqlite).
+    :param readers: how many read-only connections to open.
+    :param write_timeout: how many seconds a write waits for the writer
+        connection before failing.
+    :param pragmas: the pragmas to set on every connection.
+    :param statement_cache_size: how many compiled statements to cache.
+    :param echo: whether to log every statement.
+    :returns: the writer and the reader engines.
+    """
+    url = make_url(url)
+    read_only_url = url.set(database=f"file:{url.database}").update_query_dict(
+        {"mode": "ro", "uri": "true"}
+    )
+    options = {
+        "echo": echo,
+        "query_cache_size": statement_cache_size,
+        "poolclass": AsyncAdaptedQueuePool,
+        "max_overflow": 0,
+    }
+    writer = create_async_engine(url, pool_size=1, pool_timeout=write_timeout, **options)
+    reader = create_async_engine(read_only_url, pool_size=readers, **options)
+
+    writer_pragmas = dict(pragmas)
+    reader_pragmas = {name: value for name, value in pragmas.items() if name != "journal_mode"}
+
+    @event.listens_for(writer.sync_engine, "connect")
+    def set_writer_pragmas(dbapi_connection, connection_record):
+        _set_pragmas(dbapi_connection, writer_pragmas)
+
+    @event.listens_for(reader.sync_engine, "connect")
+    def set_reader_pragmas(dbapi_connection, connection_record):
+        _set_pragmas(dbapi_connection, reader_pragmas)
+
+    return writer, reader
+
+
+def _set_pragmas(dbapi_connection, pragmas: dict) -> None:
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+if SQLITE_WAL_MODE and make_url(SQLALCHEMY_DATABASE_URL).get_backend_name() == "sqlite":
+    engine, read_engine = create_sqlite_engines()
+else:
+    engine = read_engine = create_database_engine()
 
-DATABASE_URL = "sqlite+aiosqlite:///./test.db"
-engine = create_async_engine(DATABASE_URL)
 async_session_maker = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+#: Sessions for requests that only read. Use the writer engine unless in SQLite WAL mode
+read_session_maker = sessionmaker(read_engine, class_=AsyncSession, expire_on_commit=False)
+
+
+class _BatchSyncSession(Session):
+    """
+    The sync session of a BatchSession: code given to ``run_sync``, like the
+    schedulers, only flushes when it commits too.
+    """
+
+    def commit(self) -> None:
+        self.flush()
+
+
+class BatchSession(AsyncSession):
+    """
+    A session that runs many operations in one transaction: ``commit()`` only
+    flushes, and the transaction is committed by ``commit_batch()``.
+    """
+
+    sync_session_class = _BatchSyncSession
+    rolled_back = False
+
+    async def rollback(self) -> None:
+        # Also undoes the operations before this one: the batch must fail
+        self.rolled_back = True
+        await super().rollback()
+
+    async def commit_batch(self) -> None:
+        await self.run_sync(Session.commit)
+
 
 async def create_db_and_tables():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
 
-async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
-    async with async_session_maker() as session:
+def is_read_only(request: Request) -> bool:
+    """
+    Whether this request can be served with a read-only session: GET
+    requests, except for studying, which updates the scheduler.
+    """
+    return request.method in ("GET", "HEAD") and not request.url.path.startswith("/study/")
+
+
+async def get_async_session(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    session_maker = read_session_maker if is_read_only(request) else async_session_maker
+    async with session_maker() as session:
         yield session
 
 
+def session_maker_like(session: AsyncSession, class_=AsyncSession) -> sessionmaker:
+    """
+    Sessions on the same database as this one, which is the shard of the
+    user if sharding is on. For work outliving the request's session, like
+    background tasks and streamed responses.
+
+    :param session: the session of the request.
+    :param class_: the class of the sessions.
+    """
+    return sessionmaker(session.bind, class_=class_, expire_on_commit=False)
+
+
 async def get_user_db(session: AsyncSession = Depends(get_async_session)):
     yield SQLAlchemyUserDatabase(session, User)
@@ -0,0 +1,384 @@
+import asyncio
+import logging
+from functools import lru_cache
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple
+from uuid import UUID
+
+from sqlalchemy import Table, event, select, union_all
+from sqlalchemy.engine import URL
+from sqlalchemy.orm import Session, sessionmaker
+
+from flashcards_server.changelog import ChangeLog, is_cursor_expired, latest_seq
+from flashcards_server.constants import (
+    EVENTS_MAX_STREAMS,
+    EVENTS_POLL_SECONDS,
+    EVENTS_QUEUE_SIZE,
+    SYNC_BATCH_SIZE,
+)
+from flashcards_server.database import (
+    Base,
+    Card,
+    Deck,
+    Fact,
+    Tag,
+    _referencing_column,
+    session_maker_like,
+)
+
+logger = logging.getLogger(__name__)
+
+#: The event telling a client it missed events, and must fetch the deck again
+RESYNC = "resync"
+
+
+class Subscriber:
+    """
+    A client following the changes of one deck. Its events wait in a bounded
+    queue: when the client is too slow and the queue is full, the events are
+    dropped and replaced by a single resync event.
+    """
+
+    def __init__(
+        self, deck_id: UUID, user_id: UUID, queue_size: int = EVENTS_QUEUE_SIZE
+    ):
+        self.deck_id = deck_id
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+
+    def put(self, deck_event: dict) -> None:
+        try:
+            self.queue.put_nowait(deck_event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"seq": deck_event["seq"], "event": RESYNC})
+
+
+def _links(target: Table) -> List[Tuple]:
+    """
+    The queries finding the decks that show objects of ``target`` (facts or
+    tags): through their cards, like questions and contexts, or directly,
+    like the tags of the decks.
+    """
+    cards, decks = Card.__table__, Deck.__table__
+    queries = []
+    for table in Base.metadata.sorted_tables:
+        deck_column = _referencing_column(table, decks)
+        card_column = _referencing_column(table, cards)
+        for column in table.columns:
+            if not any(
+                foreign_key.column.table is target
+                for foreign_key in column.foreign_keys
+            ):
+                continue
+            if deck_column is not None:
+                queries.append((select(column, deck_column), column, deck_column))
+            elif card_column is not None:
+                query = select(column, cards.c.deck_id).join(
+                    cards, cards.c.id == card_column
+                )
+                queries.append((query, column, cards.c.deck_id))
+    return queries
+
+
+#: The tables of the entities shown in decks without belonging to one
+_SHARED_ENTITIES = {"fact": Fact.__table__, "tag": Tag.__table__}
+
+
+@lru_cache(maxsize=None)
+def _shared_links(entity: str) -> List[Tuple]:
+    return _links(_SHARED_ENTITIES[entity])
+
+
+async def deck_events(
+    session: Session, changes: Iterable, deck_ids: Set[UUID]
+) -> List[Tuple[UUID, dict]]:
+    """
+    Finds which of these decks each change of the log is about. Cards,
+    reviews and the decks themselves have their deck in the log, facts and
+    tags are looked up: one query for each, if any changed.
+
+    :param session: the session (see flashcards_core.database:init_db()).
+    :param changes: rows of the change log.
+    :param deck_ids: the decks to find events for.
+    :returns: (deck ID, event) pairs, in the order of the log. Changes
+        seen only by one user have an ``owner_id``.
+    """
+    changes = list(changes)
+    shared_ids: Dict[str, Set[UUID]] = {entity: set() for entity in _SHARED_ENTITIES}
+    for change in changes:
+        if (
+            change.deck_id is None
+            and change.owner_id is None
+            and change.entity in shared_ids
+        ):
+            shared_ids[change.entity].add(change.entity_id)
+
+    decks_of: Dict[Tuple[str, UUID], Set[UUID]] = {}
+    for entity, ids in shared_ids.items():
+        if not ids or not deck_ids:
+            continue
+        select_decks = union_all(
+            *(
+                query.where(column.in_(ids), deck_column.in_(deck_ids))
+                for query, column, deck_column in _shared_links(entity)
+            )
+        )
+        for entity_id, deck_id in await session.execute(select_decks):
+            decks_of.setdefault((entity, entity_id), set()).add(deck_id)
+
+    events = []
+    for change in changes:
+        if change.deck_id is not None:
+            targets = {change.deck_id} & deck_ids
+        else:
+            targets = decks_of.get((change.entity, change.entity_id), set())
+        for deck_id in targets:
+            deck_event = {
+                "seq": change.seq,
+                "entity": change.entity,
+                "id": change.entity_id,
+                "op": change.op,
+            }
+            if change.owner_id is not None:
+                deck_event["owner_id"] = change.owner_id
+            events.append((deck_id, deck_event))
+    return events
+
+
+def _select_changes(after: int, limit: int):
+    return (
+        select(
+            ChangeLog.c.seq,
+            ChangeLog.c.entity,
+            ChangeLog.c.entity_id,
+            ChangeLog.c.op,
+            ChangeLog.c.deck_id,
+            ChangeLog.c.owner_id,
+        )
+        .where(ChangeLog.c.seq > after)
+        .order_by(ChangeLog.c.seq)
+        .limit(limit)
+    )
+
+
+async def replay_events(
+    session: Session,
+    deck_id: UUID,
+    user_id: UUID,
+    since: int,
+    limit: int = SYNC_BATCH_SIZE,
+) -> Optional[List[dict]]:
+    """
+    The events of this deck after the cursor ``since``, for a client
+    reconnecting with Last-Event-ID.
+
+    :param user_id: the user following the deck.
+    :returns: the events, or None if some were pruned from the log or there
+        are more than ``limit``: the client must fetch the deck again.
+    """
+    if await is_cursor_expired(session=session, since=since):
+        return None
+    maybe_visible = (ChangeLog.c.deck_id == deck_id) | (
+        ChangeLog.c.deck_id.is_(None) & ChangeLog.c.entity.in_(_SHARED_ENTITIES)
+    )
+    changes = (
+        await session.execute(_select_changes(since, limit + 1).where(maybe_visible))
+    ).all()
+    if len(changes) > limit:
+        return None
+    return [
+        deck_event
+        for _, deck_event in await deck_events(session, changes, deck_ids={deck_id})
+        if deck_event.get("owner_id", user_id) == user_id
+    ]
+
+
+class EventHub:
+    """
+    Follows the change log of one database, and sends the events of each
+    deck to its subscribers. It runs while there are subscribers: one query
+    every ``poll_seconds`` whatever their number, or right after a commit of
+    this worker logged changes.
+
+    The change log is shared by the workers, so each one sees the changes of
+    the others at its next poll.
+    """
+
+    def __init__(
+        self,
+        session_maker: sessionmaker,
+        poll_seconds: float = EVENTS_POLL_SECONDS,
+        batch_size: int = SYNC_BATCH_SIZE,
+    ):
+        self.session_maker = session_maker
+        self.poll_seconds = poll_seconds
+        self.batch_size = batch_size
+        self._subscribers: Dict[UUID, Set[Subscriber]] = {}
+        self._wake = asyncio.Event()
+        self._started = asyncio.Event()
+        self._start_error: Optional[Exception] = None
+        self._task: Optional[asyncio.Task] = None
+        self.last_seq = 0
+
+    def __len__(self) -> int:
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    async def subscribe(self, deck_id: UUID, user_id: UUID) -> Subscriber:
+        """
+        Starts sending the events of this deck committed from now on.
+        """
+        subscriber = Subscriber(deck_id=deck_id, user_id=user_id)
+        self._subscribers.setdefault(deck_id, set()).add(subscriber)
+        if self._task is None or self._task.done():
+            self._started.clear()
+            self._start_error = None
+            self._task = asyncio.ensure_future(self._run())
+        await self._started.wait()
+        if self._start_error is not None:
+            self.unsubscribe(subscriber)
+            raise self._start_error
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        subscribers = self._subscribers.get(subscriber.deck_id, set())
+        subscribers.discard(subscriber)
+        if not subscribers:
+            self._subscribers.pop(subscriber.deck_id, None)
+        if not self._subscribers:
+            self.wake()  # To stop
+
+    def wake(self) -> None:
+        """
+        Reads the change log now, instead of at the next poll.
+        """
+        self._wake.set()
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _run(self) -> None:
+        try:
+            async with self.session_maker() as session:
+                self.last_seq = await latest_seq(session=session)
+        except Exception as exc:
+            self._start_error = exc
+            return
+        finally:
+            self._started.set()
+        while self._subscribers:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.poll()
+            except Exception:
+                logger.exception("Could not read the change log for the deck events")
+
+    async def poll(self) -> None:
+        """
+        Sends the events logged since the last poll.
+        """
+        async with self.session_maker() as session:
+            while self._subscribers:
+                changes = (
+                    await session.execute(
+                        _select_changes(self.last_seq, self.batch_size)
+                    )
+                ).all()
+                if not changes:
+                    return
+                events = await deck_events(
+                    session, changes, deck_ids=set(self._subscribers)
+                )
+                for deck_id, deck_event in events:
+                    for subscriber in self._subscribers.get(deck_id, ()):
+                        if (
+                            deck_event.get("owner_id", subscriber.user_id)
+                            == subscriber.user_id
+                        ):
+                            subscriber.put(deck_event)
+                self.last_seq = changes[-1].seq
+                if len(changes) < self.batch_size:
+                    return
+
+
+def _database_key(url: URL) -> Hashable:
+    """
+    Identifies the database of an engine: the read-only engine of SQLite in
+    WAL mode opens the same file as the writer, with another URL.
+    """
+    database = url.database or ""
+    if database.startswith("file:"):
+        database = database.replace("file:", "", 1)
+    return url.get_backend_name(), url.host, url.port, database
+
+
+class EventHubs:
+    """
+    The hubs of this worker, one for each database with subscribers: the
+    main one, or the shards of the users following their decks.
+    """
+
+    def __init__(self, max_streams: int = EVENTS_MAX_STREAMS):
+        self.max_streams = max_streams
+        self._hubs: Dict[Hashable, EventHub] = {}
+
+    def __len__(self) -> int:
+        return sum(len(hub) for hub in self._hubs.values())
+
+    async def subscribe(
+        self, session: Session, deck_id: UUID, user_id: UUID
+    ) -> Subscriber:
+        """
+        Follows this deck, in the database of this session.
+
+        :param session: the session of the request.
+        """
+        key = _database_key(session.bind.url)
+        if key not in self._hubs:
+            self._hubs[key] = EventHub(session_maker_like(session))
+        return await self._hubs[key].subscribe(deck_id=deck_id, user_id=user_id)
+
+    def unsubscribe(self, session: Session, subscriber: Subscriber) -> None:
+        """
+        Stops following the deck, and forgets the hub if nobody else follows
+        a deck of its database.
+        """
+        key = _database_key(session.bind.url)
+        hub = self._hubs.get(key)
+        if hub is not None:
+            hub.unsubscribe(subscriber)
+            if not len(hub):
+                del self._hubs[key]
+
+    def wake(self, url: URL) -> None:
+        hub = self._hubs.get(_database_key(url))
+        if hub is not None:
+            hub.wake()
+
+    async def close_all(self) -> None:
+        hubs, self._hubs = list(self._hubs.values()), {}
+        await asyncio.gather(*(hub.close() for hub in hubs))
+
+
+#: The event hubs of this worker
+event_hubs = EventHubs()
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_event_hubs(session):
+    """
+    Sends the changes this commit logged to the streams of this worker now.
+    """
+    if session.info.pop("logged_changes", False):
+        event_hubs.wake(session.get_bind().url)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_logged_changes(session, previous_transaction):
+    session.info.pop("logged_changes", None)
@@ -0,0 +1,341 @@
+import asyncio
+import hashlib
+import json
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional, Tuple, Type
+from uuid import UUID, uuid4
+
+from fastapi import HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Index,
+    Integer,
+    String,
+    Table,
+    Text,
+    and_,
+    delete,
+    or_,
+    select,
+    update,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, sessionmaker
+
+from flashcards_core.guid import GUID
+from flashcards_core.database import Base
+
+from flashcards_server.constants import (
+    IDEMPOTENCY_KEY_TTL_HOURS,
+    IDEMPOTENCY_LOCK_SECONDS,
+    IDEMPOTENCY_WAIT_SECONDS,
+)
+
+#: The requests sent with an Idempotency-Key header, and their responses. A
+#: row without ``status`` is a request still running: it holds the key.
+IdempotencyKey = Table(
+    "idempotency_keys",
+    Base.metadata,
+    Column("user_id", GUID(), primary_key=True),
+    Column("key", String(255), primary_key=True),
+    # Hash of the method, path and body: a key can't be reused for another request
+    Column("fingerprint", String(64), nullable=False),
+    # Identifies the request holding the key
+    Column("token", GUID(), nullable=False),
+    Column("status", Integer(), nullable=True),
+    Column("response", Text(), nullable=True),
+    Column("created_at", DateTime(), nullable=False),
+    Index("ix_idempotency_keys_created_at", "created_at"),
+)
+
+#: The header clients send a unique key in, the same one for all the retries
+HEADER = "Idempotency-Key"
+
+#: How often a retry checks whether the request it repeats finished, in seconds
+_WAIT_POLL_SECONDS = 0.2
+
+_UPSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+#: Set when the request holding a key in this worker finishes, by (user ID, key)
+_finished: Dict[Tuple[UUID, str], asyncio.Event] = {}
+
+
+def fingerprint(method: str, path: str, body: bytes) -> str:
+    return hashlib.sha256(
+        method.encode() + b" " + path.encode() + b"\n" + body
+    ).hexdigest()
+
+
+async def claim_key(
+    session: Session, user_id: UUID, key: str, fingerprint: str, token: UUID
+) -> Optional[dict]:
+    """
+    Takes the key for this request, unless another request has it: one
+    running, or one that finished less than IDEMPOTENCY_KEY_TTL_HOURS ago.
+    Keys held for more than IDEMPOTENCY_LOCK_SECONDS by a request that never
+    finished are taken over.
+
+    :param session: the session (see flashcards_core.database:init_db()).
+    :param token: identifies this request.
+    :returns: None if the key was taken, otherwise the row of the request
+        holding it.
+    """
+    now = datetime.utcnow()
+    insert = _UPSERTS[session.bind.dialect.name]
+    upsert = insert(IdempotencyKey).values(
+        user_id=user_id, key=key, fingerprint=fingerprint, token=token, created_at=now
+    )
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[IdempotencyKey.c.user_id, IdempotencyKey.c.key],
+        set_={
+            "fingerprint": upsert.excluded.fingerprint,
+            "token": upsert.excluded.token,
+            "status": None,
+            "response": None,
+            "created_at": upsert.excluded.created_at,
+        },
+        where=or_(
+            IdempotencyKey.c.created_at
+            < now - timedelta(hours=IDEMPOTENCY_KEY_TTL_HOURS),
+            and_(
+                IdempotencyKey.c.status.is_(None),
+                IdempotencyKey.c.fingerprint == upsert.excluded.fingerprint,
+                IdempotencyKey.c.created_at
+                < now - timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS),
+            ),
+        ),
+    )
+    await session.execute(upsert)
+    row = (
+        (
+            await session.execute(
+                select(IdempotencyKey).where(
+                    IdempotencyKey.c.user_id == user_id, IdempotencyKey.c.key == key
+                )
+            )
+        )
+        .mappings()
+        .one()
+    )
+    await session.commit()
+    return None if row["token"] == token else dict(row)
+
+
+async def store_response(
+    session: Session, user_id: UUID, key: str, token: UUID, status: int, response: str
+) -> bool:
+    """
+    Saves the response of the request holding the key, in the session's
+    transaction: commit it with the changes of the request.
+
+    :returns: whether the request still held the key. If not, it was taken
+        over by a retry, and the transaction must be rolled back.
+    """
+    stored = await session.execute(
+        update(IdempotencyKey)
+        .where(
+            IdempotencyKey.c.user_id == user_id,
+            IdempotencyKey.c.key == key,
+            IdempotencyKey.c.token == token,
+        )
+        .values(status=status, response=response)
+    )
+    return stored.rowcount == 1
+
+
+async def release_key(session: Session, user_id: UUID, key: str, token: UUID) -> None:
+    """
+    Gives the key back after the request failed, for its retries to run.
+    """
+    await session.execute(
+        delete(IdempotencyKey).where(
+            IdempotencyKey.c.user_id == user_id,
+            IdempotencyKey.c.key == key,
+            IdempotencyKey.c.token == token,
+        )
+    )
+    await session.commit()
+
+
+async def prune_idempotency_keys(
+    session: Session, ttl_hours: float = IDEMPOTENCY_KEY_TTL_HOURS
+) -> None:
+    """
+    Deletes the keys older than their time to live.
+
+    :param session: the session (see flashcards_core.database:init_db()).
+    :param ttl_hours: how many hours keys are kept for.
+    """
+    oldest_kept = datetime.utcnow() - timedelta(hours=ttl_hours)
+    await session.execute(
+        delete(IdempotencyKey).where(IdempotencyKey.c.created_at < oldest_kept)
+    )
+    await session.commit()
+
+
+def _replay(row: dict) -> Response:
+    return Response(
+        content=row["response"],
+        status_code=row["status"],
+        media_type="application/json",
+        headers={"Idempotent-Replayed": "true"},
+    )
+
+
+async def _wait_for(user_id: UUID, key: str, timeout: float) -> None:
+    """
+    Waits until the request holding the key in this worker finishes, or for
+    ``timeout`` seconds if it runs in another worker.
+    """
+    finished = _finished.get((user_id, key))
+    if finished is None:
+        await asyncio.sleep(timeout)
+        return
+    try:
+        await asyncio.wait_for(finished.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def _claim(
+    session_maker: sessionmaker,
+    user_id: UUID,
+    key: str,
+    request_fingerprint: str,
+    token: UUID,
+) -> Optional[Response]:
+    """
+    Claims the key, waiting for the request holding it to finish if needed.
+
+    :returns: None once the key is claimed, or the response of the request
+        that had it, to replay.
+    """
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        async with session_maker() as session:
+            holder = await claim_key(
+                session, user_id, key, fingerprint=request_fingerprint, token=token
+            )
+        if holder is None:
+            return None
+        if holder["fingerprint"] != request_fingerprint:
+            raise HTTPException(
+                status_code=422, detail=f"This {HEADER} was used for another request"
+            )
+        if holder["status"] is not None:
+            return _replay(holder)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise HTTPException(
+                status_code=409,
+                detail=f"The request with this {HEADER} is still running",
+                headers={"Retry-After": "1"},
+            )
+        await _wait_for(user_id, key, min(remaining, _WAIT_POLL_SECONDS))
+
+
+async def _run_and_store(
+    batch_session_maker: sessionmaker,
+    user_id: UUID,
+    key: str,
+    token: UUID,
+    run: Callable[[Session], Awaitable],
+    schema: Type[BaseModel],
+) -> str:
+    """
+    Runs the request, and commits its changes together with its response.
+
+    :param batch_session_maker: BatchSession sessions.
+    :returns: the response, serialized.
+    """
+    async with batch_session_maker() as session:
+        result = await run(session)
+        if session.rolled_back:
+            raise HTTPException(
+                status_code=409, detail="The request rolled back its transaction"
+            )
+        response = json.dumps(jsonable_encoder(schema.from_orm(result)))
+        if not await store_response(session, user_id, key, token, 200, response):
+            await session.rollback()
+            raise HTTPException(
+                status_code=409,
+                detail=f"The request with this {HEADER} took too long, and was retried",
+            )
+        await session.commit_batch()
+    return response
+
+
+async def run_idempotently(
+    request: Request,
+    session: Session,
+    user_id: UUID,
+    run: Callable[[Session], Awaitable],
+    schema: Type[BaseModel],
+):
+    """
+    Runs a request at most once for each Idempotency-Key its client sends,
+    so that clients can retry it safely.
+
+    The changes of the request and its response are committed together, and
+    the retries get the same response without running it again. Retries
+    sent while it runs wait for it to finish. If it fails, nothing is saved
+    and the next retry runs it again. Without the header, ``run`` is just
+    called with the session.
+
+    With the header, the session of the request is closed: the request runs
+    in a session of its own.
+
+    :param request: the request.
+    :param session: the session of the request.
+    :param user_id: the user sending it: keys are unique to each user.
+    :param run: runs the request with the session it's given, and returns
+        the result.
+    :param schema: the response model of the route.
+    :returns: the result, serialized.
+    """
+    key = request.headers.get(HEADER)
+    if key is None:
+        return await run(session)
+    if not key or len(key) > IdempotencyKey.c.key.type.length:
+        raise HTTPException(
+            status_code=400,
+            detail=f"{HEADER} must have 1 to {IdempotencyKey.c.key.type.length} characters",
+        )
+    # database.py imports this module for its table
+    from flashcards_server.database import BatchSession, session_maker_like
+
+    request_fingerprint = fingerprint(
+        request.method, request.url.path, await request.body()
+    )
+    # Authenticating may have taken a connection: give it back first, as in
+    # SQLite WAL mode the claim needs the only writer connection
+    await session.close()
+    session_maker = session_maker_like(session)
+    token = uuid4()
+    replay = await _claim(session_maker, user_id, key, request_fingerprint, token)
+    if replay is not None:
+        return replay
+
+    finished = _finished[(user_id, key)] = asyncio.Event()
+    try:
+        response = await _run_and_store(
+            session_maker_like(session, class_=BatchSession),
+            user_id,
+            key,
+            token,
+            run,
+            schema,
+        )
+    except BaseException:
+        async with session_maker() as release_session:
+            await asyncio.shield(release_key(release_session, user_id, key, token))
+        raise
+    finally:
+        finished.set()
+        if _finished.get((user_id, key)) is finished:
+            del _finished[(user_id, key)]
+    return Response(content=response, media_type="application/json")
@@ -0,0 +1,392 @@
+import asyncio
+import logging
+import math
+import os
+import random
+import socket
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Union
+from uuid import uuid4
+
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+from flashcards_server.archive import archive_reviews
+from flashcards_server.changelog import prune_change_log
+from flashcards_server.constants import (
+    CHANGE_LOG_PRUNE_SCHEDULE,
+    DECK_PURGE_INTERVAL_SECONDS,
+    IDEMPOTENCY_PRUNE_INTERVAL_SECONDS,
+    JOB_JITTER_SECONDS,
+    REVIEW_ARCHIVE_AFTER_DAYS,
+    REVIEW_ARCHIVE_SCHEDULE,
+    SHARD_IDLE_SECONDS,
+    SHARDING_ENABLED,
+    SQLITE_ANALYZE_SCHEDULE,
+    SQLITE_VACUUM_SCHEDULE,
+)
+from flashcards_server.database import async_session_maker, engine, purge_deleted_decks
+from flashcards_server.idempotency import prune_idempotency_keys
+from flashcards_server.leases import acquire_lease
+from flashcards_server.metrics import JOB_DURATION, JOB_LAST_SUCCESS, JOB_SKIPPED
+from flashcards_server.shards import ShardEngines, shard_engines
+
+logger = logging.getLogger(__name__)
+
+
+class IntervalTrigger:
+    """
+    Runs every ``seconds``. Run times are aligned on the epoch, so that all
+    the workers agree on them.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+    def next_run(self, after: datetime) -> datetime:
+        """
+        :param after: a naive UTC datetime.
+        :returns: the first run time strictly after it.
+        """
+        timestamp = after.replace(tzinfo=timezone.utc).timestamp()
+        run_at = (math.floor(timestamp / self.seconds) + 1) * self.seconds
+        return datetime.fromtimestamp(run_at, timezone.utc).replace(tzinfo=None)
+
+    def previous_run(self, before: datetime) -> datetime:
+        """
+        :param before: a naive UTC datetime.
+        :returns: the last run time before it, or at it.
+        """
+        return self.next_run(before - timedelta(seconds=self.seconds))
+
+
+class CronTrigger:
+    """
+    Runs at the times matching a cron expression, in UTC: ``minute hour
+    day-of-month month day-of-week``. Fields take ``*``, numbers, ranges
+    (``1-5``), lists (``1,15``) and steps (``*/10``, ``0-30/5``). Sunday is 0.
+    """
+
+    _RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expressions have 5 fields, got '{expression}'")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = [
+            self._parse(field, low, high)
+            for field, (low, high) in zip(fields, self._RANGES)
+        ]
+        # Like cron: if both days are restricted, either of them matches
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    @staticmethod
+    def _parse(field: str, low: int, high: int) -> Set[int]:
+        values = set()
+        for part in field.split(","):
+            part, _, step = part.partition("/")
+            if part == "*":
+                start, end = low, high
+            elif "-" in part:
+                start, end = (int(value) for value in part.split("-"))
+            else:
+                start = end = int(part)
+            if start < low or end > high or start > end:
+                raise ValueError(f"'{field}' is out of range {low}-{high}")
+            values.update(range(start, end + 1, int(step) if step else 1))
+        return values
+
+    def _day_matches(self, day: datetime) -> bool:
+        day_matches = day.day in self.days
+        weekday_matches = (day.weekday() + 1) % 7 in self.weekdays
+        if self._any_day:
+            return weekday_matches
+        if self._any_weekday:
+            return day_matches
+        return day_matches or weekday_matches
+
+    def next_run(self, after: datetime) -> datetime:
+        """
+        :param after: a naive UTC datetime.
+        :returns: the first run time strictly after it.
+        """
+        run_at = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        give_up_at = run_at + timedelta(days=366 * 5)
+        while run_at < give_up_at:
+            if run_at.month not in self.months or not self._day_matches(run_at):
+                run_at = run_at.replace(hour=0, minute=0) + timedelta(days=1)
+            elif run_at.hour not in self.hours:
+                run_at = run_at.replace(minute=0) + timedelta(hours=1)
+            elif run_at.minute not in self.minutes:
+                run_at += timedelta(minutes=1)
+            else:
+                return run_at
+        raise ValueError(f"'{self.expression}' never matches")
+
+
+Trigger = Union[IntervalTrigger, CronTrigger]
+
+
+@dataclass
+class Job:
+    """
+    A periodic job.
+
+    :param name: unique name, used for the lease and the metrics.
+    :param func: the coroutine function to run, without arguments.
+    :param trigger: when to run it.
+    :param timeout: after how many seconds a run is cancelled.
+    :param jitter: up to how many seconds each run is delayed, at random.
+    :param exclusive: whether only one of the workers runs each run (see
+        leases.py). If False, every worker runs it, like for cache warming.
+    :param run_at_startup: also run it when the scheduler starts. Only for
+        interval triggers: it's the last run before startup that runs.
+    """
+
+    name: str
+    func: Callable[[], Awaitable[None]]
+    trigger: Trigger
+    timeout: float
+    jitter: float = JOB_JITTER_SECONDS
+    exclusive: bool = True
+    run_at_startup: bool = False
+
+
+class JobScheduler:
+    """
+    Runs periodic jobs on the event loop of the worker, off the request path.
+
+    A run is skipped if the previous one is still going, and exclusive jobs
+    are run by the first worker taking the lease of each run.
+    """
+
+    def __init__(self, session_maker: sessionmaker = async_session_maker):
+        """
+        :param session_maker: sessions to take the leases with.
+        """
+        self.session_maker = session_maker
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+        self.jobs: Dict[str, Job] = {}
+        self._loops: List[asyncio.Task] = []
+        self._runs: Dict[str, asyncio.Task] = {}
+
+    def add(self, job: Job) -> None:
+        if job.name in self.jobs:
+            raise ValueError(f"There is already a job called '{job.name}'")
+        if job.run_at_startup and not isinstance(job.trigger, IntervalTrigger):
+            raise ValueError("Only jobs with an interval trigger can run at startup")
+        self.jobs[job.name] = job
+
+    def start(self) -> None:
+        self._loops = [
+            asyncio.create_task(self._loop(job)) for job in self.jobs.values()
+        ]
+
+    async def stop(self) -> None:
+        """
+        Cancels the schedules and the runs in progress.
+        """
+        tasks = self._loops + list(self._runs.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._loops, self._runs = [], {}
+
+    async def _loop(self, job: Job) -> None:
+        now = datetime.utcnow()
+        if job.run_at_startup:
+            run_at = job.trigger.previous_run(now)
+        else:
+            run_at = job.trigger.next_run(now)
+        while True:
+            delay = (run_at - datetime.utcnow()).total_seconds() + random.uniform(
+                0, job.jitter
+            )
+            await asyncio.sleep(max(0.0, delay))
+            await self.run(job, run_at)
+            # Runs missed while the worker was busy are skipped, not caught up
+            run_at = job.trigger.next_run(max(run_at, datetime.utcnow()))
+
+    async def run(self, job: Job, run_at: datetime) -> Optional[asyncio.Task]:
+        """
+        Starts a run of the job in the background, unless it's still running
+        or another worker took this run.
+
+        :param job: the job to run.
+        :param run_at: when the run was scheduled.
+        :returns: the task of the run, if it started.
+        """
+        previous = self._runs.get(job.name)
+        if previous is not None and not previous.done():
+            JOB_SKIPPED.labels(job.name, "overlap").inc()
+            return None
+        if job.exclusive:
+            try:
+                async with self.session_maker() as session:
+                    leader = await acquire_lease(session, job.name, run_at, self.owner)
+            except Exception:
+                logger.exception("Could not take the lease of job '%s'", job.name)
+                JOB_SKIPPED.labels(job.name, "lease_error").inc()
+                return None
+            if not leader:
+                JOB_SKIPPED.labels(job.name, "other_worker").inc()
+                return None
+        self._runs[job.name] = asyncio.create_task(self._run(job))
+        return self._runs[job.name]
+
+    async def _run(self, job: Job) -> None:
+        outcome = "cancelled"
+        started_at = time.perf_counter()
+        try:
+            await asyncio.wait_for(job.func(), timeout=job.timeout)
+            outcome = "success"
+            JOB_LAST_SUCCESS.labels(job.name).set_to_current_time()
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            logger.warning("Job '%s' timed out after %s seconds", job.name, job.timeout)
+        except Exception:
+            outcome = "error"
+            logger.exception("Job '%s' failed", job.name)
+        finally:
+            JOB_DURATION.labels(job.name, outcome).observe(
+                time.perf_counter() - started_at
+            )
+
+
+def on_every_database(
+    func: Callable[[sessionmaker], Awaitable[None]],
+    shards: Optional[ShardEngines] = shard_engines if SHARDING_ENABLED else None,
+) -> Callable[[], Awaitable[None]]:
+    """
+    Makes a job running ``func`` on the main database, then on every shard.
+
+    :param func: the coroutine function to run, with the sessions of a database.
+    :param shards: the shards, if sharding is on.
+    """
+
+    async def run() -> None:
+        await func(async_session_maker)
+        if shards is None:
+            return
+        failed = 0
+        for user_id in shards.user_ids():
+            # One shard failing doesn't keep the others from running
+            try:
+                async with shards.session_maker(user_id) as session_maker:
+                    await func(session_maker)
+            except Exception:
+                failed += 1
+                logger.exception("Job failed on the shard of user %s", user_id)
+        if failed:
+            raise RuntimeError(f"The job failed on {failed} shards")
+
+    return run
+
+
+async def prune_change_log_job(session_maker: sessionmaker) -> None:
+    async with session_maker() as session:
+        await prune_change_log(session=session)
+
+
+async def prune_idempotency_keys_job(session_maker: sessionmaker) -> None:
+    async with session_maker() as session:
+        await prune_idempotency_keys(session=session)
+
+
+async def archive_old_reviews(session_maker: sessionmaker) -> None:
+    """
+    Archives the old reviews of all the cards, a batch of cards at a time.
+    """
+    older_than = datetime.utcnow() - timedelta(days=REVIEW_ARCHIVE_AFTER_DAYS)
+    while True:
+        async with session_maker() as session:
+            if not await archive_reviews(session=session, older_than=older_than):
+                break
+        await asyncio.sleep(0)  # Let other requests go through between batches
+
+
+async def sqlite_analyze() -> None:
+    """
+    Refreshes the statistics the SQLite query planner picks indexes with.
+    """
+    async with engine.connect() as conn:
+        await conn.execute(text("ANALYZE"))
+        await conn.execute(text("PRAGMA optimize"))
+        await conn.commit()
+
+
+async def sqlite_vacuum() -> None:
+    """
+    Rebuilds the SQLite file, giving back the space of deleted rows.
+    """
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("VACUUM"))
+
+
+def default_jobs() -> List[Job]:
+    """
+    The maintenance jobs of the server.
+    """
+    jobs = [
+        # Also finishes purging the decks deleted before the last shutdown
+        Job(
+            name="purge_deleted_decks",
+            func=on_every_database(purge_deleted_decks),
+            trigger=IntervalTrigger(DECK_PURGE_INTERVAL_SECONDS),
+            timeout=DECK_PURGE_INTERVAL_SECONDS,
+            run_at_startup=True,
+        ),
+        Job(
+            name="prune_change_log",
+            func=on_every_database(prune_change_log_job),
+            trigger=CronTrigger(CHANGE_LOG_PRUNE_SCHEDULE),
+            timeout=600,
+        ),
+        Job(
+            name="prune_idempotency_keys",
+            func=on_every_database(prune_idempotency_keys_job),
+            trigger=IntervalTrigger(IDEMPOTENCY_PRUNE_INTERVAL_SECONDS),
+            timeout=600,
+        ),
+        Job(
+            name="archive_old_reviews",
+            func=on_every_database(archive_old_reviews),
+            trigger=CronTrigger(REVIEW_ARCHIVE_SCHEDULE),
+            timeout=3600,
+        ),
+    ]
+    if SHARDING_ENABLED:
+        # Every worker closes its own idle shards
+        jobs.append(
+            Job(
+                name="close_idle_shards",
+                func=shard_engines.close_idle,
+                trigger=IntervalTrigger(max(SHARD_IDLE_SECONDS / 4, 1)),
+                timeout=60,
+                exclusive=False,
+            )
+        )
+    if engine.dialect.name == "sqlite":
+        jobs.append(
+            Job(
+                name="sqlite_analyze",
+                func=sqlite_analyze,
+                trigger=CronTrigger(SQLITE_ANALYZE_SCHEDULE),
+                timeout=600,
+            )
+        )
+        if SQLITE_VACUUM_SCHEDULE:
+            jobs.append(
+                Job(
+                    name="sqlite_vacuum",
+                    func=sqlite_vacuum,
+                    trigger=CronTrigger(SQLITE_VACUUM_SCHEDULE),
+                    timeout=3600,
+                )
+            )
+    return jobs
@@ -0,0 +1,57 @@
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, String, Table, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from flashcards_core.database import Base
+
+#: Which worker ran the last run of each periodic job (see jobs.py). A worker
+#: runs a job only if it takes the lease for that run first, so that each run
+#: happens once across all the workers and containers sharing the database.
+JobLease = Table(
+    "job_leases",
+    Base.metadata,
+    Column("job", String(64), primary_key=True),
+    # When the run was scheduled: workers compute the same time for the same run
+    Column("run_at", DateTime(), nullable=False),
+    Column("owner", String(128), nullable=False),
+    Column("acquired_at", DateTime(), nullable=False),
+)
+
+_UPSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+async def acquire_lease(
+    session: Session, job: str, run_at: datetime, owner: str
+) -> bool:
+    """
+    Takes the lease of this run of the job, unless another worker took it.
+
+    :param session: the session (see flashcards_core.database:init_db()).
+    :param job: the name of the job.
+    :param run_at: when the run was scheduled.
+    :param owner: who wants to run it, unique to each worker.
+    :returns: whether the lease was taken, and so whether to run the job.
+    """
+    insert = _UPSERTS[session.bind.dialect.name]
+    upsert = insert(JobLease).values(
+        job=job, run_at=run_at, owner=owner, acquired_at=datetime.utcnow()
+    )
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[JobLease.c.job],
+        set_={
+            "run_at": upsert.excluded.run_at,
+            "owner": upsert.excluded.owner,
+            "acquired_at": upsert.excluded.acquired_at,
+        },
+        where=JobLease.c.run_at < upsert.excluded.run_at,
+    )
+    await session.execute(upsert)
+    lease = (
+        await session.execute(
+            select(JobLease.c.owner, JobLease.c.run_at).where(JobLease.c.job == job)
+        )
+    ).one()
+    await session.commit()
+    return lease.owner == owner and lease.run_at == run_at
@@ -0,0 +1,144 @@
+import asyncio
+from typing import Any, Dict, Iterable, List, Optional, Set
+from uuid import UUID
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from flashcards_core.guid import GUID
+
+
+class Loader:
+    """
+    Loads the objects of one model by one of their columns, batching the
+    lookups: the keys requested in the same event loop iteration, for example
+    by ``asyncio.gather``, are loaded with a single ``WHERE ... IN`` query.
+
+    Results are remembered for the rest of the session, missing objects
+    included. Get one with ``loader()``.
+    """
+
+    def __init__(
+        self, session: Session, model, column, options: tuple, lock: asyncio.Lock
+    ):
+        """
+        :param options: loader options of the query, like ``selectinload``.
+        :param lock: shared by the loaders of the session, which can't run
+            queries concurrently.
+        """
+        self.session = session
+        self.model = model
+        self.column = column
+        self.options = options
+        self._lock = lock
+        self._results: Dict[Any, Any] = {}
+        self._pending: Dict[Any, asyncio.Future] = {}
+        # The event loop only keeps weak references to the running tasks
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _key(self, key: Any) -> Any:
+        if isinstance(self.column.type, GUID) and not isinstance(key, UUID):
+            return UUID(str(key))
+        return key
+
+    async def load(self, key: Any) -> Optional[Any]:
+        """
+        :param key: the value of the column to look up.
+        :returns: the object, or None if there's none.
+        """
+        try:
+            key = self._key(key)
+        except ValueError:
+            return None  # Not a valid ID: no object has it
+        if key in self._results:
+            return self._results[key]
+        if key not in self._pending:
+            if not self._pending:
+                asyncio.get_running_loop().call_soon(self._dispatch, 0)
+            self._pending[key] = asyncio.get_running_loop().create_future()
+        return await self._pending[key]
+
+    async def load_many(self, keys: Iterable[Any]) -> List[Optional[Any]]:
+        """
+        :param keys: the values of the column to look up.
+        :returns: the objects in the same order, None for the missing ones.
+        """
+        return list(await asyncio.gather(*(self.load(key) for key in keys)))
+
+    def _dispatch(self, seen: int) -> None:
+        if len(self._pending) != seen:
+            # Keys keep coming, like from nested gathers: wait for the others
+            asyncio.get_running_loop().call_soon(self._dispatch, len(self._pending))
+            return
+        pending, self._pending = self._pending, {}
+        task = asyncio.ensure_future(self._load_pending(pending))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _load_pending(self, pending: Dict[Any, asyncio.Future]) -> None:
+        try:
+            select_objects = (
+                select(self.model)
+                .where(self.column.in_(pending))
+                .options(*self.options)
+            )
+            async with self._lock:
+                objects = {
+                    getattr(obj, self.column.key): obj
+                    for obj in await self.session.scalars(select_objects)
+                }
+        except Exception as exc:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for key, future in pending.items():
+            self._results[key] = objects.get(key)
+            if not future.done():
+                future.set_result(self._results[key])
+
+    def forget(self, obj) -> None:
+        """
+        Drops what is remembered about this object, to load it again if needed.
+        """
+        self._results = {
+            key: result
+            for key, result in self._results.items()
+            if result is not obj and key != getattr(obj, self.column.key, None)
+        }
+
+
+def loader(session: Session, model, column=None, options: Iterable = ()) -> Loader:
+    """
+    The loader of this model for this session, created on first use.
+
+    :param session: the session (see flashcards_core.database:init_db()).
+    :param model: the model to load, like ``Fact``.
+    :param column: the column to look objects up by. Their ID by default.
+    :param options: loader options of the query. Loaders with different
+        options are different loaders.
+    """
+    column = column if column is not None else model.id
+    options = tuple(options)
+    loaders = session.info.setdefault("loaders", {})
+    key = (model, column.key, options)
+    if key not in loaders:
+        lock = session.info.setdefault("loaders_lock", asyncio.Lock())
+        loaders[key] = Loader(session, model, column, options, lock)
+    return loaders[key]
+
+
+@event.listens_for(Session, "after_flush")
+def _forget_flushed_objects(session, flush_context):
+    """
+    Objects created, changed or deleted may not be what the loaders remember
+    anymore: a tag created after a lookup found none, for example.
+    """
+    loaders = session.info.get("loaders")
+    if not loaders:
+        return
+    changed = [*session.new, *session.dirty, *session.deleted]
+    for model_loader in loaders.values():
+        for obj in changed:
+            if isinstance(obj, model_loader.model):
+                model_loader.forget(obj)
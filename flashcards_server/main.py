@@ -1,4 +1,8 @@
+import os
+
 import uvicorn
 
 if __name__ == "__main__":
+    # A development server: migrate the database at startup, see SCHEMA_MODE
+    os.environ.setdefault("FLASHCARDS_SCHEMA_MODE", "upgrade")
     uvicorn.run("flashcards_server.app:app", host="127.0.0.1", log_level="info")
@@ -0,0 +1,182 @@
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram
+from prometheus_client import generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from flashcards_server import ratelimit
+
+
+REQUEST_DURATION = Histogram(
+    "flashcards_request_duration_seconds",
+    "Time spent serving requests",
+    ["method", "route", "status"],
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "flashcards_requests_in_flight",
+    "Requests being served",
+    ["method"],
+)
+RESPONSE_SIZE = Histogram(
+    "flashcards_response_size_bytes",
+    "Size of the response bodies",
+    ["method", "route"],
+    buckets=[100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000],
+)
+SQL_STATEMENTS = Histogram(
+    "flashcards_request_sql_statements",
+    "SQL statements executed by each request",
+    ["method", "route"],
+    buckets=[0, 1, 2, 3, 5, 10, 20, 50, 100],
+)
+SQL_DURATION = Histogram(
+    "flashcards_request_sql_duration_seconds",
+    "Time each request spent waiting for SQL statements",
+    ["method", "route"],
+)
+SQL_STATEMENTS_TOTAL = Counter(
+    "flashcards_sql_statements",
+    "SQL statements executed, in requests or not",
+)
+JOB_DURATION = Histogram(
+    "flashcards_job_duration_seconds",
+    "Time spent running the background jobs",
+    ["job", "outcome"],
+    buckets=[0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600],
+)
+JOB_SKIPPED = Counter(
+    "flashcards_job_skipped_runs",
+    "Background job runs skipped: still running, or run by another worker",
+    ["job", "reason"],
+)
+JOB_LAST_SUCCESS = Gauge(
+    "flashcards_job_last_success_timestamp_seconds",
+    "When each background job last succeeded in this worker",
+    ["job"],
+)
+
+#: [statements, seconds] spent in SQL by the current request
+_request_sql: ContextVar[Optional[list]] = ContextVar("request_sql", default=None)
+
+
+class MetricsMiddleware:
+    """
+    Records the latency, the response size and the SQL statements of every
+    request, labelled by route template (``/decks/{deck_id}``), so that the
+    number of series doesn't grow with the number of decks or users.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._route_names: Dict = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = 500
+        size = 0
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        sql = [0, 0.0]
+        token = _request_sql.set(sql)
+        in_flight = REQUESTS_IN_FLIGHT.labels(method)
+        in_flight.inc()
+        started_at = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - started_at
+            in_flight.dec()
+            _request_sql.reset(token)
+            route = self._route(scope)
+            REQUEST_DURATION.labels(method, route, str(status)).observe(duration)
+            RESPONSE_SIZE.labels(method, route).observe(size)
+            SQL_STATEMENTS.labels(method, route).observe(sql[0])
+            SQL_DURATION.labels(method, route).observe(sql[1])
+
+    def _route(self, scope: Scope) -> str:
+        """
+        The path template of the route that served the request, from the
+        endpoint the router stored in the scope.
+        """
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"  # 404s, and requests rejected before routing
+        if endpoint not in self._route_names:
+            routes = scope["app"].routes if "app" in scope else []
+            self._route_names.update(
+                (route.endpoint, route.path)
+                for route in routes
+                if hasattr(route, "endpoint")
+            )
+        return self._route_names.get(endpoint, "unmatched")
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """
+    Counts and times the SQL statements sent through this engine, adding
+    them to the request they're made for.
+    """
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started_at", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def stop_timer(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info["metrics_started_at"].pop()
+        SQL_STATEMENTS_TOTAL.inc()
+        sql = _request_sql.get()
+        if sql is not None:
+            sql[0] += 1
+            sql[1] += duration
+
+
+class AdmissionControlCollector:
+    """
+    Exports the admission control counters (see ``ratelimit.py``).
+    """
+
+    def collect(self):
+        in_flight = GaugeMetricFamily(
+            "flashcards_admission_in_flight", "Requests holding a concurrency slot"
+        )
+        in_flight.add_metric([], ratelimit.concurrency_limiter.in_flight)
+        waiting = GaugeMetricFamily(
+            "flashcards_admission_waiting", "Requests waiting for a concurrency slot"
+        )
+        waiting.add_metric([], ratelimit.concurrency_limiter.waiting)
+        rejected = CounterMetricFamily(
+            "flashcards_admission_rejections",
+            "Requests rejected by admission control",
+            labels=["reason", "route_class"],
+        )
+        for (reason, route_class), count in sorted(ratelimit.rejections.items()):
+            rejected.add_metric([reason, route_class], count)
+        return [in_flight, waiting, rejected]
+
+
+REGISTRY.register(AdmissionControlCollector())
+
+
+def metrics_response() -> Response:
+    """
+    All the metrics of this process, in the Prometheus text format.
+    """
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
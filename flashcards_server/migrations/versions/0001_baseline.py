@@ -0,0 +1,94 @@
+"""Baseline schema
+
+Creates the tables of the flashcards-core models, with the users and deck
+owners tables. On databases created by ``create_all`` before migrations
+existed, the existing tables are left untouched.
+
+The users and deck owners tables are written out as they were at this
+revision. flashcards-core ships no migrations: its tables are created from
+its own modules, without the tables and indexes the server adds to them.
+
+Revision ID: 0001
+Revises:
+Create Date: 2022-10-01 00:00:00.000000
+
+"""
+import sys
+from typing import List
+
+import sqlalchemy as sa
+from alembic import op
+from fastapi_users_db_sqlalchemy.generics import GUID as UserGUID
+
+from flashcards_core.guid import GUID
+
+
+# revision identifiers, used by Alembic.
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _core_tables() -> List[sa.Table]:
+    """
+    The tables defined by flashcards-core: those of its models and their
+    associative tables, in dependency order.
+    """
+    from flashcards_core.database import Base
+
+    tables = set()
+    for mapper in Base.registry.mappers:
+        if mapper.class_.__module__.split(".")[0] == "flashcards_core":
+            tables.update(mapper.tables)
+            tables.update(
+                relationship.secondary
+                for relationship in mapper.relationships
+                if relationship.secondary is not None
+            )
+    for name, module in list(sys.modules.items()):
+        if name.split(".")[0] == "flashcards_core":
+            tables.update(
+                value for value in vars(module).values() if isinstance(value, sa.Table)
+            )
+    return [table for table in Base.metadata.sorted_tables if table in tables]
+
+
+def upgrade():
+    connection = op.get_bind()
+    existing = set(sa.inspect(connection).get_table_names())
+
+    for table in _core_tables():
+        if table.name in existing:
+            continue
+        connection.execute(sa.schema.CreateTable(table))
+        # Only the indexes flashcards-core declares: 0002 adds the others
+        for index in table.indexes:
+            if any(column.index for column in index.columns):
+                index.create(connection)
+
+    if "users" not in existing:
+        op.create_table(
+            "users",
+            sa.Column("id", UserGUID(), primary_key=True),
+            sa.Column("email", sa.String(320), nullable=False),
+            sa.Column("hashed_password", sa.String(1024), nullable=False),
+            sa.Column("is_active", sa.Boolean(), nullable=False),
+            sa.Column("is_superuser", sa.Boolean(), nullable=False),
+            sa.Column("is_verified", sa.Boolean(), nullable=False),
+        )
+        op.create_index("ix_users_email", "users", ["email"], unique=True)
+
+    if "deck_owners" not in existing:
+        op.create_table(
+            "deck_owners",
+            sa.Column("deck_id", GUID(), sa.ForeignKey("decks.id"), primary_key=True),
+            sa.Column("owner_id", GUID(), sa.ForeignKey("users.id"), nullable=False),
+        )
+
+
+def downgrade():
+    op.drop_table("deck_owners")
+    op.drop_table("users")
+    for table in reversed(_core_tables()):
+        op.drop_table(table.name)
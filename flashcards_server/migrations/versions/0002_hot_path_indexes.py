@@ -0,0 +1,86 @@
+"""Index the hot lookup columns
+
+Adds the indexes of the most frequent lookups (deck owners, cards by deck,
+reviews by card, tags by name, both sides of the associative tables) and
+the ``deck_owners.deleted_at`` column, where they're missing.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2022-10-01 00:00:00.000000
+
+"""
+from typing import List, Tuple
+
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+#: The tables of the models and the deck owners: the other tables of the
+#: baseline are associative tables, whose foreign keys are all indexed
+ENTITY_TABLES = {"users", "decks", "cards", "facts", "tags", "reviews", "deck_owners"}
+
+#: (table, column) of the lookups on the hot paths
+HOT_PATH_COLUMNS = [
+    ("deck_owners", "owner_id"),
+    ("cards", "deck_id"),
+    ("reviews", "card_id"),
+    ("tags", "name"),
+]
+
+
+def _hot_path_columns(inspector) -> List[Tuple[str, str]]:
+    columns = list(HOT_PATH_COLUMNS)
+    for table in sorted(
+        set(inspector.get_table_names()) - ENTITY_TABLES - {"alembic_version"}
+    ):
+        for foreign_key in inspector.get_foreign_keys(table):
+            columns += [
+                (table, column) for column in foreign_key["constrained_columns"]
+            ]
+    return columns
+
+
+def _is_indexed(inspector, table: str, column: str) -> bool:
+    """
+    Whether lookups on this column can already use an index.
+    """
+    leading_columns = [
+        index["column_names"][0] for index in inspector.get_indexes(table)
+    ]
+    leading_columns += [
+        constraint["column_names"][0]
+        for constraint in inspector.get_unique_constraints(table)
+    ]
+    leading_columns += inspector.get_pk_constraint(table)["constrained_columns"][:1]
+    return column in leading_columns
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+
+    deck_owner_columns = [
+        column["name"] for column in inspector.get_columns("deck_owners")
+    ]
+    if "deleted_at" not in deck_owner_columns:
+        op.add_column(
+            "deck_owners", sa.Column("deleted_at", sa.DateTime(), nullable=True)
+        )
+
+    for table, column in _hot_path_columns(inspector):
+        if not _is_indexed(inspector, table, column):
+            op.create_index(f"ix_{table}_{column}", table, [column])
+
+
+def downgrade():
+    inspector = sa.inspect(op.get_bind())
+    for table, column in _hot_path_columns(inspector):
+        existing = [index["name"] for index in inspector.get_indexes(table)]
+        if f"ix_{table}_{column}" in existing:
+            op.drop_index(f"ix_{table}_{column}", table_name=table)
@@ -0,0 +1,31 @@
+"""Version counters for conditional GETs
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2022-10-08 00:00:00.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+from flashcards_core.guid import GUID
+
+
+# revision identifiers, used by Alembic.
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "entity_versions",
+        sa.Column("entity", sa.String(16), primary_key=True),
+        sa.Column("entity_id", GUID(), primary_key=True),
+        sa.Column("version", sa.Integer(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table("entity_versions")
@@ -0,0 +1,35 @@
+"""Change log for delta sync
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2022-10-15 00:00:00.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+from flashcards_core.guid import GUID
+
+
+# revision identifiers, used by Alembic.
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "change_log",
+        sa.Column("seq", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("entity", sa.String(16), nullable=False),
+        sa.Column("entity_id", GUID(), nullable=False),
+        sa.Column("op", sa.String(8), nullable=False),
+        sa.Column("deck_id", GUID(), nullable=True),
+        sa.Column("owner_id", GUID(), nullable=True),
+        sa.Column("changed_at", sa.DateTime(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table("change_log")
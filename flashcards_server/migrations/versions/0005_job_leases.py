@@ -0,0 +1,30 @@
+"""Leases of the periodic jobs
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2022-10-22 00:00:00.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "job_leases",
+        sa.Column("job", sa.String(64), primary_key=True),
+        sa.Column("run_at", sa.DateTime(), nullable=False),
+        sa.Column("owner", sa.String(128), nullable=False),
+        sa.Column("acquired_at", sa.DateTime(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table("job_leases")
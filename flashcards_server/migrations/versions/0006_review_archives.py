@@ -0,0 +1,32 @@
+"""Archive of old reviews
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2022-10-29 00:00:00.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+from flashcards_core.guid import GUID
+
+
+# revision identifiers, used by Alembic.
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "review_archives",
+        sa.Column("card_id", GUID(), sa.ForeignKey("cards.id"), primary_key=True),
+        sa.Column("reviews_count", sa.Integer(), nullable=False),
+        sa.Column("newest", sa.DateTime(), nullable=False),
+        sa.Column("data", sa.LargeBinary(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table("review_archives")
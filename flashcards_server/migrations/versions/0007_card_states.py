@@ -0,0 +1,86 @@
+"""Per-card entries of the deck states
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2022-11-05 00:00:00.000000
+
+"""
+
+from uuid import UUID
+
+import sqlalchemy as sa
+from alembic import op
+
+from flashcards_core.guid import GUID
+
+# revision identifiers, used by Alembic.
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def _is_card_key(key: str) -> bool:
+    try:
+        UUID(key)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def upgrade():
+    card_states = op.create_table(
+        "card_states",
+        sa.Column("deck_id", GUID(), sa.ForeignKey("decks.id"), primary_key=True),
+        sa.Column("key", sa.String(36), primary_key=True),
+        sa.Column("state", sa.JSON(), nullable=True),
+    )
+
+    # Move the per-card entries of the existing states to the new table
+    decks = sa.table("decks", sa.column("id", GUID()), sa.column("state", sa.JSON()))
+    connection = op.get_bind()
+    for deck_id, state in connection.execute(
+        sa.select(decks.c.id, decks.c.state)
+    ).all():
+        card_entries = {
+            key: value for key, value in (state or {}).items() if _is_card_key(key)
+        }
+        if not card_entries:
+            continue
+        connection.execute(
+            sa.insert(card_states),
+            [
+                {"deck_id": deck_id, "key": key, "state": value}
+                for key, value in card_entries.items()
+            ],
+        )
+        deck_entries = {
+            key: value for key, value in state.items() if key not in card_entries
+        }
+        connection.execute(
+            sa.update(decks).where(decks.c.id == deck_id).values(state=deck_entries)
+        )
+
+
+def downgrade():
+    card_states = sa.table(
+        "card_states",
+        sa.column("deck_id", GUID()),
+        sa.column("key", sa.String()),
+        sa.column("state", sa.JSON()),
+    )
+    decks = sa.table("decks", sa.column("id", GUID()), sa.column("state", sa.JSON()))
+    connection = op.get_bind()
+    card_entries = {}
+    for deck_id, key, state in connection.execute(sa.select(card_states)).all():
+        card_entries.setdefault(deck_id, {})[key] = state
+    for deck_id, entries in card_entries.items():
+        state = connection.execute(
+            sa.select(decks.c.state).where(decks.c.id == deck_id)
+        ).scalar()
+        connection.execute(
+            sa.update(decks)
+            .where(decks.c.id == deck_id)
+            .values(state={**(state or {}), **entries})
+        )
+    op.drop_table("card_states")
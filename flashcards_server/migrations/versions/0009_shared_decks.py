@@ -0,0 +1,28 @@
+"""Decks shared for every user to clone
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2022-11-26 00:00:00.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "deck_owners",
+        sa.Column("shared", sa.Boolean(), nullable=False, server_default=sa.false()),
+    )
+
+
+def downgrade():
+    # SQLite can't drop columns in place
+    with op.batch_alter_table("deck_owners") as batch_op:
+        batch_op.drop_column("shared")
@@ -0,0 +1,137 @@
+import asyncio
+import contextvars
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Callable, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi_users.password import PasswordHelper
+
+from flashcards_server.constants import (
+    PASSWORD_HASHING_EXECUTOR,
+    PASSWORD_HASHING_QUEUE_SIZE,
+    PASSWORD_HASHING_WORKERS,
+)
+
+
+#: Does the actual work in the workers. Module level so that it can be
+#: used from worker processes too.
+_worker_password_helper = PasswordHelper()
+
+
+def _hash(password: str) -> str:
+    return _worker_password_helper.hash(password)
+
+
+def _verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, str]:
+    return _worker_password_helper.verify_and_update(plain_password, hashed_password)
+
+
+#: (password, hash) pair computed by the pool for the request in this context
+_prehashed: contextvars.ContextVar = contextvars.ContextVar("prehashed", default=None)
+
+
+class PooledPasswordHelper(PasswordHelper):
+    """
+    Password helper that hashes and verifies passwords in a pool of threads
+    or processes, so that this deliberately slow work doesn't block the
+    event loop.
+
+    The number of jobs waiting for a worker is bounded: when the queue is
+    full, new jobs are rejected right away with a 503 error.
+    """
+
+    def __init__(self, executor_type: str, workers: int, queue_size: int):
+        """
+        :param executor_type: ``thread``, ``process`` or ``inline``. ``inline``
+            does the work on the event loop, like the default PasswordHelper.
+        :param workers: how many threads or processes to start.
+        :param queue_size: how many jobs can wait for a free worker.
+        """
+        super().__init__()
+        self.executor_type = executor_type
+        self.workers = workers
+        self.queue_size = queue_size
+        self._executor: Optional[Executor] = None
+        self._pending = 0
+
+    @property
+    def executor(self) -> Executor:
+        """
+        The pool of workers, started on first use.
+        """
+        if self._executor is None:
+            if self.executor_type == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="password-hashing"
+                )
+        return self._executor
+
+    def shutdown(self) -> None:
+        """
+        Stops the pool of workers, if it was started.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def _run(self, function: Callable, *args):
+        if self.executor_type == "inline":
+            return function(*args)
+        if self._pending >= self.workers + self.queue_size:
+            raise HTTPException(
+                status_code=503,
+                detail="Too many authentication requests, please retry later.",
+                headers={"Retry-After": "1"},
+            )
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, function, *args)
+        finally:
+            self._pending -= 1
+
+    async def hash_async(self, password: str) -> str:
+        """
+        Hashes the password in the pool.
+        """
+        return await self._run(_hash, password)
+
+    async def verify_and_update_async(
+        self, plain_password: str, hashed_password: str
+    ) -> Tuple[bool, str]:
+        """
+        Verifies the password, and computes an updated hash if needed, in the pool.
+        """
+        return await self._run(_verify_and_update, plain_password, hashed_password)
+
+    @asynccontextmanager
+    async def prehashed(self, password: str):
+        """
+        Hashes the password in the pool. Within this block, ``hash(password)``
+        returns that hash instead of computing it on the event loop.
+
+        Lets the synchronous ``hash()`` calls made by BaseUserManager benefit
+        from the pool.
+        """
+        token = _prehashed.set((password, await self.hash_async(password)))
+        try:
+            yield
+        finally:
+            _prehashed.reset(token)
+
+    def hash(self, password: str) -> str:
+        prehashed = _prehashed.get()
+        if prehashed is not None and prehashed[0] == password:
+            return prehashed[1]
+        return super().hash(password)
+
+
+#: Password helper shared by all the requests of this worker
+password_helper = PooledPasswordHelper(
+    executor_type=PASSWORD_HASHING_EXECUTOR,
+    workers=PASSWORD_HASHING_WORKERS,
+    queue_size=PASSWORD_HASHING_QUEUE_SIZE,
+)
@@ -0,0 +1,244 @@
+import asyncio
+import time
+from collections import Counter, OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from flashcards_server.constants import (
+    MAX_CONCURRENT_REQUESTS,
+    MAX_QUEUED_REQUESTS,
+    QUEUE_TIMEOUT_SECONDS,
+    RATE_LIMIT_BUCKETS,
+    RATE_LIMIT_EXEMPT_PATHS,
+    RATE_LIMITS,
+)
+from flashcards_server.users import user_id_from_token
+
+
+class TokenBucket:
+    """
+    Allows ``rate`` requests per second on average, with bursts of up to
+    ``capacity`` requests.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated_at")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = now
+
+    def take(self, now: float) -> float:
+        """
+        Takes a token from the bucket, if there is one.
+
+        :param now: the current time, in seconds.
+        :returns: 0 if a token was taken, otherwise how many seconds to wait
+            for the next one.
+        """
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    One token bucket for each client and route class. Only the most
+    recently used ``max_buckets`` buckets are kept: a forgotten bucket
+    starts full again.
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[float, float]], max_buckets: int):
+        """
+        :param limits: maps each route class to its (rate, burst) pair.
+        :param max_buckets: how many buckets to keep at most.
+        """
+        self.limits = limits
+        self.max_buckets = max_buckets
+        self._buckets: OrderedDict = OrderedDict()
+
+    def take(self, client: Hashable, route_class: str) -> float:
+        """
+        Takes a token from the bucket of this client for this route class.
+
+        :returns: 0 if the request can go through, otherwise how many seconds
+            the client should wait before retrying.
+        """
+        now = time.monotonic()
+        key = (client, route_class)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            rate, burst = self.limits[route_class]
+            bucket = self._buckets[key] = TokenBucket(
+                rate=rate, capacity=burst, now=now
+            )
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket.take(now)
+
+
+class ConcurrencyLimiter:
+    """
+    Caps the number of requests served at the same time. Requests over the
+    cap wait in a bounded queue, and give up after ``timeout`` seconds.
+    """
+
+    def __init__(self, max_concurrent: int, max_queued: int, timeout: float):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.waiting = 0
+        self.in_flight = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def acquire(self) -> bool:
+        """
+        Waits for a free slot.
+
+        :returns: True if the request got a slot, False if the queue is full
+            or the wait timed out.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        if self._semaphore.locked() and self.waiting >= self.max_queued:
+            return False
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+            self.in_flight += 1
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiting -= 1
+
+    def release(self) -> None:
+        """
+        Frees the slot taken by ``acquire``.
+        """
+        self.in_flight -= 1
+        self._semaphore.release()
+
+
+def route_class(method: str, path: str) -> str:
+    """
+    Classifies a request as ``study``, ``read`` or ``write`` for rate limiting.
+    """
+    if path.startswith("/study/"):
+        return "study"
+    if method in ("GET", "HEAD", "OPTIONS"):
+        return "read"
+    return "write"
+
+
+def is_event_stream(method: str, path: str) -> bool:
+    """
+    Whether the request opens a stream of events, which stays open for as
+    long as the client follows the deck.
+    """
+    return method == "GET" and path.startswith("/decks/") and path.endswith("/events")
+
+
+class AdmissionControlMiddleware:
+    """
+    Rejects the requests of clients going over their rate limits with a 429,
+    and the requests that can't get a slot under the global concurrency cap
+    with a 503, instead of letting them pile up.
+
+    Authenticated requests are limited per user, the others per IP address.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        rate_limiter: RateLimiter,
+        concurrency_limiter: ConcurrencyLimiter,
+    ):
+        self.app = app
+        self.rate_limiter = rate_limiter
+        self.concurrency_limiter = concurrency_limiter
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] in RATE_LIMIT_EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        limited_class = route_class(scope["method"], scope["path"])
+        retry_after = self.rate_limiter.take(self._client(scope), limited_class)
+        if retry_after:
+            rejections[("rate_limited", limited_class)] += 1
+            response = JSONResponse(
+                {"detail": "Too many requests, please slow down."},
+                status_code=429,
+                headers={"Retry-After": str(max(1, round(retry_after)))},
+            )
+            await response(scope, receive, send)
+            return
+
+        if is_event_stream(scope["method"], scope["path"]):
+            # Long lived and idle most of the time: capped on their own (see events.py)
+            await self.app(scope, receive, send)
+            return
+
+        if not await self.concurrency_limiter.acquire():
+            rejections[("overloaded", limited_class)] += 1
+            response = JSONResponse(
+                {"detail": "The server is overloaded, please retry later."},
+                status_code=503,
+                headers={"Retry-After": "1"},
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.concurrency_limiter.release()
+
+    def _client(self, scope: Scope) -> Hashable:
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                scheme, _, token = value.decode("latin-1").partition(" ")
+                user_id = (
+                    user_id_from_token(token) if scheme.lower() == "bearer" else None
+                )
+                if user_id:
+                    return ("user", user_id)
+                break
+        client = scope.get("client")
+        return ("ip", client[0] if client else None)
+
+
+#: Limits shared by all the requests of this worker
+rate_limiter = RateLimiter(limits=RATE_LIMITS, max_buckets=RATE_LIMIT_BUCKETS)
+concurrency_limiter = ConcurrencyLimiter(
+    max_concurrent=MAX_CONCURRENT_REQUESTS,
+    max_queued=MAX_QUEUED_REQUESTS,
+    timeout=QUEUE_TIMEOUT_SECONDS,
+)
+
+#: Requests rejected by this worker, by (reason, route class)
+rejections: Counter = Counter()
+
+
+def admission_metrics() -> dict:
+    """
+    Admission control counters of this worker, for monitoring.
+    """
+    return {
+        "in_flight": concurrency_limiter.in_flight,
+        "waiting": concurrency_limiter.waiting,
+        "rejections": [
+            {"reason": reason, "route_class": limited_class, "count": count}
+            for (reason, limited_class), count in sorted(rejections.items())
+        ],
+    }
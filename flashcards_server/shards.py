@@ -0,0 +1,238 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncGenerator, List
+from uuid import UUID
+
+from fastapi import Depends, FastAPI
+from fastapi_users.db import SQLAlchemyUserDatabase
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from flashcards_server.constants import (
+    DATABASE_ECHO,
+    SHARD_CONNECTIONS,
+    SHARD_DIRECTORY,
+    SHARD_IDLE_SECONDS,
+    SHARD_MAX_OPEN,
+    SHARD_SQLITE_PRAGMAS,
+    SQLITE_WRITE_TIMEOUT,
+)
+from flashcards_server.database import (
+    User,
+    _set_pragmas,
+    async_session_maker,
+    get_async_session,
+    get_user_db,
+)
+from flashcards_server.users import current_active_user
+
+
+def shard_path(user_id: UUID, directory: str = SHARD_DIRECTORY) -> Path:
+    """
+    The SQLite file holding the data of this user.
+    """
+    return Path(directory) / f"{user_id}.db"
+
+
+def shard_url(path: Path) -> str:
+    return f"sqlite+aiosqlite:///{path}"
+
+
+def create_shard_engine(path: Path) -> AsyncEngine:
+    """
+    Creates the engine of a shard, with the pragmas of SHARD_SQLITE_PRAGMAS.
+    """
+    engine = create_async_engine(
+        shard_url(path),
+        echo=DATABASE_ECHO,
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=SHARD_CONNECTIONS,
+        max_overflow=0,
+        pool_timeout=SQLITE_WRITE_TIMEOUT,
+    )
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def set_shard_pragmas(dbapi_connection, connection_record):
+        _set_pragmas(dbapi_connection, SHARD_SQLITE_PRAGMAS)
+
+    return engine
+
+
+async def create_shard_schema(engine: AsyncEngine) -> None:
+    """
+    Creates the tables of a new shard, at the latest migration.
+    """
+    # Imported here, Alembic is slow to import and only needed for new shards
+    from flashcards_server.utils.migrate import create_schema
+
+    async with engine.begin() as conn:
+        await conn.run_sync(create_schema)
+
+
+@dataclass
+class _Shard:
+    engine: AsyncEngine
+    session_maker: sessionmaker
+    last_used: float
+    in_use: int = 0
+
+
+class ShardEngines:
+    """
+    The engines of the shards, opened on first use. The least recently used
+    shards are closed when too many are open, or when they have been idle
+    for too long, unless they are serving requests.
+    """
+
+    def __init__(
+        self,
+        directory: str = SHARD_DIRECTORY,
+        max_open: int = SHARD_MAX_OPEN,
+        idle_seconds: float = SHARD_IDLE_SECONDS,
+    ):
+        self.directory = directory
+        self.max_open = max_open
+        self.idle_seconds = idle_seconds
+        self._shards: "OrderedDict[UUID, _Shard]" = OrderedDict()
+        self._opening: dict = {}
+
+    def __len__(self) -> int:
+        return len(self._shards)
+
+    async def _open(self, user_id: UUID) -> _Shard:
+        path = shard_path(user_id, self.directory)
+        is_new = not path.exists()
+        engine = create_shard_engine(path)
+        if is_new:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            await create_shard_schema(engine)
+        session_maker = sessionmaker(
+            engine, class_=AsyncSession, expire_on_commit=False
+        )
+        return _Shard(
+            engine=engine, session_maker=session_maker, last_used=time.monotonic()
+        )
+
+    async def _acquire(self, user_id: UUID) -> _Shard:
+        """
+        The shard of this user, marked as in use so that it's not closed.
+        """
+        shard = self._shards.get(user_id)
+        if shard is None:
+            # Concurrent requests of the same user open the shard once
+            if user_id not in self._opening:
+                self._opening[user_id] = asyncio.ensure_future(self._open(user_id))
+            try:
+                shard = await asyncio.shield(self._opening[user_id])
+            finally:
+                self._opening.pop(user_id, None)
+            shard = self._shards.setdefault(user_id, shard)
+            shard.in_use += 1
+            await self._evict(keep=self.max_open)
+        else:
+            shard.in_use += 1
+        self._shards.move_to_end(user_id)
+        shard.last_used = time.monotonic()
+        return shard
+
+    async def _close(self, shards: List[_Shard]) -> None:
+        await asyncio.gather(*(shard.engine.dispose() for shard in shards))
+
+    async def _evict(self, keep: int) -> None:
+        """
+        Closes the least recently used shards not in use, down to ``keep``
+        open if possible.
+        """
+        evicted = []
+        for user_id, shard in list(self._shards.items()):
+            if len(self._shards) <= keep:
+                break
+            if not shard.in_use:
+                evicted.append(self._shards.pop(user_id))
+        await self._close(evicted)
+
+    async def close_idle(self) -> None:
+        """
+        Closes the shards unused for more than ``idle_seconds``.
+        """
+        idle_since = time.monotonic() - self.idle_seconds
+        evicted = [
+            user_id
+            for user_id, shard in self._shards.items()
+            if not shard.in_use and shard.last_used < idle_since
+        ]
+        await self._close([self._shards.pop(user_id) for user_id in evicted])
+
+    async def close_all(self) -> None:
+        shards, self._shards = list(self._shards.values()), OrderedDict()
+        await self._close(shards)
+
+    def user_ids(self) -> List[UUID]:
+        """
+        The users with a shard in the directory, open or not.
+        """
+        user_ids = []
+        for path in sorted(Path(self.directory).glob("*.db")):
+            try:
+                user_ids.append(UUID(path.stem))
+            except ValueError:
+                continue  # Not a shard
+        return user_ids
+
+    @asynccontextmanager
+    async def session_maker(self, user_id: UUID) -> AsyncGenerator[sessionmaker, None]:
+        """
+        Sessions on the shard of this user, which stays open while in use.
+        """
+        shard = await self._acquire(user_id)
+        try:
+            yield shard.session_maker
+        finally:
+            shard.in_use -= 1
+            shard.last_used = time.monotonic()
+
+    @asynccontextmanager
+    async def session(self, user_id: UUID) -> AsyncGenerator[AsyncSession, None]:
+        """
+        A session on the shard of this user, which stays open while in use.
+        """
+        async with self.session_maker(user_id) as session_maker:
+            async with session_maker() as session:
+                yield session
+
+
+#: The shards opened by this worker
+shard_engines = ShardEngines()
+
+
+async def get_shard_session(
+    user: User = Depends(current_active_user),
+) -> AsyncGenerator[AsyncSession, None]:
+    async with shard_engines.session(user.id) as session:
+        yield session
+
+
+async def get_central_session() -> AsyncGenerator[AsyncSession, None]:
+    async with async_session_maker() as session:
+        yield session
+
+
+async def get_central_user_db(session: AsyncSession = Depends(get_central_session)):
+    yield SQLAlchemyUserDatabase(session, User)
+
+
+def enable_sharding(app: FastAPI) -> None:
+    """
+    Routes the sessions of the authenticated requests to the shard of their
+    user. The users stay in the main database.
+    """
+    os.makedirs(SHARD_DIRECTORY, exist_ok=True)
+    app.dependency_overrides[get_user_db] = get_central_user_db
+    app.dependency_overrides[get_async_session] = get_shard_session
@@ -1,27 +1,184 @@
 import uuid
-from typing import Optional
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Optional
 
+import jwt
 from fastapi import Depends, Request
-from fastapi_users import BaseUserManager, FastAPIUsers, UUIDIDMixin
+from fastapi.security import OAuth2PasswordRequestForm
+from fastapi_users import BaseUserManager, FastAPIUsers, UUIDIDMixin, exceptions
 from fastapi_users.authentication import (
     AuthenticationBackend,
     BearerTransport,
     JWTStrategy,
 )
 from fastapi_users.db import SQLAlchemyUserDatabase
+from fastapi_users.jwt import decode_jwt
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
 
+from flashcards_server.cache import TTLCache
+from flashcards_server.constants import USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS
 from flashcards_server.database import User, get_user_db
+from flashcards_server.passwords import password_helper
+from flashcards_server.schemas import UserCreate, UserUpdate
 
 SECRET = "SECRET"
 
 
+#: Snapshots of the active users resolved from a JWT (see ``user_snapshot``),
+#: keyed by (user_id, token)
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+
+
+def user_snapshot(user: User) -> Mapping[str, Any]:
+    """
+    Returns the values of the columns of this user, read-only: a cache can
+    share them across requests, unlike the instance, which belongs to the
+    session that loaded it.
+
+    :param user: the user, loaded.
+    :returns: the values, by attribute name.
+    """
+    return MappingProxyType(
+        {attribute.key: getattr(user, attribute.key) for attribute in inspect(User).column_attrs}
+    )
+
+
+def user_from_snapshot(snapshot: Mapping[str, Any]) -> User:
+    """
+    Returns a new detached instance of a user from its snapshot: adding it
+    to a session, or merging it, makes it persistent without loading it again.
+
+    :param snapshot: what ``user_snapshot`` returned.
+    :returns: the user.
+    """
+    user = User(**snapshot)
+    make_transient_to_detached(user)
+    return user
+
+
+def user_id_from_token(token: str) -> Optional[str]:
+    """
+    Returns the ID of the user a JWT was issued to, if the token is valid.
+    Doesn't check that the user exists or is active.
+
+    :param token: the JWT.
+    :returns: the user ID, or None if the token is invalid.
+    """
+    strategy = get_jwt_strategy()
+    try:
+        data = decode_jwt(
+            token, strategy.decode_key, strategy.token_audience, algorithms=[strategy.algorithm]
+        )
+    except jwt.PyJWTError:
+        return None
+    return data.get("sub")
+
+
+def forget_user(user: User) -> None:
+    """
+    Drop this user from the cache of authenticated users. To be called every
+    time the user changes.
+
+    :param user: the user that changed.
+    """
+    user_id = str(user.id)
+    user_cache.pop_where(lambda key: key[0] == user_id)
+
+
 class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
+    """
+    Hashes and verifies passwords in the pool of ``password_helper`` rather
+    than on the event loop.
+    """
+
     reset_password_token_secret = SECRET
     verification_token_secret = SECRET
 
+    async def create(
+        self, user_create: UserCreate, safe: bool = False, request: Optional[Request] = None
+    ) -> User:
+        async with self.password_helper.prehashed(user_create.password):
+            return await super().create(user_create, safe=safe, request=request)
+
+    async def update(
+        self,
+        user_update: UserUpdate,
+        user: User,
+        safe: bool = False,
+        request: Optional[Request] = None,
+    ) -> User:
+        if user_update.password is None:
+            return await super().update(user_update, user, safe=safe, request=request)
+        async with self.password_helper.prehashed(user_update.password):
+            return await super().update(user_update, user, safe=safe, request=request)
+
+    async def forgot_password(self, user: User, request: Optional[Request] = None) -> None:
+        # The token holds a hash of the password hash, as a fingerprint
+        async with self.password_helper.prehashed(user.hashed_password):
+            return await super().forgot_password(user, request=request)
+
+    async def reset_password(
+        self, token: str, password: str, request: Optional[Request] = None
+    ) -> User:
+        # Same as BaseUserManager.reset_password, with the password checks done in the pool
+        try:
+            data = decode_jwt(
+                token, self.reset_password_token_secret, [self.reset_password_token_audience]
+            )
+            user_id, password_fingerprint = data["sub"], data["password_fgpt"]
+            user = await self.get(self.parse_id(user_id))
+        except (jwt.PyJWTError, KeyError, exceptions.InvalidID):
+            raise exceptions.InvalidResetPasswordToken()
+
+        valid_fingerprint, _ = await self.password_helper.verify_and_update_async(
+            user.hashed_password, password_fingerprint
+        )
+        if not valid_fingerprint:
+            raise exceptions.InvalidResetPasswordToken()
+        if not user.is_active:
+            raise exceptions.UserInactive()
+
+        async with self.password_helper.prehashed(password):
+            updated_user = await self._update(user, {"password": password})
+        await self.on_after_reset_password(user, request)
+        return updated_user
+
+    async def authenticate(self, credentials: OAuth2PasswordRequestForm) -> Optional[User]:
+        # Same as BaseUserManager.authenticate, with the password checks done in the pool
+        try:
+            user = await self.get_by_email(credentials.username)
+        except exceptions.UserNotExists:
+            # Run the hasher anyway to mitigate timing attacks
+            await self.password_helper.hash_async(credentials.password)
+            return None
+
+        verified, updated_password_hash = await self.password_helper.verify_and_update_async(
+            credentials.password, user.hashed_password
+        )
+        if not verified:
+            return None
+        if updated_password_hash is not None:
+            await self.user_db.update(user, {"hashed_password": updated_password_hash})
+        return user
+
     async def on_after_register(self, user: User, request: Optional[Request] = None):
         print(f"User {user.id} has registered.")
 
+    async def on_after_update(
+        self, user: User, update_dict: Dict[str, Any], request: Optional[Request] = None
+    ):
+        forget_user(user)
+
+    async def on_after_verify(self, user: User, request: Optional[Request] = None):
+        forget_user(user)
+
+    async def on_after_reset_password(self, user: User, request: Optional[Request] = None):
+        forget_user(user)
+
+    async def on_after_delete(self, user: User, request: Optional[Request] = None):
+        forget_user(user)
+
     async def on_after_forgot_password(
         self, user: User, token: str, request: Optional[Request] = None
     ):
@@ -34,14 +191,54 @@ class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
 
 
 async def get_user_manager(user_db: SQLAlchemyUserDatabase = Depends(get_user_db)):
-    yield UserManager(user_db)
+    yield UserManager(user_db, password_helper)
+
+
+class CachedJWTStrategy(JWTStrategy):
+    """
+    JWT strategy that remembers the active users it resolves for a few
+    seconds (see ``user_cache``), so that most authenticated requests don't
+    need to load the user from the database. Each request gets an instance
+    of its own, detached: routes changing the user add it to their session.
+
+    Changes to a user go through UserManager, whose hooks drop the user from
+    the cache. Other workers may keep seeing the old user for up to
+    USER_CACHE_TTL_SECONDS.
+    """
+
+    async def read_token(
+        self, token: Optional[str], user_manager: BaseUserManager[User, uuid.UUID]
+    ) -> Optional[User]:
+        if token is None:
+            return None
+        try:
+            data = decode_jwt(
+                token, self.decode_key, self.token_audience, algorithms=[self.algorithm]
+            )
+        except jwt.PyJWTError:
+            return None
+        user_id = data.get("sub")
+        if user_id is None:
+            return None
+
+        key = (user_id, token)
+        snapshot = user_cache.get(key)
+        if snapshot is not None:
+            return user_from_snapshot(snapshot)
+        try:
+            user = await user_manager.get(user_manager.parse_id(user_id))
+        except (exceptions.UserNotExists, exceptions.InvalidID):
+            return None
+        if user.is_active:
+            user_cache.set(key, user_snapshot(user))
+        return user
 
 
 bearer_transport = BearerTransport(tokenUrl="auth/jwt/login")
 
 
 def get_jwt_strategy() -> JWTStrategy:
-    return JWTStrategy(secret=SECRET, lifetime_seconds=3600)
+    return CachedJWTStrategy(secret=SECRET, lifetime_seconds=3600)
 
 
 auth_backend = AuthenticationBackend(
@@ -0,0 +1,364 @@
+"""
+Fills the configured database with a large synthetic dataset, for scaling
+tests, benchmarks and query plan checks. Run the migrations first:
+
+    flashcards-migrate
+    flashcards-generate-dataset --users 1000 --huge-decks 2 --reviews 10000000 --seed 42
+
+Rows are written with bulk Core inserts, bypassing the ORM helpers, their
+change log and their version counters: don't run it on a live database.
+Every user's password is ``password``.
+"""
+
+import argparse
+import asyncio
+import itertools
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, Iterator, List
+
+from fastapi_users.password import PasswordHelper
+from sqlalchemy import insert
+
+from flashcards_server.database import (
+    Card,
+    Deck,
+    DeckOwner,
+    Fact,
+    Review,
+    Tag,
+    User,
+    _referencing_column,
+    _self_association,
+    engine,
+)
+
+#: Relationships between related cards
+RELATIONSHIPS = ["similar", "opposite", "prerequisite", "example"]
+
+#: Share of the reviews done in each hour of the day: people study in the evening
+HOURLY_ACTIVITY = [
+    1,
+    1,
+    1,
+    1,
+    1,
+    2,
+    3,
+    5,
+    6,
+    6,
+    5,
+    5,
+    6,
+    5,
+    5,
+    5,
+    6,
+    7,
+    9,
+    11,
+    12,
+    10,
+    6,
+    3,
+]
+
+
+class DatasetGenerator:
+    """
+    Generates the rows of the dataset, reproducibly for a given seed, and
+    inserts them in batches.
+    """
+
+    def __init__(self, seed: int, batch_size: int):
+        self.random = random.Random(seed)
+        self.batch_size = batch_size
+        self.card_ids: List[uuid.UUID] = []
+        self._tag_columns = {}
+        # Midnight, and fixed so that seeds give the same data
+        self.now = datetime(2022, 10, 1)
+
+    def uuid(self) -> uuid.UUID:
+        return uuid.UUID(int=self.random.getrandbits(128), version=4)
+
+    async def insert(self, table, rows: Iterable[dict]) -> int:
+        """
+        Inserts the rows in batches, each in its own transaction.
+
+        :returns: how many rows were inserted.
+        """
+        count = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == self.batch_size:
+                count += await self._insert_batch(table, batch)
+                batch = []
+        if batch:
+            count += await self._insert_batch(table, batch)
+        return count
+
+    async def _insert_batch(self, table, batch: List[dict]) -> int:
+        async with engine.begin() as conn:
+            await conn.execute(insert(table), batch)
+        return len(batch)
+
+    def tags(self, count: int) -> List[dict]:
+        return [{"id": self.uuid(), "name": f"tag-{index}"} for index in range(count)]
+
+    def pick_tags(
+        self, tags: List[dict], cum_weights: List[float], most: int
+    ) -> List[dict]:
+        """
+        Picks up to ``most`` distinct tags, the first ones of the vocabulary
+        being more popular (Zipf's law).
+        """
+        picked = self.random.choices(
+            tags, cum_weights=cum_weights, k=self.random.randint(0, most)
+        )
+        return list({tag["id"]: tag for tag in picked}.values())
+
+    def tag_rows(
+        self, model, entity_id, tags: List[dict], cum_weights: List[float], most: int
+    ):
+        """
+        Rows of the associative table between ``model`` and tags, tagging
+        this entity with some tags of the vocabulary.
+        """
+        if model not in self._tag_columns:
+            table = model.tags.property.secondary
+            self._tag_columns[model] = (
+                _referencing_column(table, model.__table__).name,
+                _referencing_column(table, Tag.__table__).name,
+            )
+        entity_column, tag_column = self._tag_columns[model]
+        return [
+            {entity_column: entity_id, tag_column: tag["id"]}
+            for tag in self.pick_tags(tags, cum_weights, most)
+        ]
+
+    def review_times(self, count: int) -> Iterator[datetime]:
+        """
+        Review timestamps: recent days are busier than older ones, and
+        evenings busier than mornings.
+        """
+        for start in range(0, count, self.batch_size):
+            hours = self.random.choices(
+                range(24),
+                weights=HOURLY_ACTIVITY,
+                k=min(self.batch_size, count - start),
+            )
+            for hour in hours:
+                days_ago = min(365, int(self.random.expovariate(1 / 60)))
+                # self.now is midnight: the most recent day is the one before
+                day = self.now - timedelta(days=days_ago + 1)
+                yield day + timedelta(hours=hour, seconds=self.random.randrange(3600))
+
+
+async def generate(
+    users: int,
+    decks_per_user: int,
+    cards_per_deck: int,
+    huge_decks: int,
+    huge_deck_cards: int,
+    reviews: int,
+    tags: int,
+    related_share: float,
+    seed: int,
+    batch_size: int,
+):
+    generator = DatasetGenerator(seed=seed, batch_size=batch_size)
+    started_at = time.perf_counter()
+
+    def progress(message: str):
+        print(f"[{time.perf_counter() - started_at:7.1f}s] {message}")
+
+    vocabulary = generator.tags(tags)
+    weights = list(itertools.accumulate(1 / rank for rank in range(1, tags + 1)))
+    await generator.insert(Tag.__table__, vocabulary)
+    progress(f"{tags} tags")
+
+    hashed_password = PasswordHelper().hash("password")
+    user_rows = [
+        {
+            "id": generator.uuid(),
+            "email": f"user{index}@example.com",
+            "hashed_password": hashed_password,
+            "is_active": True,
+            "is_superuser": False,
+            "is_verified": True,
+        }
+        for index in range(users)
+    ]
+    await generator.insert(User.__table__, user_rows)
+    progress(f"{users} users")
+
+    decks, owners, tagged_decks = [], [], []
+    for user_index, user in enumerate(user_rows):
+        for deck_index in range(decks_per_user):
+            deck_id = generator.uuid()
+            decks.append(
+                {
+                    "id": deck_id,
+                    "name": f"Deck {deck_index} of user {user_index}",
+                    "description": "Generated deck",
+                    "algorithm": "random",
+                    "parameters": {},
+                    "state": {},
+                }
+            )
+            owners.append({"deck_id": deck_id, "owner_id": user["id"]})
+            tagged_decks += generator.tag_rows(
+                Deck, deck_id, vocabulary, weights, most=3
+            )
+    await generator.insert(Deck.__table__, decks)
+    await generator.insert(DeckOwner, owners)
+    await generator.insert(Deck.tags.property.secondary, tagged_decks)
+    progress(f"{len(decks)} decks")
+
+    await _generate_cards(
+        generator,
+        decks,
+        cards_per_deck=cards_per_deck,
+        huge_decks=huge_decks,
+        huge_deck_cards=huge_deck_cards,
+        vocabulary=vocabulary,
+        weights=weights,
+        related_share=related_share,
+        progress=progress,
+    )
+
+    if generator.card_ids:
+        await generator.insert(Review.__table__, _review_rows(generator, reviews))
+    progress(f"{reviews} reviews")
+
+
+async def _generate_cards(
+    generator: DatasetGenerator,
+    decks: List[dict],
+    cards_per_deck: int,
+    huge_decks: int,
+    huge_deck_cards: int,
+    vocabulary: List[dict],
+    weights: List[float],
+    related_share: float,
+    progress: Callable[[str], None],
+):
+    rng = generator.random
+    facts, cards, tagged_facts, tagged_cards, related = [], [], [], [], []
+    for deck_index, deck in enumerate(decks):
+        deck_start = len(generator.card_ids)
+        for index in range(
+            huge_deck_cards if deck_index < huge_decks else cards_per_deck
+        ):
+            card_id, question_id, answer_id = (
+                generator.uuid(),
+                generator.uuid(),
+                generator.uuid(),
+            )
+            facts += [
+                {"id": question_id, "value": f"Question {index}", "format": "text"},
+                {"id": answer_id, "value": f"Answer {index}", "format": "text"},
+            ]
+            cards.append(
+                {
+                    "id": card_id,
+                    "deck_id": deck["id"],
+                    "question_id": question_id,
+                    "answer_id": answer_id,
+                }
+            )
+            for fact_id in (question_id, answer_id):
+                tagged_facts += generator.tag_rows(
+                    Fact, fact_id, vocabulary, weights, most=2
+                )
+            tagged_cards += generator.tag_rows(
+                Card, card_id, vocabulary, weights, most=1
+            )
+            if index and rng.random() < related_share:
+                # Related cards are close to each other in the same deck
+                for _ in range(rng.randint(1, 3)):
+                    previous = rng.randrange(
+                        max(deck_start, deck_start + index - 100), deck_start + index
+                    )
+                    related.append(
+                        (
+                            card_id,
+                            generator.card_ids[previous],
+                            rng.choice(RELATIONSHIPS),
+                        )
+                    )
+            generator.card_ids.append(card_id)
+            if len(cards) >= generator.batch_size:
+                await _insert_cards(
+                    generator, facts, cards, tagged_facts, tagged_cards, related
+                )
+                facts, cards, tagged_facts, tagged_cards, related = [], [], [], [], []
+                progress(f"{len(generator.card_ids)} cards")
+    await _insert_cards(generator, facts, cards, tagged_facts, tagged_cards, related)
+    progress(f"{len(generator.card_ids)} cards")
+
+
+def _review_rows(generator: DatasetGenerator, count: int) -> Iterator[dict]:
+    rng = generator.random
+    card_ids = generator.card_ids
+    for review_time in generator.review_times(count):
+        yield {
+            "id": generator.uuid(),
+            # Skewed: some cards are studied much more than others
+            "card_id": card_ids[int(len(card_ids) * rng.random() ** 2)],
+            "result": rng.random() < 0.8,
+            "algorithm": "random",
+            "datetime": review_time,
+        }
+
+
+async def _insert_cards(generator, facts, cards, tagged_facts, tagged_cards, related):
+    await generator.insert(Fact.__table__, facts)
+    await generator.insert(Card.__table__, cards)
+    await generator.insert(Fact.tags.property.secondary, tagged_facts)
+    await generator.insert(Card.tags.property.secondary, tagged_cards)
+    related_cards = _self_association(Card.__table__)
+    if related_cards is not None:
+        table, source_column, related_column = related_cards
+        rows = []
+        for source_id, related_id, relationship in related:
+            row = {source_column.name: source_id, related_column.name: related_id}
+            if "relationship" in table.c:
+                row["relationship"] = relationship
+            rows.append(row)
+        await generator.insert(table, rows)
+
+
+def generate_dataset():
+    """
+    Entry point of ``flashcards-generate-dataset``.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--decks-per-user", type=int, default=3)
+    parser.add_argument("--cards-per-deck", type=int, default=200)
+    parser.add_argument(
+        "--huge-decks",
+        type=int,
+        default=1,
+        help="how many decks get --huge-deck-cards cards",
+    )
+    parser.add_argument("--huge-deck-cards", type=int, default=100_000)
+    parser.add_argument("--reviews", type=int, default=1_000_000)
+    parser.add_argument(
+        "--tags", type=int, default=500, help="size of the tag vocabulary"
+    )
+    parser.add_argument(
+        "--related-share",
+        type=float,
+        default=0.1,
+        help="share of the cards related to other cards",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    args = parser.parse_args()
+    asyncio.run(generate(**vars(args)))
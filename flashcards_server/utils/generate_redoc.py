@@ -35,7 +35,8 @@ def generate_redoc():
     """
     Export the ReDoc documentation page into a standalone HTML file.
     """
+    spec = app.openapi()
     with open("redoc.html", "w") as fd:
-        fd.write(HTML_TEMPLATE.format(json.dumps(app.openapi())))
+        fd.write(HTML_TEMPLATE.format(json.dumps(spec)))
     with open("spec.json", "w") as fd:
-        json.dump(app.openapi(), fd)
+        json.dump(spec, fd)
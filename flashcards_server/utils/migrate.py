@@ -0,0 +1,87 @@
+import sys
+from pathlib import Path
+from typing import Optional
+
+from alembic import command
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from flashcards_server.constants import SHARD_DIRECTORY, SQLALCHEMY_DATABASE_URL
+
+
+#: Where the migration scripts are, inside the package
+MIGRATIONS_PATH = Path(__file__).parent.parent / "migrations"
+
+
+def alembic_config(url: str = SQLALCHEMY_DATABASE_URL) -> Config:
+    """
+    Alembic configuration that doesn't need alembic.ini, so that the
+    migrations can run from an installed package.
+
+    :param url: the database to migrate
+    """
+    config = Config()
+    config.set_main_option("script_location", str(MIGRATIONS_PATH))
+    config.attributes["url"] = url
+    return config
+
+
+def head_revision() -> Optional[str]:
+    """
+    The latest revision of the migration scripts.
+    """
+    return ScriptDirectory.from_config(alembic_config()).get_current_head()
+
+
+async def current_revision(engine: AsyncEngine) -> Optional[str]:
+    """
+    The revision the database is at, or None if it was never migrated.
+
+    :param engine: the engine connected to the database
+    """
+    async with engine.connect() as conn:
+        return await conn.run_sync(
+            lambda sync_conn: MigrationContext.configure(
+                sync_conn
+            ).get_current_revision()
+        )
+
+
+def create_schema(connection: Connection) -> None:
+    """
+    Creates all the tables, and marks the database as being at the latest
+    revision, so that the next migrations apply to it.
+
+    :param connection: a sync connection to the new database
+    """
+    from flashcards_server.database import Base
+
+    Base.metadata.create_all(connection)
+    script = ScriptDirectory.from_config(alembic_config())
+    MigrationContext.configure(connection).stamp(script, "head")
+
+
+def upgrade_schema(revision: str = "head"):
+    """
+    Upgrade the database to the given revision (the latest by default), and
+    every shard too if sharding is on (see FLASHCARDS_SHARD_DIRECTORY).
+
+    Runs its own event loop: call it from a thread without one.
+    """
+    command.upgrade(alembic_config(), revision)
+    if SHARD_DIRECTORY:
+        for path in sorted(Path(SHARD_DIRECTORY).glob("*.db")):
+            command.upgrade(alembic_config(f"sqlite+aiosqlite:///{path}"), revision)
+
+
+def migrate(revision: str = "head"):
+    """
+    Upgrade the database and the shards, see ``upgrade_schema``.
+    Run it before starting the app: `flashcards-migrate [revision]`
+    """
+    if len(sys.argv) > 1:
+        revision = sys.argv[1]
+    upgrade_schema(revision)
@@ -0,0 +1,102 @@
+import argparse
+import json
+import os
+import sys
+from typing import Optional
+
+from fastapi import FastAPI
+from fastapi.openapi.utils import get_openapi
+
+from flashcards_server.constants import OPENAPI_PATH
+
+
+def build_openapi(app: FastAPI) -> dict:
+    """
+    Generates the OpenAPI schema from the routes of the app. Slow: it walks
+    every route and pydantic model.
+
+    :param app: the app to describe
+    """
+    return get_openapi(
+        title=app.title,
+        version=app.version,
+        openapi_version=app.openapi_version,
+        description=app.description,
+        routes=app.routes,
+    )
+
+
+def load_openapi(app: FastAPI, path: str = OPENAPI_PATH) -> dict:
+    """
+    Replacement for ``app.openapi``: reads the schema generated at build time
+    if there is one, and generates it otherwise. Either way, only once.
+
+    :param app: the app to describe
+    :param path: where the generated schema is
+    """
+    if app.openapi_schema is None:
+        if os.path.exists(path):
+            with open(path) as fd:
+                app.openapi_schema = json.load(fd)
+        else:
+            app.openapi_schema = build_openapi(app)
+    return app.openapi_schema
+
+
+def openapi_drift(app: FastAPI, path: str = OPENAPI_PATH) -> Optional[str]:
+    """
+    Compares the schema file with the routes of the app.
+
+    :param app: the app to describe
+    :param path: where the generated schema is
+    :returns: why the file is out of date, or None if it's not.
+    """
+    if not os.path.exists(path):
+        return f"{path} doesn't exist"
+    with open(path) as fd:
+        stored = json.load(fd)
+    live = build_openapi(app)
+    if stored == live:
+        return None
+    changed = sorted(
+        set(stored.get("paths", {})).symmetric_difference(live.get("paths", {}))
+        | {
+            route
+            for route in set(stored.get("paths", {})) & set(live.get("paths", {}))
+            if stored["paths"][route] != live["paths"][route]
+        }
+    )
+    return f"{path} is out of date" + (
+        f", check: {', '.join(changed)}" if changed else ""
+    )
+
+
+def generate_openapi():
+    """
+    Writes the OpenAPI schema of the app into the file the server reads it
+    from: `flashcards-openapi`. With `--check`, doesn't write anything but
+    fails if the file doesn't match the routes.
+    """
+    parser = argparse.ArgumentParser(
+        description="Generate the OpenAPI schema of the app."
+    )
+    parser.add_argument(
+        "--output", default=OPENAPI_PATH, help="where to write the schema"
+    )
+    parser.add_argument(
+        "--check", action="store_true", help="fail if the schema file is out of date"
+    )
+    args = parser.parse_args()
+
+    from flashcards_server.app import app
+
+    if args.check:
+        drift = openapi_drift(app, args.output)
+        if drift:
+            sys.exit(f"{drift}: run `flashcards-openapi`")
+        print(f"{args.output} is up to date")
+        return
+    with open(args.output, "w") as fd:
+        json.dump(build_openapi(app), fd, indent=2, sort_keys=True)
+        fd.write("\n")
+    print(f"OpenAPI schema written to {args.output}")
@@ -0,0 +1,244 @@
+"""
+Copies the data of each user from the main database into their own SQLite
+file, for sharding (see FLASHCARDS_SHARD_DIRECTORY). Stop the server first:
+
+    flashcards-migrate
+    FLASHCARDS_SHARD_DIRECTORY=/data/shards flashcards-split-shards
+
+Users whose shard already exists are skipped, unless --overwrite is given.
+The main database is left as is: once the shards are checked, the users'
+data can be removed from it.
+"""
+
+import argparse
+import asyncio
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Set
+from uuid import UUID
+
+from sqlalchemy import Table, insert, or_, select
+
+from flashcards_server.changelog import ChangeLog
+from flashcards_server.constants import SHARD_DIRECTORY
+from flashcards_server.database import (
+    Base,
+    Card,
+    Deck,
+    DeckOwner,
+    Fact,
+    Tag,
+    User,
+    engine,
+)
+from flashcards_server.leases import JobLease
+from flashcards_server.shards import (
+    create_shard_engine,
+    create_shard_schema,
+    shard_path,
+)
+from flashcards_server.versions import EntityVersion
+
+#: How many IDs go in each IN clause, below the SQLite limit of bound parameters
+CHUNK_SIZE = 500
+
+#: Tables of the main database only
+CENTRAL_TABLES = {User.__table__, JobLease}
+
+
+def _chunks(ids: Iterable, size: int = CHUNK_SIZE) -> Iterable[List]:
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        end = start + size
+        yield ids[start:end]
+
+
+def _references(table: Table) -> Dict[str, Table]:
+    """
+    The columns of this table holding a foreign key, and the table they point to.
+    """
+    return {
+        column.name: foreign_key.column.table
+        for column in table.columns
+        for foreign_key in column.foreign_keys
+    }
+
+
+class UserSplitter:
+    """
+    Finds the rows of one user in the main database, and copies them into a shard.
+    """
+
+    def __init__(self, conn, user_id: UUID):
+        self.conn = conn
+        self.user_id = user_id
+        #: The IDs of the user's rows of each entity table
+        self.ids: Dict[Table, Set] = {User.__table__: {user_id}}
+
+    async def _select_in(self, query, column, ids: Iterable) -> List:
+        rows = []
+        for chunk in _chunks(ids):
+            rows += (
+                (await self.conn.execute(query.where(column.in_(chunk))))
+                .mappings()
+                .all()
+            )
+        return rows
+
+    async def _scalars_in(self, query, column, ids: Iterable) -> Set:
+        values = set()
+        for chunk in _chunks(ids):
+            values.update(
+                (await self.conn.scalars(query.where(column.in_(chunk)))).all()
+            )
+        return values
+
+    async def find_entities(self) -> None:
+        """
+        Collects the IDs of the decks, cards, facts and tags of the user.
+        """
+        cards, decks, facts, tags = (
+            model.__table__ for model in (Card, Deck, Fact, Tag)
+        )
+        select_decks = select(DeckOwner.c.deck_id).where(
+            DeckOwner.c.owner_id == self.user_id
+        )
+        self.ids[decks] = set((await self.conn.scalars(select_decks)).all())
+        self.ids[cards] = await self._scalars_in(
+            select(cards.c.id), cards.c.deck_id, self.ids[decks]
+        )
+
+        # Their facts and tags: questions and answers, then the ones linked
+        # through associative tables, like contexts, related facts and tags
+        self.ids[facts] = set()
+        for card_column in (cards.c.question_id, cards.c.answer_id):
+            self.ids[facts] |= await self._scalars_in(
+                select(card_column), cards.c.id, self.ids[cards]
+            )
+        self.ids[tags] = set()
+        associations = [
+            (table, references)
+            for table, references in (
+                (t, _references(t)) for t in Base.metadata.sorted_tables
+            )
+            if table not in self.ids
+            and table not in CENTRAL_TABLES
+            and len(references) == 2
+        ]
+        for target in (facts, tags):
+            for table, references in associations:
+                for source_name, source in references.items():
+                    for target_name, target_table in references.items():
+                        if source_name == target_name or target_table is not target:
+                            continue
+                        if source in (decks, cards, facts):
+                            self.ids[target] |= await self._scalars_in(
+                                select(table.c[target_name]),
+                                table.c[source_name],
+                                self.ids[source],
+                            )
+
+    async def rows(self, table: Table) -> List[dict]:
+        """
+        The rows of the user in this table.
+        """
+        if table in self.ids:
+            return await self._select_in(select(table), table.c.id, self.ids[table])
+        if table is EntityVersion:
+            entity_ids = set().union(*self.ids.values())
+            return await self._select_in(select(table), table.c.entity_id, entity_ids)
+        if table is ChangeLog:
+            select_changes = select(table).where(
+                or_(
+                    table.c.owner_id == self.user_id,
+                    table.c.deck_id.in_(self.ids[Deck.__table__]),
+                )
+            )
+            return (await self.conn.execute(select_changes)).mappings().all()
+
+        # Rows depending on the user's rows: all their references must be the user's
+        references = {
+            name: target
+            for name, target in _references(table).items()
+            if target in self.ids
+        }
+        if not references:
+            return []
+        first, *others = references.items()
+        rows = await self._select_in(
+            select(table), table.c[first[0]], self.ids[first[1]]
+        )
+        return [
+            row
+            for row in rows
+            if all(
+                row[name] is None or row[name] in self.ids[target]
+                for name, target in others
+            )
+        ]
+
+
+async def split_user(user_id: UUID, directory: str, overwrite: bool = False) -> bool:
+    """
+    Copies the data of this user into their shard.
+
+    :returns: whether the shard was written.
+    """
+    path = shard_path(user_id, directory)
+    if path.exists():
+        if not overwrite:
+            return False
+        path.unlink()
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    shard_engine = create_shard_engine(path)
+    try:
+        await create_shard_schema(shard_engine)
+        async with engine.connect() as conn:
+            splitter = UserSplitter(conn, user_id)
+            await splitter.find_entities()
+            async with shard_engine.begin() as shard_conn:
+                for table in Base.metadata.sorted_tables:
+                    if table in CENTRAL_TABLES:
+                        continue
+                    rows = await splitter.rows(table)
+                    if rows:
+                        await shard_conn.execute(
+                            insert(table), [dict(row) for row in rows]
+                        )
+    finally:
+        await shard_engine.dispose()
+    return True
+
+
+async def split(directory: str, overwrite: bool = False) -> None:
+    async with engine.connect() as conn:
+        user_ids = (await conn.scalars(select(User.__table__.c.id))).all()
+    started_at = time.perf_counter()
+    written = 0
+    for user_id in user_ids:
+        written += await split_user(user_id, directory, overwrite=overwrite)
+    print(
+        f"Wrote {written} shards of {len(user_ids)} users in {directory} "
+        f"in {time.perf_counter() - started_at:.1f}s"
+    )
+
+
+def split_shards():
+    """
+    Entry point of ``flashcards-split-shards``.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--directory",
+        default=SHARD_DIRECTORY,
+        help="where to write the shards (FLASHCARDS_SHARD_DIRECTORY by default)",
+    )
+    parser.add_argument(
+        "--overwrite", action="store_true", help="rewrite existing shards"
+    )
+    args = parser.parse_args()
+    if not args.directory:
+        parser.error("Set FLASHCARDS_SHARD_DIRECTORY or --directory")
+    Path(args.directory).mkdir(parents=True, exist_ok=True)
+    asyncio.run(split(directory=args.directory, overwrite=args.overwrite))
@@ -0,0 +1,317 @@
+from collections import defaultdict
+from itertools import chain
+from typing import Dict, Iterable, Set, Tuple
+
+from uuid import UUID
+
+from fastapi import Request
+from sqlalchemy import Column, Integer, String, Table, event, inspect, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from flashcards_core.guid import GUID
+from flashcards_core.database import Base, Deck, Card, Tag, Fact
+
+
+#: Version counters of what the conditional GET endpoints return:
+#:  - ("decks", owner_id): the decks of a user (GET /decks)
+#:  - ("cards", deck_id): the cards of a deck (GET /decks/{deck_id}/cards)
+#:  - ("fact", fact_id): a fact (GET /facts/{fact_id})
+#: Counters only ever go up, and a missing row means version 0.
+EntityVersion = Table(
+    "entity_versions",
+    Base.metadata,
+    Column("entity", String(16), primary_key=True),
+    Column("entity_id", GUID(), primary_key=True),
+    Column("version", Integer(), nullable=False, default=1),
+)
+
+VersionKey = Tuple[str, UUID]
+
+_UPSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+async def get_version(session: Session, entity: str, entity_id: UUID) -> int:
+    """
+    Returns the current version of this entity.
+
+    :param session: the session (see flashcards_core.database:init_db()).
+    :param entity: "decks", "cards" or "fact" (see ``EntityVersion``).
+    :param entity_id: the owner, deck or fact ID.
+    :returns: the version, 0 if it never changed.
+    """
+    select_version = select(EntityVersion.c.version).where(
+        EntityVersion.c.entity == entity, EntityVersion.c.entity_id == entity_id
+    )
+    return (await session.scalar(select_version)) or 0
+
+
+async def bump_versions(
+    session: Session,
+    decks: Iterable[UUID] = (),
+    cards: Iterable[UUID] = (),
+    facts: Iterable[UUID] = (),
+    tags: Iterable[UUID] = (),
+    keys: Iterable[VersionKey] = (),
+) -> None:
+    """
+    Bumps the versions of everything showing these objects, in the session's
+    transaction.
+
+    Changes flushed by the ORM are tracked automatically: call this only
+    after changing rows with Core statements.
+
+    :param session: the session (see flashcards_core.database:init_db()).
+    :param decks: IDs of the changed decks.
+    :param cards: IDs of the changed cards.
+    :param facts: IDs of the changed facts.
+    :param tags: IDs of the changed tags.
+    :param keys: more version keys to bump as they are.
+    """
+
+    def bump(sync_session):
+        write_versions(
+            sync_session.connection(),
+            decks=decks,
+            cards=cards,
+            facts=facts,
+            tags=tags,
+            keys=keys,
+        )
+
+    await session.run_sync(bump)
+
+
+def write_versions(
+    connection: Connection,
+    decks: Iterable[UUID] = (),
+    cards: Iterable[UUID] = (),
+    facts: Iterable[UUID] = (),
+    tags: Iterable[UUID] = (),
+    keys: Iterable[VersionKey] = (),
+) -> None:
+    """
+    Same as ``bump_versions``, with the connection of a session: for the
+    code running in a flush, like the session listeners.
+    """
+    changed = {
+        Deck.__table__: set(decks),
+        Card.__table__: set(cards),
+        Fact.__table__: set(facts),
+        Tag.__table__: set(tags),
+    }
+    _upsert_versions(connection, _affected_keys(connection, changed, set()) | set(keys))
+
+
+def etag(entity: str, entity_id: UUID, version: int) -> str:
+    """
+    Returns the strong ETag of this version of the entity.
+    """
+    return f'"{entity}-{entity_id}-{version}"'
+
+
+def is_not_modified(request: Request, current_etag: str) -> bool:
+    """
+    Whether the client's copy, as given by If-None-Match, is still current.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    client_etags = [value.strip() for value in if_none_match.split(",")]
+    return "*" in client_etags or current_etag in client_etags
+
+
+def _upsert_versions(connection: Connection, keys: Set[VersionKey]) -> None:
+    if not keys:
+        return
+    insert = _UPSERTS[connection.dialect.name]
+    rows = [
+        {"entity": entity, "entity_id": entity_id, "version": 1}
+        # Same lock order for every writer
+        for entity, entity_id in sorted(keys, key=str)
+    ]
+    upsert = insert(EntityVersion).values(rows)
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[EntityVersion.c.entity, EntityVersion.c.entity_id],
+        set_={"version": EntityVersion.c.version + 1},
+    )
+    connection.execute(upsert)
+
+
+def _tracked_tables() -> Set[Table]:
+    return {Deck.__table__, Card.__table__, Fact.__table__, Tag.__table__}
+
+
+def _changed_ids(session: Session, objects: Iterable) -> Tuple[Dict[Table, set], set]:
+    """
+    Returns the IDs of the decks, cards, facts and tags touched by these
+    objects, and the decks the touched cards are (or were) in.
+    """
+    tracked, associations = _tracked_tables(), _association_tables()
+    changed = defaultdict(set)
+    card_decks = set()
+    for obj in objects:
+        state = inspect(obj)
+        mapper = state.mapper
+        table = mapper.local_table
+        if table not in tracked and table not in associations:
+            continue  # Like the reviews, not shown by the conditional endpoints
+        if table in tracked:
+            changed[table].add(mapper.primary_key_from_instance(obj)[0])
+            if table is Card.__table__:
+                history = state.attrs.deck_id.history
+                card_decks.update(history.added, history.unchanged, history.deleted)
+            continue
+        # Association objects: whatever they point to changed
+        for column in table.columns:
+            for foreign_key in column.foreign_keys:
+                if foreign_key.column.table in tracked:
+                    key = mapper.get_property_by_column(column).key
+                    changed[foreign_key.column.table].add(state.dict.get(key))
+    for ids in changed.values():
+        ids.discard(None)
+    card_decks.discard(None)
+    return changed, card_decks
+
+
+def _association_tables() -> Iterable[Table]:
+    """
+    The associative tables between tracked tables, like the tags of the
+    cards: the tables of the server referencing them (like the card states)
+    don't link them.
+    """
+    tracked = _tracked_tables()
+    return [
+        table
+        for table in Base.metadata.sorted_tables
+        if table not in tracked
+        and len(table.foreign_keys) > 1
+        and all(
+            foreign_key.column.table in tracked for foreign_key in table.foreign_keys
+        )
+    ]
+
+
+def _references(column: Column, target: Table) -> bool:
+    return any(
+        foreign_key.column.table is target for foreign_key in column.foreign_keys
+    )
+
+
+def _linked_ids(connection: Connection, target: Table, ids: set, other: Table) -> set:
+    """
+    Returns the IDs of the rows of ``other`` linked to these rows of
+    ``target`` through the associative tables.
+    """
+    linked = set()
+    if not ids:
+        return linked
+    for table in _association_tables():
+        for target_column in [c for c in table.columns if _references(c, target)]:
+            for other_column in [c for c in table.columns if _references(c, other)]:
+                if other_column is not target_column:
+                    select_linked = select(other_column).where(target_column.in_(ids))
+                    linked.update(connection.execute(select_linked).scalars())
+    return linked
+
+
+def _affected_keys(
+    connection: Connection, changed: Dict[Table, set], card_decks: set
+) -> Set[VersionKey]:
+    """
+    Returns the versions to bump when these objects change: the facts
+    related to a changed fact, the cards showing a changed fact, tag or
+    related card, the decks of those cards, and the owners of changed decks.
+    """
+    deck_table, card_table = Deck.__table__, Card.__table__
+    fact_table, tag_table = Fact.__table__, Tag.__table__
+    decks = set(changed.get(deck_table, ()))
+    cards = set(changed.get(card_table, ()))
+    facts = set(changed.get(fact_table, ()))
+    tags = changed.get(tag_table, set())
+
+    decks |= _linked_ids(connection, tag_table, tags, deck_table)
+    cards |= _linked_ids(connection, tag_table, tags, card_table)
+    facts |= _linked_ids(connection, tag_table, tags, fact_table)
+
+    facts |= _linked_ids(connection, fact_table, facts, fact_table)
+    if facts:
+        cards |= _linked_ids(connection, fact_table, facts, card_table)
+        select_cards = select(card_table.c.id).where(
+            card_table.c.question_id.in_(facts) | card_table.c.answer_id.in_(facts)
+        )
+        cards.update(connection.execute(select_cards).scalars())
+
+    cards |= _linked_ids(connection, card_table, cards, card_table)
+    card_decks = set(card_decks)
+    if cards:
+        select_decks = select(card_table.c.deck_id).where(card_table.c.id.in_(cards))
+        card_decks.update(connection.execute(select_decks).scalars())
+
+    owners = set()
+    if decks:
+        deck_owners = Base.metadata.tables["deck_owners"]
+        select_owners = select(deck_owners.c.owner_id).where(
+            deck_owners.c.deck_id.in_(decks)
+        )
+        owners.update(connection.execute(select_owners).scalars())
+
+    return set(
+        chain(
+            (("decks", owner_id) for owner_id in owners),
+            (("cards", deck_id) for deck_id in card_decks),
+            (("fact", fact_id) for fact_id in facts),
+        )
+    )
+
+
+def _modified(session: Session) -> list:
+    return [obj for obj in session.dirty if session.is_modified(obj)]
+
+
+def _unlinked(session: Session) -> list:
+    """
+    The modified objects that may lose links at the flush: those with a
+    changed collection of linked objects.
+    """
+    return [
+        obj
+        for obj in _modified(session)
+        if any(
+            relationship.secondary is not None
+            and inspect(obj).attrs[relationship.key].history.has_changes()
+            for relationship in inspect(obj).mapper.relationships
+        )
+    ]
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_removed_links(session, flush_context, instances):
+    """
+    Deleted objects, and objects whose collections changed, lose links that
+    only exist until the flush: find what shows them while the rows are
+    still there. The other changes are all found after the flush.
+    """
+    if not session.deleted and not session.dirty:
+        return
+    changed, card_decks = _changed_ids(
+        session, chain(session.deleted, _unlinked(session))
+    )
+    if changed or card_decks:
+        keys = _affected_keys(session.connection(), changed, card_decks)
+        session.info.setdefault("pending_versions", set()).update(keys)
+
+
+@event.listens_for(Session, "after_flush")
+def _bump_flushed_versions(session, flush_context):
+    """
+    Bumps the versions of everything showing the objects of this flush, in
+    the same transaction. Flushes changing nothing tracked send no query.
+    """
+    keys = session.info.pop("pending_versions", set())
+    changed, card_decks = _changed_ids(session, chain(session.new, _modified(session)))
+    if changed or card_decks:
+        keys |= _affected_keys(session.connection(), changed, card_decks)
+    if keys:
+        _upsert_versions(session.connection(), keys)
@@ -0,0 +1,181 @@
+"""
+Load test of the main endpoints: registration and login, deck listing, card
+paging, fact search and study sessions, with many concurrent virtual users.
+
+Runs against the ASGI app in process, on a fresh SQLite database unless
+FLASHCARDS_DATABASE_URL is set, and writes the results as JSON:
+
+    python tests/benchmarks/bench_api.py --users 20 --output before.json
+    ... change something ...
+    python tests/benchmarks/bench_api.py --users 20 --output after.json
+    python tests/benchmarks/compare.py before.json after.json
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import uuid
+
+# Must be set before the app is imported
+os.environ.setdefault("FLASHCARDS_RATE_LIMITING", "0")
+os.environ.setdefault("FLASHCARDS_SCHEMA_MODE", "create")
+os.environ.setdefault(
+    "FLASHCARDS_DATABASE_URL",
+    f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/benchmark.db",
+)
+
+import httpx  # noqa: E402
+
+from flashcards_server.app import app  # noqa: E402
+from flashcards_server.database import create_db_and_tables  # noqa: E402
+from harness import Report, run_scenario  # noqa: E402
+
+
+PASSWORD = "benchmark-password"
+
+
+async def register_and_login(client: httpx.AsyncClient, state: dict) -> httpx.Response:
+    email = f"{uuid.uuid4()}@example.com"
+    await client.post("/register", json={"email": email, "password": PASSWORD})
+    response = await client.post(
+        "/auth/jwt/login", data={"username": email, "password": PASSWORD}
+    )
+    state["email"] = email
+    state["headers"] = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    return response
+
+
+async def create_deck(client: httpx.AsyncClient, state: dict, cards: int) -> None:
+    """
+    Gives the virtual user a deck with ``cards`` cards, with a tag for the searches.
+    """
+    response = await client.post(
+        "/decks/",
+        headers=state["headers"],
+        json={"name": "benchmark", "description": "benchmark", "algorithm": "random"},
+    )
+    state["deck_id"] = response.json()["id"]
+    state["tag"] = str(uuid.uuid4())
+    for index in range(cards):
+        facts = []
+        for side in ("question", "answer"):
+            fact = {
+                "value": f"{side} {index}",
+                "format": "text",
+                "tags": [{"name": state["tag"]}],
+            }
+            response = await client.post("/facts/", headers=state["headers"], json=fact)
+            facts.append(response.json())
+        await client.post(
+            f"/decks/{state['deck_id']}/cards",
+            headers=state["headers"],
+            json={"question_id": facts[0]["id"], "answer_id": facts[1]["id"]},
+        )
+
+
+async def list_decks(client: httpx.AsyncClient, state: dict) -> httpx.Response:
+    return await client.get("/decks", headers=state["headers"])
+
+
+async def page_cards(client: httpx.AsyncClient, state: dict) -> httpx.Response:
+    offset = state.get("offset", 0)
+    response = await client.get(
+        f"/decks/{state['deck_id']}/cards?offset={offset}&limit=10",
+        headers=state["headers"],
+    )
+    state["offset"] = (
+        offset + 10 if response.status_code == 200 and response.json() else 0
+    )
+    return response
+
+
+async def search_facts(client: httpx.AsyncClient, state: dict) -> httpx.Response:
+    return await client.get(
+        f"/facts/tag/{state['tag']}?limit=20", headers=state["headers"]
+    )
+
+
+async def study(client: httpx.AsyncClient, state: dict) -> httpx.Response:
+    """
+    One step of a study session: answer the current card, get the next one.
+    """
+    if "card_id" not in state:
+        response = await client.get(
+            f"/study/{state['deck_id']}/start", headers=state["headers"]
+        )
+    else:
+        response = await client.post(
+            f"/study/{state['deck_id']}/next",
+            headers=state["headers"],
+            json={"card_id": state["card_id"], "result": random.random() > 0.3},
+        )
+    if response.status_code == 200:
+        state["card_id"] = response.json()["id"]
+    return response
+
+
+async def main(users: int, iterations: int, cards: int, seed: int, output: str):
+    random.seed(seed)
+    await create_db_and_tables()
+    report = Report(
+        parameters={
+            "users": users,
+            "iterations": iterations,
+            "cards": cards,
+            "seed": seed,
+        }
+    )
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        states = [{} for _ in range(users)]
+        scenarios = [
+            # Password hashing is slow on purpose: one round per user is enough
+            ("register+login", 1, register_and_login),
+            ("list decks", iterations, list_decks),
+            ("page cards", iterations, page_cards),
+            ("search facts", iterations, search_facts),
+            ("study", iterations, study),
+        ]
+        for name, scenario_iterations, action in scenarios:
+            result = await run_scenario(
+                name, client, states, scenario_iterations, action
+            )
+            report.scenarios.append(result)
+            report.print_summary(result)
+            if name == "register+login":
+                await asyncio.gather(
+                    *(create_deck(client, state, cards) for state in states)
+                )
+
+    report.save(output)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--users", type=int, default=20, help="concurrent virtual users"
+    )
+    parser.add_argument(
+        "--iterations", type=int, default=50, help="requests per user and scenario"
+    )
+    parser.add_argument(
+        "--cards", type=int, default=30, help="cards in each user's deck"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="seed of the study answers")
+    parser.add_argument(
+        "--output", default="benchmark.json", help="where to write the results"
+    )
+    args = parser.parse_args()
+    asyncio.run(
+        main(
+            users=args.users,
+            iterations=args.iterations,
+            cards=args.cards,
+            seed=args.seed,
+            output=args.output,
+        )
+    )
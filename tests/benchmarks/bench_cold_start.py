@@ -0,0 +1,59 @@
+"""
+Measures how long a new worker takes to import the app, with the slow
+imports deferred (as served) or done upfront (as before they were deferred).
+
+Each run is a new interpreter, so nothing is cached in memory:
+
+    python tests/benchmarks/bench_cold_start.py --runs 15
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+
+#: Imported at startup before they were deferred to the routes needing them
+EAGER_IMPORTS = ["flashcards_server.utils.migrate", "flashcards_core.schedulers"]
+
+#: Times the import of the app in a new interpreter, and prints what it pulled in
+IMPORT_APP = """
+import importlib, json, sys, time
+start = time.perf_counter()
+for module in {modules!r}:
+    importlib.import_module(module)
+import flashcards_server.app
+print(json.dumps({{
+    "seconds": time.perf_counter() - start,
+    "deferred": [m for m in {deferred!r} if m not in sys.modules],
+}}))
+"""
+
+
+def import_app(eager: bool) -> dict:
+    code = IMPORT_APP.format(
+        modules=EAGER_IMPORTS if eager else [], deferred=EAGER_IMPORTS
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main(runs: int):
+    for name, eager in (("deferred", False), ("upfront", True)):
+        import_app(eager)  # Warms up the file system cache
+        results = [import_app(eager) for _ in range(runs)]
+        seconds = [result["seconds"] for result in results]
+        print(
+            f"{name:>10}: median {statistics.median(seconds) * 1000:7.1f} ms   "
+            f"min {min(seconds) * 1000:7.1f} ms   "
+            f"not imported: {', '.join(results[0]['deferred']) or 'nothing'}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=15, help="imports to time per mode")
+    args = parser.parse_args()
+    main(runs=args.runs)
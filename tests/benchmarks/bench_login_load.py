@@ -0,0 +1,90 @@
+"""
+Measures the latency of the study endpoint while other clients log in.
+
+Password hashing is deliberately slow: this shows how much it delays the
+other requests served by the same worker. Run it once per executor type
+and compare:
+
+    export FLASHCARDS_PASSWORD_HASHING_EXECUTOR=inline
+    python tests/benchmarks/bench_login_load.py --output inline.json
+    export FLASHCARDS_PASSWORD_HASHING_EXECUTOR=thread
+    python tests/benchmarks/bench_login_load.py --output thread.json
+    python tests/benchmarks/compare.py inline.json thread.json
+"""
+import argparse
+import asyncio
+
+import httpx
+
+# Sets up the database and the app for the benchmarks
+from bench_api import (
+    PASSWORD,
+    app,
+    create_db_and_tables,
+    create_deck,
+    register_and_login,
+    study,
+)
+from flashcards_server.constants import PASSWORD_HASHING_EXECUTOR
+from harness import Report, run_scenario
+
+
+async def keep_logging_in(client: httpx.AsyncClient, state: dict, stop: asyncio.Event):
+    while not stop.is_set():
+        await client.post(
+            "/auth/jwt/login", data={"username": state["email"], "password": PASSWORD}
+        )
+
+
+async def main(logins: int, requests: int, output: str):
+    await create_db_and_tables()
+    report = Report(
+        parameters={
+            "logins": logins,
+            "requests": requests,
+            "executor": PASSWORD_HASHING_EXECUTOR,
+        }
+    )
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        student = {}
+        await register_and_login(client, student)
+        await create_deck(client, student, cards=10)
+        login_users = [{} for _ in range(logins)]
+        for state in login_users:
+            await register_and_login(client, state)
+
+        print(f"Password hashing executor: {PASSWORD_HASHING_EXECUTOR}")
+        result = await run_scenario("idle", client, [student], requests, study)
+        report.scenarios.append(result)
+        report.print_summary(result)
+
+        stop = asyncio.Event()
+        login_load = [
+            asyncio.create_task(keep_logging_in(client, state, stop))
+            for state in login_users
+        ]
+        result = await run_scenario(
+            f"{logins} logins in flight", client, [student], requests, study
+        )
+        report.scenarios.append(result)
+        report.print_summary(result)
+        stop.set()
+        await asyncio.gather(*login_load)
+    report.save(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--logins", type=int, default=8, help="concurrent login loops")
+    # Few: with the inline executor, each takes seconds while logins are in flight
+    parser.add_argument(
+        "--requests", type=int, default=20, help="study requests to time"
+    )
+    parser.add_argument(
+        "--output", default="login_load.json", help="where to write the results"
+    )
+    args = parser.parse_args()
+    asyncio.run(main(logins=args.logins, requests=args.requests, output=args.output))
@@ -0,0 +1,105 @@
+"""
+Compares read and write throughput on SQLite between the default engine and
+WAL mode (a single writer connection plus a pool of read-only connections).
+
+    python tests/benchmarks/bench_sqlite_concurrency.py --writers 8 --readers 32
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, func, select, update
+from sqlalchemy.exc import OperationalError
+
+from flashcards_server.database import create_database_engine, create_sqlite_engines
+
+
+metadata = MetaData()
+counters = Table(
+    "counters",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("name", String),
+    Column("value", Integer, nullable=False),
+)
+ROWS = 1000
+
+
+async def setup(engine) -> None:
+    async with engine.begin() as connection:
+        await connection.run_sync(metadata.create_all)
+        await connection.execute(
+            counters.insert(),
+            [{"id": i, "name": f"row {i}", "value": 0} for i in range(ROWS)],
+        )
+
+
+async def writer(engine, deadline: float, stats: dict) -> None:
+    while time.perf_counter() < deadline:
+        try:
+            async with engine.begin() as connection:
+                row_id = random.randrange(ROWS)
+                await connection.execute(
+                    update(counters)
+                    .where(counters.c.id == row_id)
+                    .values(value=counters.c.value + 1)
+                )
+            stats["writes"] += 1
+        except OperationalError:
+            stats["errors"] += 1
+
+
+async def reader(engine, deadline: float, stats: dict) -> None:
+    while time.perf_counter() < deadline:
+        try:
+            async with engine.connect() as connection:
+                await connection.execute(select(func.sum(counters.c.value)))
+            stats["reads"] += 1
+        except OperationalError:
+            stats["errors"] += 1
+
+
+async def run(label, write_engine, read_engine, writers, readers, seconds) -> None:
+    await setup(write_engine)
+    stats = {"reads": 0, "writes": 0, "errors": 0}
+    deadline = time.perf_counter() + seconds
+    await asyncio.gather(
+        *[writer(write_engine, deadline, stats) for _ in range(writers)],
+        *[reader(read_engine, deadline, stats) for _ in range(readers)],
+    )
+    print(
+        f"{label:>8}: {stats['writes'] / seconds:8.0f} writes/s  "
+        f"{stats['reads'] / seconds:8.0f} reads/s  {stats['errors']} errors"
+    )
+    await write_engine.dispose()
+    if read_engine is not write_engine:
+        await read_engine.dispose()
+
+
+async def main(writers: int, readers: int, seconds: float) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        url = f"sqlite+aiosqlite:///{os.path.join(directory, 'default.db')}"
+        engine = create_database_engine(url)
+        await run("default", engine, engine, writers, readers, seconds)
+
+        url = f"sqlite+aiosqlite:///{os.path.join(directory, 'wal.db')}"
+        writer_engine, reader_engine = create_sqlite_engines(url)
+        await run("WAL", writer_engine, reader_engine, writers, readers, seconds)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--writers", type=int, default=8, help="concurrent writing tasks"
+    )
+    parser.add_argument(
+        "--readers", type=int, default=32, help="concurrent reading tasks"
+    )
+    parser.add_argument(
+        "--seconds", type=float, default=10, help="duration of each run"
+    )
+    args = parser.parse_args()
+    asyncio.run(main(writers=args.writers, readers=args.readers, seconds=args.seconds))
@@ -0,0 +1,56 @@
+"""
+Compares two benchmark reports written by bench_api.py, scenario by scenario.
+
+    python tests/benchmarks/compare.py before.json after.json --threshold 10
+
+Exits with 1 if the p95 latency of any scenario got worse by more than the
+threshold (in percent), so it can gate a CI job.
+"""
+import argparse
+import json
+import sys
+
+
+def load(path: str) -> dict:
+    with open(path) as fd:
+        report = json.load(fd)
+    return {scenario["name"]: scenario for scenario in report["scenarios"]}
+
+
+def change(before: float, after: float) -> float:
+    return (after - before) / before * 100 if before else 0.0
+
+
+def compare(before_path: str, after_path: str, threshold: float) -> bool:
+    before, after = load(before_path), load(after_path)
+    regressed = False
+    print(f"{'scenario':>16}  {'req/s':>18}  {'p95 ms':>18}  {'p99 ms':>18}")
+    for name, new in after.items():
+        old = before.get(name)
+        if old is None:
+            print(f"{name:>16}  (new scenario)")
+            continue
+        p95_change = change(old["p95_ms"], new["p95_ms"])
+        flag = ""
+        if p95_change > threshold:
+            regressed = True
+            flag = "  <-- slower"
+        print(
+            f"{name:>16}  "
+            f"{old['throughput']:7.1f} -> {new['throughput']:7.1f}  "
+            f"{old['p95_ms']:7.1f} -> {new['p95_ms']:7.1f}  "
+            f"{old['p99_ms']:7.1f} -> {new['p99_ms']:7.1f}"
+            f"{flag}"
+        )
+    return not regressed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("before", help="report of the baseline")
+    parser.add_argument("after", help="report to compare with the baseline")
+    parser.add_argument(
+        "--threshold", type=float, default=10, help="allowed p95 slowdown, in percent"
+    )
+    args = parser.parse_args()
+    sys.exit(0 if compare(args.before, args.after, args.threshold) else 1)
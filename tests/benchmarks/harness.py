@@ -0,0 +1,118 @@
+"""
+Shared pieces of the benchmarks: virtual users hammering the ASGI app in
+process, latency percentiles, and JSON reports that can be compared across
+commits with ``compare.py``.
+"""
+import asyncio
+import json
+import platform
+import statistics
+import subprocess
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Awaitable, Callable, List, Optional
+
+import httpx
+
+
+#: What a virtual user does at each iteration: given its client and its own
+#: state, send one request and return the response
+Action = Callable[[httpx.AsyncClient, dict], Awaitable[httpx.Response]]
+
+
+@dataclass
+class ScenarioResult:
+    name: str
+    virtual_users: int
+    requests: int
+    errors: int
+    duration_seconds: float
+    throughput: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+
+
+@dataclass
+class Report:
+    parameters: dict
+    scenarios: List[ScenarioResult] = field(default_factory=list)
+    commit: Optional[str] = field(default_factory=lambda: git_commit())
+    timestamp: str = field(default_factory=lambda: datetime.utcnow().isoformat())
+    python: str = field(default_factory=platform.python_version)
+    platform: str = field(default_factory=platform.platform)
+
+    def print_summary(self, result: ScenarioResult) -> None:
+        print(
+            f"{result.name:>16}: {result.throughput:8.1f} req/s   "
+            f"p50 {result.p50_ms:7.1f} ms   p95 {result.p95_ms:7.1f} ms   "
+            f"p99 {result.p99_ms:7.1f} ms   errors {result.errors}"
+        )
+
+    def save(self, path: str) -> None:
+        with open(path, "w") as fd:
+            json.dump(asdict(self), fd, indent=2)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentile(latencies: List[float], percent: int) -> float:
+    if len(latencies) < 2:
+        return latencies[0] if latencies else 0.0
+    return statistics.quantiles(latencies, n=100)[percent - 1]
+
+
+async def run_scenario(
+    name: str,
+    client: httpx.AsyncClient,
+    states: List[dict],
+    iterations: int,
+    action: Action,
+) -> ScenarioResult:
+    """
+    Runs ``action`` ``iterations`` times for each virtual user, all the
+    users at the same time.
+
+    :param name: the name of the scenario, in the report.
+    :param client: the client connected to the app.
+    :param states: one state per virtual user (its headers, deck, ...).
+    :param iterations: how many requests each virtual user sends.
+    :param action: what a virtual user does at each iteration.
+    """
+    latencies = []
+    errors = 0
+
+    async def virtual_user(state: dict):
+        nonlocal errors
+        for _ in range(iterations):
+            start = time.perf_counter()
+            try:
+                response = await action(client, state)
+                if response.status_code >= 400:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(virtual_user(state) for state in states))
+    duration = time.perf_counter() - start
+    return ScenarioResult(
+        name=name,
+        virtual_users=len(states),
+        requests=len(latencies),
+        errors=errors,
+        duration_seconds=duration,
+        throughput=len(latencies) / duration if duration else 0.0,
+        p50_ms=percentile(latencies, 50) * 1000,
+        p95_ms=percentile(latencies, 95) * 1000,
+        p99_ms=percentile(latencies, 99) * 1000,
+    )
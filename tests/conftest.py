@@ -1,5 +1,111 @@
+import os
+import re
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List
+
+import pytest
 from fastapi.testclient import TestClient
-from flashcards_server.app import app
+from sqlalchemy import event
+
+# Tests send lots of requests from the same client: rate limiting is tested on its own
+os.environ.setdefault("FLASHCARDS_RATE_LIMITING", "0")
+# Tests start from an empty database, without migrating it
+os.environ.setdefault("FLASHCARDS_SCHEMA_MODE", "create")
+
+from flashcards_server.app import app  # noqa: E402
+from flashcards_server.database import engine, read_engine  # noqa: E402
 
 
 client = TestClient(app)
+
+
+def register_user() -> Dict[str, str]:
+    """
+    Registers a new user and returns the headers needed to authenticate as them.
+    """
+    with client:  # Runs the startup event, which creates the tables
+        email = f"{uuid.uuid4()}@example.com"
+        client.post("/register", json={"email": email, "password": "password"})
+        response = client.post(
+            "/auth/jwt/login", data={"username": email, "password": "password"}
+        )
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture
+def auth_headers():
+    return register_user()
+
+
+@pytest.fixture
+def other_auth_headers():
+    """
+    The headers of another user, for what users share.
+    """
+    return register_user()
+
+
+@contextmanager
+def count_queries():
+    """
+    Collects the SQL statements sent to the database within this block.
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engines = {engine.sync_engine, read_engine.sync_engine}
+    for sync_engine in engines:
+        event.listen(sync_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        for sync_engine in engines:
+            event.remove(sync_engine, "before_cursor_execute", before_cursor_execute)
+
+
+#: Matches lists of bound parameters, like the ones of IN clauses
+_PARAMETER_LIST = re.compile(
+    r"\((?:\s*(?:\?|%s|%\(\w+\)s|\$\d+(?:::\w+)?|:\w+)\s*,?)+\)"
+)
+
+
+def repeated_statements(statements: List[str], max_repeats: int) -> Dict[str, int]:
+    """
+    Returns the statements sent more than ``max_repeats`` times, differing
+    only in their parameters: usually, a query run once per row (N+1).
+    """
+    normalized = Counter(
+        " ".join(_PARAMETER_LIST.sub("(?)", statement).split())
+        for statement in statements
+    )
+    return {
+        statement: count
+        for statement, count in normalized.items()
+        if count > max_repeats
+    }
+
+
+@contextmanager
+def query_budget(max_queries: int, max_repeats: int = 3):
+    """
+    Fails if the code in this block sends more than ``max_queries`` SQL
+    statements, or the same statement more than ``max_repeats`` times.
+
+    Batched loaders (``selectinload``) may legitimately send the same
+    statement a few times, once per relationship. To catch per-row queries,
+    make the block handle more rows than ``max_repeats``.
+    """
+    with count_queries() as statements:
+        yield statements
+    repeated = repeated_statements(statements, max_repeats)
+    assert not repeated, "Statements repeated for each row (N+1?):\n" + "\n".join(
+        f"{count} x {statement}" for statement, count in repeated.items()
+    )
+    assert len(statements) <= max_queries, (
+        f"{len(statements)} statements, over the budget of {max_queries}:\n"
+        + "\n".join(statements)
+    )
@@ -1,5 +1,7 @@
 from conftest import client
-import flashcards_core
+
+# The app only imports the schedulers when a route needs them
+import flashcards_core.schedulers
 
 
 # def test_endpoints_are_protected():
@@ -0,0 +1,85 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from flashcards_server.archive import (
+    ArchivedReview,
+    ReviewArchive,
+    archive_reviews,
+    pack_reviews,
+    unpack_reviews,
+    with_archived_reviews,
+)
+from flashcards_server.database import Base, Review
+
+
+def make_reviews(card_id, count, start=datetime(2022, 1, 1)):
+    return [
+        ArchivedReview(
+            id=uuid.uuid4(),
+            card_id=card_id,
+            result=str(index % 4),
+            algorithm="random" if index % 3 else "ebisu",
+            datetime=start + timedelta(days=index, microseconds=index),
+        )
+        for index in range(count)
+    ]
+
+
+def test_pack_reviews_round_trip():
+    card_id = uuid.uuid4()
+    reviews = make_reviews(card_id, 1000)
+    data = pack_reviews(reviews)
+    assert unpack_reviews(card_id, data) == reviews
+    assert len(data) < 20 * len(reviews)
+    assert unpack_reviews(card_id, pack_reviews([])) == []
+
+
+def test_archive_reviews(tmp_path):
+    card_id, other_card_id = uuid.uuid4(), uuid.uuid4()
+    reviews = make_reviews(card_id, 10)
+    other_reviews = make_reviews(other_card_id, 2)
+
+    async def scenario():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/archive.db")
+        session_maker = sessionmaker(
+            engine, class_=AsyncSession, expire_on_commit=False
+        )
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            rows = [vars(review) for review in reviews + other_reviews]
+            await conn.execute(insert(Review.__table__), rows)
+
+        async with session_maker() as session:
+            older_than = reviews[4].datetime
+            assert await archive_reviews(session, older_than, batch_size=1) == 1
+            assert await archive_reviews(session, older_than, batch_size=1) == 1
+            assert await archive_reviews(session, older_than, batch_size=1) == 0
+            # Merged into the existing archive
+            older_than = reviews[8].datetime
+            assert await archive_reviews(session, older_than, batch_size=1) == 1
+            assert await archive_reviews(session, older_than, batch_size=1) == 0
+
+            hot = (
+                await session.scalars(select(Review).where(Review.card_id == card_id))
+            ).all()
+            archived_count = await session.scalar(
+                select(ReviewArchive.c.reviews_count).where(
+                    ReviewArchive.c.card_id == card_id
+                )
+            )
+            history = await with_archived_reviews(session, card_id, hot)
+        await engine.dispose()
+        return hot, archived_count, history
+
+    hot, archived_count, history = asyncio.run(scenario())
+    assert len(hot) == 2
+    assert archived_count == 8
+    assert [review.id for review in history] == [review.id for review in reviews]
+    assert [review.result for review in history] == [
+        review.result for review in reviews
+    ]
@@ -0,0 +1,189 @@
+import asyncio
+import uuid
+
+from fastapi import Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from conftest import client
+from flashcards_server.app import app
+from flashcards_server.database import (
+    Base,
+    create_sqlite_engines,
+    get_async_session,
+    is_read_only,
+)
+
+
+def create_deck(auth_headers, name):
+    deck = {"name": name, "description": "a test deck", "algorithm": "random"}
+    return client.post("/decks/", headers=auth_headers, json=deck).json()
+
+
+def fact_values(auth_headers):
+    facts = client.get("/facts/?limit=500", headers=auth_headers).json()
+    return {fact["value"] for fact in facts}
+
+
+def test_batch_references_earlier_operations(auth_headers):
+    deck = create_deck(auth_headers, "deck")
+    response = client.post(
+        "/batch",
+        headers=auth_headers,
+        json=[
+            {
+                "id": "question",
+                "method": "post",
+                "path": "/facts/",
+                "body": {"value": "q", "format": "text"},
+            },
+            {
+                "id": "answer",
+                "method": "post",
+                "path": "/facts/",
+                "body": {"value": "a", "format": "text"},
+            },
+            {
+                "id": "card",
+                "method": "post",
+                "path": f"/decks/{deck['id']}/cards",
+                "body": {"question_id": "$question.id", "answer_id": "$answer.id"},
+            },
+            {"method": "get", "path": f"/decks/{deck['id']}/cards/$card.id"},
+        ],
+    )
+    assert response.status_code == 200
+    question, answer, card, read_card = response.json()
+    assert [result["status"] for result in response.json()] == [200] * 4
+    assert card["body"]["question"]["id"] == question["body"]["id"]
+    assert card["body"]["answer"]["id"] == answer["body"]["id"]
+    assert read_card["id"] is None
+    assert read_card["body"]["id"] == card["body"]["id"]
+
+
+def test_batch_is_one_transaction(auth_headers):
+    value = str(uuid.uuid4())
+    response = client.post(
+        "/batch",
+        headers=auth_headers,
+        json=[
+            {
+                "id": "fact",
+                "method": "post",
+                "path": "/facts/",
+                "body": {"value": value, "format": "text"},
+            },
+            {
+                "method": "post",
+                "path": f"/decks/{uuid.uuid4()}/cards",
+                "body": {"question_id": "$fact.id", "answer_id": "$fact.id"},
+            },
+        ],
+    )
+    assert response.status_code == 404
+    assert response.json()["detail"]["operation"] == 1
+    assert value not in fact_values(auth_headers)
+
+
+def test_batch_commits_nothing_studied_before_a_failure(auth_headers):
+    deck = create_deck(auth_headers, "deck")
+    value = str(uuid.uuid4())
+    response = client.post(
+        "/batch",
+        headers=auth_headers,
+        json=[
+            {
+                "id": "fact",
+                "method": "post",
+                "path": "/facts/",
+                "body": {"value": value, "format": "text"},
+            },
+            {
+                "id": "card",
+                "method": "post",
+                "path": f"/decks/{deck['id']}/cards",
+                "body": {"question_id": "$fact.id", "answer_id": "$fact.id"},
+            },
+            # The scheduler commits its changes: in a batch, this only flushes
+            {
+                "method": "post",
+                "path": f"/study/{deck['id']}/next",
+                "body": {"card_id": "$card.id", "result": "1"},
+            },
+            {"method": "get", "path": f"/decks/{uuid.uuid4()}"},
+        ],
+    )
+    assert response.status_code == 404
+    assert response.json()["detail"]["operation"] == 3
+    assert value not in fact_values(auth_headers)
+    assert client.get(f"/decks/{deck['id']}/cards", headers=auth_headers).json() == []
+
+
+def test_batch_with_a_single_writer(tmp_path):
+    writer, reader = create_sqlite_engines(
+        f"sqlite+aiosqlite:///{tmp_path}/wal.db", write_timeout=1
+    )
+    write_session_maker = sessionmaker(
+        writer, class_=AsyncSession, expire_on_commit=False
+    )
+    read_session_maker = sessionmaker(
+        reader, class_=AsyncSession, expire_on_commit=False
+    )
+
+    async def get_wal_session(request: Request):
+        session_maker = (
+            read_session_maker if is_read_only(request) else write_session_maker
+        )
+        async with session_maker() as session:
+            yield session
+
+    async def create_tables():
+        async with writer.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        await writer.dispose()
+
+    asyncio.run(create_tables())
+    app.dependency_overrides[get_async_session] = get_wal_session
+    try:
+        email = f"{uuid.uuid4()}@example.com"
+        client.post("/register", json={"email": email, "password": "password"})
+        token = client.post(
+            "/auth/jwt/login", data={"username": email, "password": "password"}
+        ).json()["access_token"]
+        # The request authenticates with the writer connection, and the batch needs it too
+        response = client.post(
+            "/batch",
+            headers={"Authorization": f"Bearer {token}"},
+            json=[
+                {
+                    "method": "post",
+                    "path": "/decks/",
+                    "body": {"name": "deck", "description": "", "algorithm": "random"},
+                }
+            ],
+        )
+        assert response.status_code == 200
+    finally:
+        del app.dependency_overrides[get_async_session]
+
+
+def test_batch_rejects_bad_operations(auth_headers):
+    def run(operation):
+        return client.post("/batch", headers=auth_headers, json=[operation])
+
+    # Not a route
+    assert run({"method": "get", "path": "/nothing"}).status_code == 404
+    # Needs more than the user and the session
+    assert run({"method": "get", "path": "/users/me"}).status_code == 400
+    # Gets a request of its own, without the headers of the batch
+    headers = {**auth_headers, "If-None-Match": "*"}
+    response = client.post(
+        "/batch", headers=headers, json=[{"method": "get", "path": "/decks"}]
+    )
+    assert [result["status"] for result in response.json()] == [200]
+    # Invalid body
+    response = run({"method": "post", "path": "/facts/", "body": {"value": "v"}})
+    assert response.status_code == 422
+    # Unknown reference
+    response = run({"method": "get", "path": "/facts/$missing.id"})
+    assert response.status_code == 400
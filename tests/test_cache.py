@@ -0,0 +1,56 @@
+from freezegun import freeze_time
+
+from flashcards_server.cache import TTLCache
+
+
+def test_get_missing_key():
+    cache = TTLCache(maxsize=10, ttl=10)
+    assert cache.get("missing") is None
+    assert cache.get("missing", default=False) is False
+
+
+def test_set_and_get():
+    cache = TTLCache(maxsize=10, ttl=10)
+    cache.set("key", False)
+    assert cache.get("key") is False
+
+
+def test_entries_expire():
+    cache = TTLCache(maxsize=10, ttl=10)
+    with freeze_time("2022-01-01 00:00:00", tick=False) as frozen_time:
+        cache.set("key", "value")
+        frozen_time.tick(9)
+        assert cache.get("key") == "value"
+        frozen_time.tick(2)
+        assert cache.get("key") is None
+        assert len(cache) == 0
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.set("first", 1)
+    cache.set("second", 2)
+    cache.get("first")
+    cache.set("third", 3)
+    assert cache.get("first") == 1
+    assert cache.get("second") is None
+    assert cache.get("third") == 3
+
+
+def test_pop():
+    cache = TTLCache(maxsize=10, ttl=10)
+    cache.set("key", "value")
+    cache.pop("key")
+    cache.pop("missing")
+    assert cache.get("key") is None
+
+
+def test_pop_where():
+    cache = TTLCache(maxsize=10, ttl=10)
+    cache.set(("user", "token 1"), 1)
+    cache.set(("user", "token 2"), 2)
+    cache.set(("other user", "token"), 3)
+    cache.pop_where(lambda key: key[0] == "user")
+    assert cache.get(("user", "token 1")) is None
+    assert cache.get(("user", "token 2")) is None
+    assert cache.get(("other user", "token")) == 3
@@ -0,0 +1,81 @@
+import asyncio
+import uuid
+
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from flashcards_server.card_states import CardState, load_card_states, split_state
+from flashcards_server.changelog import ChangeLog
+from flashcards_server.database import Base, Deck
+
+
+def test_split_state():
+    card_id = str(uuid.uuid4())
+    deck_entries, card_entries = split_state(
+        {"last_review": 1, card_id: {"model": [1]}}
+    )
+    assert deck_entries == {"last_review": 1}
+    assert card_entries == {card_id: {"model": [1]}}
+    assert split_state(None) == ({}, {})
+
+
+def test_card_states_are_written_one_by_one(tmp_path):
+    deck_id = uuid.uuid4()
+    first_card, second_card = str(uuid.uuid4()), str(uuid.uuid4())
+
+    async def card_states(session):
+        rows = await session.execute(select(CardState.c.key, CardState.c.state))
+        return dict(rows.all())
+
+    async def scenario():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/card_states.db")
+        session_maker = sessionmaker(
+            engine, class_=AsyncSession, expire_on_commit=False
+        )
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.execute(
+                insert(Deck.__table__).values(
+                    id=deck_id, name="deck", algorithm="random", parameters={}, state={}
+                )
+            )
+
+        # A whole new state is split at the flush
+        async with session_maker() as session:
+            deck = await session.get(Deck, deck_id)
+            await load_card_states(session, [deck])
+            deck.state = {"round": 1, first_card: {"seen": 1}, second_card: {"seen": 1}}
+            await session.commit()
+            assert deck.state[first_card] == {"seen": 1}
+            assert await card_states(session) == {
+                first_card: {"seen": 1},
+                second_card: {"seen": 1},
+            }
+            deck_row = await session.execute(select(Deck.__table__.c.state))
+            assert deck_row.scalar() == {"round": 1}
+
+        # Changes in place write only the changed entries, and are logged
+        async with session_maker() as session:
+            deck = await session.get(Deck, deck_id)
+            await load_card_states(session, [deck])
+            assert deck.state == {
+                "round": 1,
+                first_card: {"seen": 1},
+                second_card: {"seen": 1},
+            }
+            logged = (await session.execute(select(ChangeLog.c.entity_id))).all()
+            deck.state[first_card] = {"seen": 2}
+            del deck.state[second_card]
+            await session.commit()
+            assert await card_states(session) == {first_card: {"seen": 2}}
+            select_logged = select(ChangeLog.c.entity_id, ChangeLog.c.op)
+            already_logged = len(logged)
+            all_logged = (await session.execute(select_logged)).all()
+            assert all_logged[already_logged:] == [(deck_id, "update")]
+            deck_row = await session.execute(select(Deck.__table__.c.state))
+            assert deck_row.scalar() == {"round": 1}
+
+        await engine.dispose()
+
+    asyncio.run(scenario())
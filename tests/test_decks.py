@@ -0,0 +1,260 @@
+from conftest import client, count_queries
+
+
+def create_deck(auth_headers, name):
+    response = client.post(
+        "/decks/",
+        headers=auth_headers,
+        json={
+            "name": name,
+            "description": "a test deck",
+            "algorithm": "random",
+            "tags": [{"name": "test-tag"}],
+        },
+    )
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_get_my_decks(auth_headers):
+    deck = create_deck(auth_headers, "deck")
+
+    response = client.get("/decks", headers=auth_headers)
+    assert response.status_code == 200
+    assert [d["id"] for d in response.json()] == [deck["id"]]
+    assert [t["name"] for t in response.json()[0]["tags"]] == ["test-tag"]
+
+
+def test_get_my_decks_pagination(auth_headers):
+    for index in range(3):
+        create_deck(auth_headers, f"deck {index}")
+
+    response = client.get("/decks?offset=1&limit=1", headers=auth_headers)
+    assert response.status_code == 200
+    assert [d["name"] for d in response.json()] == ["deck 1"]
+
+
+def test_get_my_decks_query_count_is_constant(auth_headers):
+    create_deck(auth_headers, "first deck")
+    with count_queries() as one_deck_queries:
+        client.get("/decks", headers=auth_headers)
+
+    for index in range(5):
+        create_deck(auth_headers, f"deck {index}")
+    with count_queries() as many_decks_queries:
+        response = client.get("/decks", headers=auth_headers)
+
+    assert len(response.json()) == 6
+    assert len(many_decks_queries) == len(one_deck_queries)
+    # Authenticating the user, the version of the list, the decks and their
+    # tags, and the per-card entries of their states
+    assert len(many_decks_queries) <= 4
+
+
+def test_clone_deck_shares_facts(auth_headers):
+    deck = create_deck(auth_headers, "original")
+    question = client.post(
+        "/facts/", headers=auth_headers, json={"value": "question", "format": "text"}
+    ).json()
+    answer = client.post(
+        "/facts/", headers=auth_headers, json={"value": "answer", "format": "text"}
+    ).json()
+    client.post(
+        f"/decks/{deck['id']}/cards",
+        headers=auth_headers,
+        json={"question_id": question["id"], "answer_id": answer["id"]},
+    )
+
+    response = client.post(f"/decks/{deck['id']}/clone", headers=auth_headers)
+    assert response.status_code == 200
+    clone = response.json()
+    assert clone["id"] != deck["id"]
+    assert clone["name"] == deck["name"]
+    assert clone["state"] == {}
+    assert [t["name"] for t in clone["tags"]] == ["test-tag"]
+
+    cards = client.get(f"/decks/{clone['id']}/cards", headers=auth_headers).json()
+    assert [(c["question"]["id"], c["answer"]["id"]) for c in cards] == [
+        (question["id"], answer["id"])
+    ]
+
+
+def test_edit_fact_of_clone(auth_headers):
+    deck = create_deck(auth_headers, "original")
+    question = client.post(
+        "/facts/", headers=auth_headers, json={"value": "question", "format": "text"}
+    ).json()
+    answer = client.post(
+        "/facts/", headers=auth_headers, json={"value": "answer", "format": "text"}
+    ).json()
+    client.post(
+        f"/decks/{deck['id']}/cards",
+        headers=auth_headers,
+        json={"question_id": question["id"], "answer_id": answer["id"]},
+    )
+    clone = client.post(f"/decks/{deck['id']}/clone", headers=auth_headers).json()
+
+    response = client.patch(
+        f"/facts/{question['id']}?deck_id={clone['id']}",
+        headers=auth_headers,
+        json={"value": "edited question"},
+    )
+    assert response.status_code == 200
+    edited = response.json()
+    assert edited["id"] != question["id"]
+    assert edited["value"] == "edited question"
+
+    original_cards = client.get(
+        f"/decks/{deck['id']}/cards", headers=auth_headers
+    ).json()
+    assert [(c["question"]["id"], c["question"]["value"]) for c in original_cards] == [
+        (question["id"], "question")
+    ]
+    cloned_cards = client.get(
+        f"/decks/{clone['id']}/cards", headers=auth_headers
+    ).json()
+    assert [c["question"]["id"] for c in cloned_cards] == [edited["id"]]
+    assert [c["answer"]["id"] for c in cloned_cards] == [answer["id"]]
+
+
+def create_card(auth_headers, deck, question, answer, **card):
+    response = client.post(
+        f"/decks/{deck['id']}/cards",
+        headers=auth_headers,
+        json={"question_id": question["id"], "answer_id": answer["id"], **card},
+    )
+    assert response.status_code == 200
+    return response.json()
+
+
+def create_fact(auth_headers, value):
+    return client.post(
+        "/facts/", headers=auth_headers, json={"value": value, "format": "text"}
+    ).json()
+
+
+def test_clone_shared_deck(auth_headers, other_auth_headers):
+    deck = create_deck(auth_headers, "starter deck")
+    question, answer = create_fact(auth_headers, "q"), create_fact(auth_headers, "a")
+    create_card(auth_headers, deck, question, answer)
+
+    # Only decks shared by their owner can be cloned by others
+    clone_url = f"/decks/{deck['id']}/clone"
+    assert client.post(clone_url, headers=other_auth_headers).status_code == 404
+    shared_url = f"/decks/{deck['id']}/shared"
+    assert client.put(shared_url, headers=other_auth_headers).status_code == 404
+    assert client.put(shared_url, headers=auth_headers).status_code == 200
+    response = client.post(clone_url, headers=other_auth_headers)
+    assert response.status_code == 200
+    clone = response.json()
+    cards = client.get(f"/decks/{clone['id']}/cards", headers=other_auth_headers).json()
+    assert [c["question"]["id"] for c in cards] == [question["id"]]
+
+    assert client.delete(shared_url, headers=auth_headers).status_code == 200
+    assert client.post(clone_url, headers=other_auth_headers).status_code == 404
+
+
+def test_change_facts_of_shared_deck(auth_headers, other_auth_headers):
+    deck = create_deck(auth_headers, "starter deck")
+    question, answer = create_fact(auth_headers, "q"), create_fact(auth_headers, "a")
+    context = create_fact(auth_headers, "context")
+    create_card(
+        auth_headers, deck, question, answer, question_context_facts=[context["id"]]
+    )
+    client.put(f"/decks/{deck['id']}/shared", headers=auth_headers)
+    clone = client.post(f"/decks/{deck['id']}/clone", headers=other_auth_headers).json()
+
+    # Without the deck, there's no telling which cards to give a copy to
+    url = f"/facts/{question['id']}/tags/mine"
+    assert client.put(url, headers=other_auth_headers).status_code == 409
+    response = client.put(f"{url}?deck_id={clone['id']}", headers=other_auth_headers)
+    assert response.status_code == 200
+    tagged = response.json()
+    assert tagged["id"] != question["id"]
+    assert [tag["name"] for tag in tagged["tags"]] == ["mine"]
+    original = client.get(f"/facts/{question['id']}", headers=auth_headers).json()
+    assert original["tags"] == []
+
+    # Deleting a shared fact only takes it out of the contexts of the user's cards
+    url = f"/facts/{context['id']}"
+    assert client.delete(url, headers=other_auth_headers).status_code == 200
+    assert client.get(url, headers=auth_headers).status_code == 200
+    cloned_cards = client.get(f"/decks/{clone['id']}/cards", headers=other_auth_headers)
+    assert cloned_cards.json()[0]["question_context_facts"] == []
+    cards = client.get(f"/decks/{deck['id']}/cards", headers=auth_headers).json()
+    assert [fact["id"] for fact in cards[0]["question_context_facts"]] == [
+        context["id"]
+    ]
+    # Shown as the question of the cards of both
+    url = f"/facts/{answer['id']}"
+    assert client.delete(url, headers=other_auth_headers).status_code == 409
+
+
+def test_clone_deck_of_another_user(auth_headers):
+    response = client.post(
+        "/decks/00000000-0000-0000-0000-000000000000/clone", headers=auth_headers
+    )
+    assert response.status_code == 404
+
+
+def test_delete_deck(auth_headers):
+    deck = create_deck(auth_headers, "to delete")
+    kept_deck = create_deck(auth_headers, "to keep")
+
+    response = client.delete(f"/decks/{deck['id']}", headers=auth_headers)
+    assert response.status_code == 200
+
+    assert client.get(f"/decks/{deck['id']}", headers=auth_headers).status_code == 404
+    assert (
+        client.get(f"/decks/{deck['id']}/cards", headers=auth_headers).status_code
+        == 404
+    )
+    response = client.get("/decks", headers=auth_headers)
+    assert [d["id"] for d in response.json()] == [kept_deck["id"]]
+
+
+def test_get_my_decks_not_modified(auth_headers):
+    create_deck(auth_headers, "deck")
+    response = client.get("/decks", headers=auth_headers)
+    etag = response.headers["ETag"]
+
+    with count_queries() as queries:
+        response = client.get("/decks", headers={**auth_headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert not any("FROM decks" in query for query in queries)
+
+    create_deck(auth_headers, "another deck")
+    response = client.get("/decks", headers={**auth_headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert len(response.json()) == 2
+
+
+def test_get_cards_not_modified_until_a_fact_changes(auth_headers):
+    deck = create_deck(auth_headers, "deck")
+    question = client.post(
+        "/facts/", headers=auth_headers, json={"value": "question", "format": "text"}
+    ).json()
+    answer = client.post(
+        "/facts/", headers=auth_headers, json={"value": "answer", "format": "text"}
+    ).json()
+    client.post(
+        f"/decks/{deck['id']}/cards",
+        headers=auth_headers,
+        json={"question_id": question["id"], "answer_id": answer["id"]},
+    )
+    etag = client.get(f"/decks/{deck['id']}/cards", headers=auth_headers).headers[
+        "ETag"
+    ]
+
+    conditional_headers = {**auth_headers, "If-None-Match": etag}
+    response = client.get(f"/decks/{deck['id']}/cards", headers=conditional_headers)
+    assert response.status_code == 304
+
+    client.patch(
+        f"/facts/{question['id']}", headers=auth_headers, json={"value": "edited"}
+    )
+    response = client.get(f"/decks/{deck['id']}/cards", headers=conditional_headers)
+    assert response.status_code == 200
+    assert response.json()[0]["question"]["value"] == "edited"
@@ -0,0 +1,128 @@
+import asyncio
+import uuid
+from datetime import datetime
+
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from flashcards_server.changelog import log_changes
+from flashcards_server.database import Base, Card, Deck, Fact, Review
+from flashcards_server.events import RESYNC, Subscriber, event_hubs, replay_events
+
+
+def test_subscriber_queue_overflow_asks_for_resync():
+    async def scenario():
+        subscriber = Subscriber(
+            deck_id=uuid.uuid4(), user_id=uuid.uuid4(), queue_size=2
+        )
+        for seq in (1, 2, 3):
+            subscriber.put(
+                {"seq": seq, "entity": "card", "id": uuid.uuid4(), "op": "update"}
+            )
+        assert subscriber.queue.qsize() == 1
+        assert subscriber.queue.get_nowait() == {"seq": 3, "event": RESYNC}
+
+    asyncio.run(scenario())
+
+
+def test_deck_events(tmp_path):
+    user_id, other_user_id = uuid.uuid4(), uuid.uuid4()
+
+    async def next_events(subscriber, count):
+        events = [
+            await asyncio.wait_for(subscriber.queue.get(), 5) for _ in range(count)
+        ]
+        assert subscriber.queue.empty()
+        return [(e["entity"], e["id"], e["op"]) for e in events]
+
+    async def scenario():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/events.db")
+        session_maker = sessionmaker(
+            engine, class_=AsyncSession, expire_on_commit=False
+        )
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+        async with session_maker() as session:
+            deck = Deck(
+                name="deck", description="", algorithm="random", parameters={}, state={}
+            )
+            question = Fact(value="question", format="text")
+            answer = Fact(value="answer", format="text")
+            elsewhere = Fact(value="not in the deck", format="text")
+            session.add_all([deck, question, answer, elsewhere])
+            await session.flush()
+            card = Card(deck_id=deck.id, question_id=question.id, answer_id=answer.id)
+            session.add(card)
+            await session.commit()
+
+            subscriber = await event_hubs.subscribe(
+                session=session, deck_id=deck.id, user_id=user_id
+            )
+            try:
+                # Facts are found through the cards showing them
+                question.value = "new question"
+                elsewhere.value = "still not in the deck"
+                await session.commit()
+                assert await next_events(subscriber, 1) == [
+                    ("fact", question.id, "update")
+                ]
+
+                session.add(
+                    Review(card_id=card.id, result="1", datetime=datetime.utcnow())
+                )
+                await session.commit()
+                events = await next_events(subscriber, 1)
+                assert events[0][0] == "review"
+
+                # Changes seen by another user only
+                await log_changes(
+                    session,
+                    "deck",
+                    [deck.id],
+                    "delete",
+                    deck_id=deck.id,
+                    owner_id=other_user_id,
+                )
+                await session.commit()
+                await log_changes(
+                    session,
+                    "deck",
+                    [deck.id],
+                    "delete",
+                    deck_id=deck.id,
+                    owner_id=user_id,
+                )
+                await session.commit()
+                assert await next_events(subscriber, 1) == [("deck", deck.id, "delete")]
+
+                # Reconnecting clients get what they missed
+                replayed = await replay_events(
+                    session=session, deck_id=deck.id, user_id=user_id, since=0
+                )
+                assert [(e["entity"], e["op"]) for e in replayed] == [
+                    ("deck", "create"),
+                    ("fact", "create"),
+                    ("fact", "create"),
+                    ("card", "create"),
+                    ("fact", "update"),
+                    ("review", "create"),
+                    ("deck", "delete"),
+                ]
+                assert (
+                    await replay_events(
+                        session=session,
+                        deck_id=deck.id,
+                        user_id=user_id,
+                        since=0,
+                        limit=3,
+                    )
+                    is None
+                )
+            finally:
+                event_hubs.unsubscribe(session=session, subscriber=subscriber)
+        assert len(event_hubs) == 0
+        await event_hubs.close_all()
+        await engine.dispose()
+
+    asyncio.run(scenario())
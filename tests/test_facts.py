@@ -0,0 +1,23 @@
+import uuid
+
+from conftest import client
+from flashcards_server.versions import etag
+
+
+def test_get_fact_not_modified(auth_headers):
+    fact = client.post(
+        "/facts/", headers=auth_headers, json={"value": "question", "format": "text"}
+    ).json()
+    response = client.get(f"/facts/{fact['id']}", headers=auth_headers)
+    assert response.status_code == 200
+
+    headers = {**auth_headers, "If-None-Match": response.headers["ETag"]}
+    response = client.get(f"/facts/{fact['id']}", headers=headers)
+    assert response.status_code == 304
+
+
+def test_get_missing_fact_is_never_not_modified(auth_headers):
+    fact_id = uuid.uuid4()
+    headers = {**auth_headers, "If-None-Match": etag("fact", fact_id, 0)}
+    response = client.get(f"/facts/{fact_id}", headers=headers)
+    assert response.status_code == 404
@@ -0,0 +1,42 @@
+import asyncio
+
+from flashcards_server.database import Review, User
+from flashcards_server.utils.generate_dataset import DatasetGenerator, generate
+
+
+def generated_rows(monkeypatch, seed):
+    rows = {}
+
+    async def insert_batch(self, table, batch):
+        rows.setdefault(table.name, []).extend(batch)
+        return len(batch)
+
+    monkeypatch.setattr(DatasetGenerator, "_insert_batch", insert_batch)
+    asyncio.run(
+        generate(
+            users=3,
+            decks_per_user=2,
+            cards_per_deck=5,
+            huge_decks=1,
+            huge_deck_cards=20,
+            reviews=200,
+            tags=10,
+            related_share=0.5,
+            seed=seed,
+            batch_size=16,
+        )
+    )
+    # Password hashes are salted
+    for user in rows[User.__table__.name]:
+        del user["hashed_password"]
+    return rows
+
+
+def test_same_seed_gives_same_data(monkeypatch):
+    rows = generated_rows(monkeypatch, seed=42)
+    assert rows == generated_rows(monkeypatch, seed=42)
+    assert rows != generated_rows(monkeypatch, seed=43)
+
+    review_times = [review["datetime"] for review in rows[Review.__table__.name]]
+    assert len(review_times) == 200
+    assert max(review_times) < DatasetGenerator(seed=42, batch_size=16).now
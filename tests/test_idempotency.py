@@ -0,0 +1,172 @@
+import asyncio
+import json
+import uuid
+
+import pytest
+from fastapi import HTTPException, Request
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from conftest import client
+from flashcards_server.api.tags import TagRead
+from flashcards_server.database import Base, Tag, User, create_sqlite_engines
+from flashcards_server.idempotency import (
+    IdempotencyKey,
+    prune_idempotency_keys,
+    run_idempotently,
+)
+
+
+def make_request(key, body=b"{}"):
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    headers = [(b"idempotency-key", key.encode())] if key else []
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/tags",
+        "query_string": b"",
+        "headers": headers,
+    }
+    return Request(scope, receive)
+
+
+def test_run_idempotently(tmp_path):
+    user_id = uuid.uuid4()
+    runs = []
+
+    async def create_tag(session):
+        runs.append(session)
+        await asyncio.sleep(0.1)  # Long enough for the retries to come in meanwhile
+        tag = Tag(id=uuid.uuid4(), name=f"tag {len(runs)}")
+        session.add(tag)
+        await session.commit()
+        return tag
+
+    async def fail(session):
+        raise HTTPException(status_code=404, detail="Not found")
+
+    async def scenario():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/idempotency.db")
+        session_maker = sessionmaker(
+            engine, class_=AsyncSession, expire_on_commit=False
+        )
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+        async def send(key, run=create_tag, body=b"{}"):
+            async with session_maker() as session:
+                return await run_idempotently(
+                    request=make_request(key, body),
+                    session=session,
+                    user_id=user_id,
+                    run=run,
+                    schema=TagRead,
+                )
+
+        # Concurrent retries wait for the first request, and get its response
+        first, retry = await asyncio.gather(send("key"), send("key"))
+        assert len(runs) == 1
+        assert first.body == retry.body
+        assert retry.headers["Idempotent-Replayed"] == "true"
+        assert (await send("key")).body == first.body
+        assert len(runs) == 1
+
+        # Keys are for one request only
+        with pytest.raises(HTTPException) as error:
+            await send("key", body=b'{"other": "body"}')
+        assert error.value.status_code == 422
+
+        # Failed requests save nothing, and run again when retried
+        with pytest.raises(HTTPException):
+            await send("failing key", run=fail)
+        assert json.loads((await send("failing key")).body)["name"] == "tag 2"
+
+        # Without a key, every request runs
+        await send(None)
+        await send(None)
+        assert len(runs) == 4
+
+        async with session_maker() as session:
+            assert await session.scalar(select(func.count()).select_from(Tag)) == 4
+            await prune_idempotency_keys(session, ttl_hours=0)
+            assert (await session.execute(select(IdempotencyKey))).all() == []
+        await engine.dispose()
+
+    asyncio.run(scenario())
+
+
+def test_run_idempotently_with_a_single_writer(tmp_path):
+    async def create_tag(session):
+        tag = Tag(id=uuid.uuid4(), name="tag")
+        session.add(tag)
+        await session.commit()
+        return tag
+
+    async def scenario():
+        writer, reader = create_sqlite_engines(
+            f"sqlite+aiosqlite:///{tmp_path}/wal.db", write_timeout=1
+        )
+        session_maker = sessionmaker(
+            writer, class_=AsyncSession, expire_on_commit=False
+        )
+        async with writer.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+        async with session_maker() as session:
+            # Like authenticating the request: the session holds the writer connection
+            await session.execute(select(User))
+            response = await run_idempotently(
+                request=make_request("key"),
+                session=session,
+                user_id=uuid.uuid4(),
+                run=create_tag,
+                schema=TagRead,
+            )
+        assert json.loads(response.body)["name"] == "tag"
+        async with session_maker() as session:
+            assert await session.scalar(select(func.count()).select_from(Tag)) == 1
+        await writer.dispose()
+        await reader.dispose()
+
+    asyncio.run(scenario())
+
+
+def test_create_card_with_idempotency_key(auth_headers):
+    deck = client.post(
+        "/decks/",
+        headers=auth_headers,
+        json={"name": "deck", "description": "", "algorithm": "random"},
+    ).json()
+    question = client.post(
+        "/facts/", headers=auth_headers, json={"value": "question", "format": "text"}
+    ).json()
+    answer = client.post(
+        "/facts/", headers=auth_headers, json={"value": "answer", "format": "text"}
+    ).json()
+
+    card = {
+        "question_id": question["id"],
+        "answer_id": answer["id"],
+        "tags": [{"name": "idempotent"}],
+        "question_context_facts": [answer["id"]],
+    }
+    headers = {**auth_headers, "Idempotency-Key": str(uuid.uuid4())}
+    first = client.post(f"/decks/{deck['id']}/cards", headers=headers, json=card)
+    retry = client.post(f"/decks/{deck['id']}/cards", headers=headers, json=card)
+    assert first.status_code == retry.status_code == 200
+    assert first.json() == retry.json()
+    assert [tag["name"] for tag in first.json()["tags"]] == ["idempotent"]
+    assert [fact["id"] for fact in first.json()["question_context_facts"]] == [
+        answer["id"]
+    ]
+    cards = client.get(f"/decks/{deck['id']}/cards", headers=auth_headers).json()
+    assert [c["id"] for c in cards] == [first.json()["id"]]
+
+    other_card = {"question_id": answer["id"], "answer_id": question["id"]}
+    response = client.post(
+        f"/decks/{deck['id']}/cards", headers=headers, json=other_card
+    )
+    assert response.status_code == 422
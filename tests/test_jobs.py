@@ -0,0 +1,129 @@
+import asyncio
+import uuid
+from datetime import datetime
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from flashcards_server.database import async_session_maker
+from flashcards_server.jobs import (
+    CronTrigger,
+    IntervalTrigger,
+    Job,
+    JobScheduler,
+    on_every_database,
+)
+from flashcards_server.leases import JobLease
+from flashcards_server.metrics import JOB_DURATION, JOB_SKIPPED
+from flashcards_server.shards import ShardEngines, shard_path
+
+
+def test_interval_trigger_is_aligned_across_workers():
+    trigger = IntervalTrigger(600)
+    assert trigger.next_run(datetime(2022, 10, 1, 12, 3, 20)) == datetime(
+        2022, 10, 1, 12, 10
+    )
+    assert trigger.next_run(datetime(2022, 10, 1, 12, 10)) == datetime(
+        2022, 10, 1, 12, 20
+    )
+    assert trigger.previous_run(datetime(2022, 10, 1, 12, 3)) == datetime(
+        2022, 10, 1, 12, 0
+    )
+
+
+@pytest.mark.parametrize(
+    "expression, after, expected",
+    [
+        ("0 3 * * *", datetime(2022, 10, 1, 12, 0), datetime(2022, 10, 2, 3, 0)),
+        ("*/15 * * * *", datetime(2022, 10, 1, 12, 7), datetime(2022, 10, 1, 12, 15)),
+        # Sunday
+        ("30 4 * * 0", datetime(2022, 10, 1, 12, 0), datetime(2022, 10, 2, 4, 30)),
+        ("0 0 1 1-3 *", datetime(2022, 10, 1, 12, 0), datetime(2023, 1, 1, 0, 0)),
+        # Or Friday
+        ("0 9 13 * 5", datetime(2022, 10, 1, 12, 0), datetime(2022, 10, 7, 9, 0)),
+    ],
+)
+def test_cron_trigger(expression, after, expected):
+    assert CronTrigger(expression).next_run(after) == expected
+
+
+@pytest.mark.parametrize("expression", ["* * * *", "60 * * * *", "0 0 31 2 *"])
+def test_cron_trigger_rejects_bad_expressions(expression):
+    with pytest.raises(ValueError):
+        CronTrigger(expression).next_run(datetime(2022, 10, 1))
+
+
+def lease_sessions(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/leases.db")
+    return engine, sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+
+def test_each_run_of_an_exclusive_job_happens_once(tmp_path):
+    runs = []
+
+    async def scenario():
+        engine, session_maker = lease_sessions(tmp_path)
+        async with engine.begin() as conn:
+            await conn.run_sync(JobLease.create)
+
+        async def count_run():
+            runs.append(1)
+
+        job = Job(name="count", func=count_run, trigger=IntervalTrigger(60), timeout=1)
+        workers = [JobScheduler(session_maker) for _ in range(3)]
+        for run_at in (datetime(2022, 10, 1, 12, 0), datetime(2022, 10, 1, 12, 1)):
+            tasks = [await worker.run(job, run_at) for worker in workers]
+            await asyncio.gather(*(task for task in tasks if task))
+        await engine.dispose()
+
+    skipped = JOB_SKIPPED.labels("count", "other_worker")._value.get()
+    asyncio.run(scenario())
+    assert len(runs) == 2
+    assert JOB_SKIPPED.labels("count", "other_worker")._value.get() == skipped + 4
+
+
+def test_runs_dont_overlap_and_time_out():
+    async def scenario():
+        async def slow():
+            await asyncio.sleep(10)
+
+        job = Job(
+            name="slow",
+            func=slow,
+            trigger=IntervalTrigger(60),
+            timeout=0.1,
+            exclusive=False,
+        )
+        scheduler = JobScheduler()
+        first = await scheduler.run(job, datetime(2022, 10, 1, 12, 0))
+        assert await scheduler.run(job, datetime(2022, 10, 1, 12, 1)) is None
+        await first
+
+    timeouts = JOB_DURATION.labels("slow", "timeout")._sum.get()
+    asyncio.run(scenario())
+    assert JOB_SKIPPED.labels("slow", "overlap")._value.get() >= 1
+    assert JOB_DURATION.labels("slow", "timeout")._sum.get() > timeouts
+
+
+def test_jobs_run_on_every_shard(tmp_path):
+    user_ids = [uuid.uuid4() for _ in range(2)]
+    databases = []
+
+    async def record_database(session_maker):
+        databases.append(session_maker)
+
+    async def scenario():
+        shards = ShardEngines(directory=str(tmp_path), max_open=1)
+        for user_id in user_ids:
+            async with shards.session(user_id):
+                pass
+        (tmp_path / "not a shard.db").touch()
+        await on_every_database(record_database, shards)()
+        await shards.close_all()
+
+    asyncio.run(scenario())
+    assert databases[0] is async_session_maker
+    assert sorted(
+        str(maker.kw["bind"].url.database) for maker in databases[1:]
+    ) == sorted(str(shard_path(user_id, str(tmp_path))) for user_id in user_ids)
@@ -0,0 +1,64 @@
+import asyncio
+import uuid
+
+from sqlalchemy import event, insert
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from flashcards_server.database import Base, Tag
+from flashcards_server.loaders import loader
+
+
+def test_loader_batches_and_remembers_lookups(tmp_path):
+    tag_ids = [uuid.uuid4() for _ in range(3)]
+
+    async def scenario():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/loaders.db")
+        session_maker = sessionmaker(
+            engine, class_=AsyncSession, expire_on_commit=False
+        )
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            rows = [
+                {"id": tag_id, "name": f"tag {index}"}
+                for index, tag_id in enumerate(tag_ids)
+            ]
+            await conn.execute(insert(Tag.__table__), rows)
+
+        statements = []
+        event.listen(
+            engine.sync_engine,
+            "before_cursor_execute",
+            lambda conn, cursor, statement, *args: statements.append(statement),
+        )
+        async with session_maker() as session:
+            tags = loader(session, Tag)
+            # Requested together, loaded together, missing ones included
+            missing_id = uuid.uuid4()
+            found = await asyncio.gather(
+                tags.load(tag_ids[0]), tags.load_many(tag_ids[1:] + [missing_id])
+            )
+            assert [found[0].name] + [tag and tag.name for tag in found[1]] == [
+                "tag 0",
+                "tag 1",
+                "tag 2",
+                None,
+            ]
+            assert len(statements) == 1
+
+            # Remembered, by a loader of the same model and column
+            assert (await loader(session, Tag).load(str(tag_ids[2]))).name == "tag 2"
+            assert await tags.load(missing_id) is None
+            assert await tags.load("not an ID") is None
+            assert len(statements) == 1
+
+            # Until an object is created, changed or deleted
+            by_name = loader(session, Tag, Tag.name)
+            assert await by_name.load("new tag") is None
+            session.add(Tag(id=uuid.uuid4(), name="new tag"))
+            await session.flush()
+            assert (await by_name.load("new tag")).name == "new tag"
+
+        await engine.dispose()
+
+    asyncio.run(scenario())
@@ -0,0 +1,18 @@
+from conftest import client
+
+
+def test_metrics_are_labelled_by_route_template(auth_headers):
+    client.get("/decks/00000000-0000-0000-0000-000000000000", headers=auth_headers)
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert (
+        'flashcards_request_duration_seconds_count{method="GET",route="/decks/{deck_id}",'
+        'status="404"}'
+    ) in response.text
+    assert (
+        'flashcards_request_sql_statements_count{method="GET",route="/decks/{deck_id}"}'
+        in (response.text)
+    )
+    assert "00000000-0000-0000-0000-000000000000" not in response.text
@@ -0,0 +1,23 @@
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.runtime.migration import MigrationContext
+from sqlalchemy import create_engine
+
+from flashcards_server.database import Base
+from flashcards_server.utils.migrate import alembic_config
+
+
+def test_migrations_create_the_schema_of_the_models(tmp_path):
+    config = alembic_config(f"sqlite+aiosqlite:///{tmp_path}/migrated.db")
+    engine = create_engine(f"sqlite:///{tmp_path}/migrated.db")
+
+    command.upgrade(config, "head")
+    with engine.connect() as conn:
+        assert compare_metadata(MigrationContext.configure(conn), Base.metadata) == []
+
+    # And back, and again
+    command.downgrade(config, "base")
+    command.upgrade(config, "head")
+    with engine.connect() as conn:
+        assert compare_metadata(MigrationContext.configure(conn), Base.metadata) == []
+    engine.dispose()
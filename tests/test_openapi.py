@@ -0,0 +1,59 @@
+import json
+import os
+
+import pytest
+
+from conftest import client
+from flashcards_server.app import app
+from flashcards_server.constants import OPENAPI_PATH
+from flashcards_server.utils.openapi import build_openapi, load_openapi, openapi_drift
+
+
+@pytest.fixture
+def schema_file(tmp_path):
+    path = tmp_path / "openapi.json"
+    path.write_text(json.dumps(build_openapi(app)))
+    return str(path)
+
+
+@pytest.fixture
+def fresh_app():
+    cached = app.openapi_schema
+    app.openapi_schema = None
+    yield app
+    app.openapi_schema = cached
+
+
+def test_openapi_is_served_from_the_generated_file(schema_file, fresh_app):
+    with open(schema_file, "w") as fd:
+        json.dump(
+            {"openapi": "3.0.2", "info": {"title": "from the file"}, "paths": {}}, fd
+        )
+
+    assert load_openapi(fresh_app, schema_file)["info"]["title"] == "from the file"
+    response = client.get("/openapi.json")
+    assert response.status_code == 200
+    assert response.json()["info"]["title"] == "from the file"
+
+
+def test_openapi_is_generated_without_file(tmp_path, fresh_app):
+    schema = load_openapi(fresh_app, str(tmp_path / "missing.json"))
+    assert "/decks/{deck_id}" in schema["paths"]
+
+
+def test_openapi_drift_is_detected(schema_file):
+    assert openapi_drift(app, schema_file) is None
+
+    with open(schema_file) as fd:
+        schema = json.load(fd)
+    del schema["paths"]["/decks/{deck_id}"]
+    with open(schema_file, "w") as fd:
+        json.dump(schema, fd)
+    assert "/decks/{deck_id}" in openapi_drift(app, schema_file)
+
+
+@pytest.mark.skipif(
+    not os.path.exists(OPENAPI_PATH), reason="no generated OpenAPI schema"
+)
+def test_generated_openapi_is_up_to_date():
+    assert openapi_drift(app) is None, "run `flashcards-openapi`"
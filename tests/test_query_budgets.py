@@ -0,0 +1,91 @@
+"""
+Query budgets of the list endpoints: each one must send a bounded number of
+SQL statements, whatever the number of rows it returns.
+"""
+import uuid
+
+from conftest import client, query_budget
+
+
+ROWS = 10
+
+
+def create_deck(auth_headers):
+    deck = {"name": "deck", "description": "a test deck", "algorithm": "random"}
+    return client.post("/decks/", headers=auth_headers, json=deck).json()
+
+
+def create_fact(auth_headers, value, tag="budget"):
+    fact = {"value": value, "format": "text", "tags": [{"name": tag}]}
+    return client.post("/facts/", headers=auth_headers, json=fact).json()
+
+
+def create_cards(auth_headers, deck, count):
+    for index in range(count):
+        question = create_fact(auth_headers, f"question {index}")
+        answer = create_fact(auth_headers, f"answer {index}")
+        client.post(
+            f"/decks/{deck['id']}/cards",
+            headers=auth_headers,
+            json={"question_id": question["id"], "answer_id": answer["id"]},
+        )
+
+
+def test_get_my_decks_budget(auth_headers):
+    for _ in range(ROWS):
+        create_deck(auth_headers)
+
+    with query_budget(max_queries=4):
+        response = client.get("/decks", headers=auth_headers)
+    assert len(response.json()) == ROWS
+
+
+def test_get_cards_budget(auth_headers):
+    deck = create_deck(auth_headers)
+    create_cards(auth_headers, deck, ROWS)
+
+    # The tags of the question and answer facts are loaded with the same
+    # statement, once for each
+    with query_budget(max_queries=12, max_repeats=2):
+        response = client.get(f"/decks/{deck['id']}/cards", headers=auth_headers)
+    assert len(response.json()) == ROWS
+
+
+def test_get_facts_budget(auth_headers):
+    for index in range(ROWS):
+        create_fact(auth_headers, f"fact {index}")
+
+    with query_budget(max_queries=6):
+        response = client.get(f"/facts/?limit={ROWS}", headers=auth_headers)
+    assert len(response.json()) == ROWS
+
+
+def test_get_facts_by_tag_budget(auth_headers):
+    tag = str(uuid.uuid4())
+    for index in range(ROWS):
+        create_fact(auth_headers, f"fact {index}", tag=tag)
+
+    with query_budget(max_queries=6):
+        response = client.get(f"/facts/tag/{tag}", headers=auth_headers)
+    assert len(response.json()) == ROWS
+
+
+def test_get_tags_budget(auth_headers):
+    names = {f"budget tag {uuid.uuid4()}" for _ in range(ROWS)}
+    for name in names:
+        client.post("/tags/", headers=auth_headers, json={"name": name})
+
+    with query_budget(max_queries=3):
+        response = client.get("/tags/", headers=auth_headers)
+    assert names <= {tag["name"] for tag in response.json()}
+
+
+def test_sync_budget(auth_headers):
+    deck = create_deck(auth_headers)
+    create_cards(auth_headers, deck, ROWS)
+
+    # The tags of the questions, the answers and the synced facts are loaded
+    # with the same statement, once for each
+    with query_budget(max_queries=18, max_repeats=3):
+        response = client.get("/sync", headers=auth_headers)
+    assert response.status_code == 200
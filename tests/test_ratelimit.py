@@ -0,0 +1,91 @@
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from flashcards_server.ratelimit import (
+    AdmissionControlMiddleware,
+    ConcurrencyLimiter,
+    RateLimiter,
+    TokenBucket,
+    is_event_stream,
+    route_class,
+)
+
+
+def test_token_bucket_allows_bursts():
+    bucket = TokenBucket(rate=1, capacity=3, now=0)
+    assert [bucket.take(now=0) for _ in range(3)] == [0, 0, 0]
+    assert bucket.take(now=0) == 1
+
+
+def test_token_bucket_refills():
+    bucket = TokenBucket(rate=2, capacity=1, now=0)
+    assert bucket.take(now=0) == 0
+    assert bucket.take(now=0.25) == 0.25
+    assert bucket.take(now=0.5) == 0
+
+
+def test_rate_limiter_buckets_are_per_client_and_route_class():
+    limiter = RateLimiter(limits={"read": (1, 1), "write": (1, 1)}, max_buckets=10)
+    assert limiter.take("client", "read") == 0
+    assert limiter.take("client", "read") > 0
+    assert limiter.take("client", "write") == 0
+    assert limiter.take("other client", "read") == 0
+
+
+def test_rate_limiter_forgets_least_recently_used_buckets():
+    limiter = RateLimiter(limits={"read": (1, 1)}, max_buckets=1)
+    assert limiter.take("client", "read") == 0
+    assert limiter.take("other client", "read") == 0
+    assert limiter.take("client", "read") == 0
+
+
+def test_route_class():
+    assert route_class("GET", "/study/deck/start") == "study"
+    assert route_class("POST", "/study/deck/next") == "study"
+    assert route_class("GET", "/decks") == "read"
+    assert route_class("POST", "/decks/") == "write"
+
+
+def test_is_event_stream():
+    assert is_event_stream("GET", "/decks/deck/events")
+    assert not is_event_stream("GET", "/decks/deck")
+    assert not is_event_stream("POST", "/decks/deck/events")
+
+
+def test_concurrency_limiter_rejects_when_queue_is_full():
+    async def scenario():
+        limiter = ConcurrencyLimiter(max_concurrent=1, max_queued=1, timeout=0.1)
+        assert await limiter.acquire()
+        waiting = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        assert not await limiter.acquire()  # Queue is full
+        assert not await waiting  # Timed out
+        limiter.release()
+        assert await limiter.acquire()
+
+    asyncio.run(scenario())
+
+
+def make_client(rate_limiter):
+    app = FastAPI()
+
+    @app.get("/decks")
+    async def decks():
+        return []
+
+    app.add_middleware(
+        AdmissionControlMiddleware,
+        rate_limiter=rate_limiter,
+        concurrency_limiter=ConcurrencyLimiter(
+            max_concurrent=10, max_queued=10, timeout=1
+        ),
+    )
+    return TestClient(app)
+
+
+def test_middleware_rejects_clients_over_their_limit():
+    client = make_client(RateLimiter(limits={"read": (0.1, 2)}, max_buckets=10))
+    assert [client.get("/decks").status_code for _ in range(3)] == [200, 200, 429]
+    assert client.get("/decks").headers["Retry-After"] == "10"
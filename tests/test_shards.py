@@ -0,0 +1,50 @@
+import asyncio
+import uuid
+
+from sqlalchemy import select, text
+
+from flashcards_server.database import Tag
+from flashcards_server.shards import ShardEngines, shard_path
+
+
+def test_shard_engines_lru_and_idle(tmp_path):
+    users = [uuid.uuid4() for _ in range(3)]
+
+    async def scenario():
+        shards = ShardEngines(directory=str(tmp_path), max_open=2, idle_seconds=60)
+
+        # New shards are created at the latest migration
+        async with shards.session(users[0]) as session:
+            session.add(Tag(id=uuid.uuid4(), name="first user's tag"))
+            await session.commit()
+            revision = await session.scalar(
+                text("SELECT version_num FROM alembic_version")
+            )
+            assert revision is not None
+        assert shard_path(users[0], str(tmp_path)).exists()
+
+        # Each user sees their own data only
+        async with shards.session(users[1]) as session:
+            assert (await session.scalars(select(Tag))).all() == []
+
+        # The least recently used shard is closed, unless it's in use
+        async with shards.session(users[0]):
+            async with shards.session(users[2]):
+                assert len(shards) == 2
+            async with shards.session(users[1]):
+                assert len(shards) == 2
+                # All the others are in use: over the limit for now
+                async with shards.session(users[2]):
+                    assert len(shards) == 3
+
+        # Idle shards are closed, and open again when needed
+        shards.idle_seconds = 0
+        await shards.close_idle()
+        assert len(shards) == 0
+        async with shards.session(users[0]) as session:
+            assert [tag.name for tag in await session.scalars(select(Tag))] == [
+                "first user's tag"
+            ]
+        await shards.close_all()
+
+    asyncio.run(scenario())
@@ -0,0 +1,95 @@
+import asyncio
+import json
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from conftest import client
+from flashcards_server.changelog import ChangeLog
+from flashcards_server.database import Base, Fact
+
+
+def sync(auth_headers, since=0):
+    response = client.get(f"/sync?since={since}", headers=auth_headers)
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    return lines[:-1], lines[-1]["cursor"]
+
+
+def create_deck(auth_headers, name):
+    deck = {"name": name, "description": "a test deck", "algorithm": "random"}
+    return client.post("/decks/", headers=auth_headers, json=deck).json()
+
+
+def test_sync_returns_only_what_changed(auth_headers):
+    deck = create_deck(auth_headers, "deck")
+    _, cursor = sync(auth_headers)
+
+    client.patch(f"/decks/{deck['id']}", headers=auth_headers, json={"name": "renamed"})
+    client.patch(
+        f"/decks/{deck['id']}", headers=auth_headers, json={"name": "renamed again"}
+    )
+    other_deck = create_deck(auth_headers, "other deck")
+
+    changes, new_cursor = sync(auth_headers, since=cursor)
+    assert new_cursor > cursor
+    assert [(c["entity"], c["id"], c["op"]) for c in changes] == [
+        ("deck", deck["id"], "upsert"),
+        ("deck", other_deck["id"], "upsert"),
+    ]
+    assert changes[0]["data"]["name"] == "renamed again"
+
+    changes, _ = sync(auth_headers, since=new_cursor)
+    assert changes == []
+
+
+def test_sync_deleted_deck(auth_headers):
+    deck = create_deck(auth_headers, "deck")
+    _, cursor = sync(auth_headers)
+
+    client.delete(f"/decks/{deck['id']}", headers=auth_headers)
+
+    changes, _ = sync(auth_headers, since=cursor)
+    assert [(c["entity"], c["id"], c["op"]) for c in changes] == [
+        ("deck", deck["id"], "delete")
+    ]
+
+
+def test_sync_skips_objects_created_and_deleted_since_the_cursor(auth_headers):
+    _, cursor = sync(auth_headers)
+    deck = create_deck(auth_headers, "short lived")
+    client.delete(f"/decks/{deck['id']}", headers=auth_headers)
+
+    changes, _ = sync(auth_headers, since=cursor)
+    assert [c for c in changes if c["id"] == deck["id"]] == []
+
+
+def test_changes_are_logged_when_committing(tmp_path):
+    async def logged(session):
+        return (await session.execute(select(ChangeLog.c.entity, ChangeLog.c.op))).all()
+
+    async def scenario():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/sync.db")
+        session_maker = sessionmaker(
+            engine, class_=AsyncSession, expire_on_commit=False
+        )
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+        async with session_maker() as session:
+            session.add(Fact(value="rolled back", format="text"))
+            await session.flush()
+            await session.rollback()
+
+            fact = Fact(value="question", format="text")
+            session.add(fact)
+            await session.flush()
+            # Sequence numbers are taken at commit time, in the order of the commits
+            assert await logged(session) == []
+            fact.value = "edited question"
+            await session.commit()
+            assert await logged(session) == [("fact", "create"), ("fact", "update")]
+        await engine.dispose()
+
+    asyncio.run(scenario())
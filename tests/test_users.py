@@ -0,0 +1,89 @@
+import asyncio
+import threading
+import uuid
+
+from fastapi_users.password import PasswordHelper
+from sqlalchemy import inspect
+
+from conftest import client, count_queries
+from flashcards_server.database import User
+from flashcards_server.users import UserManager, get_jwt_strategy, user_cache
+
+
+def test_authenticated_user_is_cached(auth_headers):
+    client.get("/users/me", headers=auth_headers)
+
+    with count_queries() as queries:
+        response = client.get("/users/me", headers=auth_headers)
+
+    assert response.status_code == 200
+    assert queries == []
+
+
+def test_user_cache_shares_no_instance(auth_headers):
+    strategy = get_jwt_strategy()
+    token = auth_headers["Authorization"].split()[1]
+    client.get("/users/me", headers=auth_headers)
+
+    first = asyncio.run(strategy.read_token(token, user_manager=None))
+    second = asyncio.run(strategy.read_token(token, user_manager=None))
+    assert first is not second
+    assert first.id == second.id
+    # Detached: a session adding it updates the user instead of inserting it
+    assert inspect(first).detached and inspect(first).key is not None
+    assert not isinstance(user_cache.get((str(first.id), token)), User)
+
+
+def test_user_update_is_visible_immediately(auth_headers):
+    client.get("/users/me", headers=auth_headers)
+    new_email = f"{uuid.uuid4()}@example.com"
+
+    response = client.patch(
+        "/users/me", headers=auth_headers, json={"email": new_email}
+    )
+    assert response.status_code == 200
+
+    response = client.get("/users/me", headers=auth_headers)
+    assert response.json()["email"] == new_email
+
+
+def test_reset_password_hashes_in_the_pool(monkeypatch):
+    hashing_threads = []
+    tokens = []
+
+    def record_thread(method):
+        def recorded(*args, **kwargs):
+            hashing_threads.append(threading.current_thread().name)
+            return method(*args, **kwargs)
+
+        return recorded
+
+    async def on_after_forgot_password(self, user, token, request=None):
+        tokens.append(token)
+
+    monkeypatch.setattr(PasswordHelper, "hash", record_thread(PasswordHelper.hash))
+    monkeypatch.setattr(
+        PasswordHelper,
+        "verify_and_update",
+        record_thread(PasswordHelper.verify_and_update),
+    )
+    monkeypatch.setattr(
+        UserManager, "on_after_forgot_password", on_after_forgot_password
+    )
+
+    with client:
+        email = f"{uuid.uuid4()}@example.com"
+        client.post("/register", json={"email": email, "password": "password"})
+        response = client.post("/forgot-password", json={"email": email})
+        assert response.status_code == 202
+        response = client.post(
+            "/reset-password", json={"token": tokens[0], "password": "new password"}
+        )
+        assert response.status_code == 200
+        response = client.post(
+            "/auth/jwt/login", data={"username": email, "password": "new password"}
+        )
+        assert response.status_code == 200
+
+    assert hashing_threads
+    assert all(name.startswith("password-hashing") for name in hashing_threads)
@@ -0,0 +1,64 @@
+import asyncio
+import uuid
+
+from sqlalchemy import event, insert
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from flashcards_server.database import Base, Deck, DeckOwner, User
+from flashcards_server.versions import get_version
+
+
+def test_versions_are_bumped_only_for_tracked_changes(tmp_path):
+    user_id, deck_id = uuid.uuid4(), uuid.uuid4()
+
+    async def scenario():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/versions.db")
+        session_maker = sessionmaker(
+            engine, class_=AsyncSession, expire_on_commit=False
+        )
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.execute(
+                insert(User.__table__).values(
+                    id=user_id, email="user@example.com", hashed_password="-"
+                )
+            )
+            await conn.execute(
+                insert(Deck.__table__).values(
+                    id=deck_id, name="deck", algorithm="random", parameters={}, state={}
+                )
+            )
+            await conn.execute(
+                insert(DeckOwner).values(owner_id=user_id, deck_id=deck_id)
+            )
+
+        statements = []
+        event.listen(
+            engine.sync_engine,
+            "before_cursor_execute",
+            lambda conn, cursor, statement, *args: statements.append(statement),
+        )
+
+        # Users aren't shown by the conditional endpoints: only the update
+        async with session_maker() as session:
+            user = await session.get(User, user_id)
+            statements.clear()
+            user.is_verified = True
+            await session.flush()
+            assert len(statements) == 1 and statements[0].startswith("UPDATE users")
+            await session.commit()
+
+        # A renamed deck: its owner is looked up once, after the flush
+        async with session_maker() as session:
+            deck = await session.get(Deck, deck_id)
+            statements.clear()
+            deck.name = "renamed"
+            await session.flush()
+            assert len([s for s in statements if "deck_owners" in s]) == 1
+            await session.commit()
+            assert await get_version(session, "decks", user_id) == 1
+
+        await engine.dispose()
+
+    asyncio.run(scenario())